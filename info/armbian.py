@@ -7,7 +7,7 @@ import rich.repr
 
 from distro import DistroBaseInfo
 from distro_arch import DistroBaseArchInfo
-from utils import setup_logging, GitHubReleaseReleaseAssets
+from utils import setup_logging, GitHubReleaseReleaseAssets, gh_asset_digest
 
 log: logging.Logger = setup_logging("armbian")
 
@@ -38,7 +38,7 @@ class Armbian(DistroBaseInfo):
         )
 
     def set_version_from_arch_versions(self, arch_versions: set[string]) -> string:
-        self.version = "-".join(arch_versions)  # just join all distinct versions, hopefully there is only one
+        self.version = "-".join(sorted(arch_versions))  # just join all distinct versions, hopefully there is only one
         if self.extra_release is None or self.extra_release == "":
             self.oci_tag_version = self.release + "-" + self.branch + "-" + self.version
             self.oci_tag_latest = self.release + "-" + self.branch + "-latest"
@@ -83,42 +83,27 @@ class ArmbianArchInfo(DistroBaseArchInfo):
         self.gh_release_version = None
         self.gh_asset_filename = None
         self.gh_asset_dl_url = None
+        self.qcow2_upstream_digest = None
         if self.distro.extra_release is None or self.distro.extra_release == "":
-            searched_variant_token = f"-{self.distro.variant}.img"
+            searched_variant_tail = self.distro.variant
         else:
-            searched_variant_token = f"-{self.distro.variant}-{self.distro.extra_release}.img"
-
-        searched_slugh_release_branch_tokens = f"{self.slug}_{self.distro.release}_{self.distro.branch}"
+            searched_variant_tail = f"{self.distro.variant}-{self.distro.extra_release}"
 
         ghra = GitHubReleaseReleaseAssets(
             github_org_repo="armsurvivors/armbian-release", release_tag=None
         )  # fetch latest release's assets
         release_info_assets = ghra.get_release_assets()
-        repo_release_assets = release_info_assets["assets"]
         repo_release = release_info_assets["repo_release"]
 
-        log.debug(f"repo_release_assets: {repo_release_assets}")
-        for repo_release_asset in repo_release_assets:
-            asset_fn = repo_release_asset.name
-            asset_dl_url = repo_release_asset.browser_download_url
-            if not asset_fn.endswith(".qcow2.xz"):
-                continue
-            log.debug(f"Trying repo_release_asset '{asset_fn}' ")
-            if searched_variant_token not in asset_fn:
-                log.debug(
-                    f"Skipping repo_release_asset '{asset_fn}' because it does not contain '{searched_variant_token}'"
-                )
-                continue
-            if searched_slugh_release_branch_tokens not in asset_fn:
-                log.debug(
-                    f"Skipping repo_release_asset '{asset_fn}' because it does not contain '{searched_slugh_release_branch_tokens}'"
-                )
-                continue
-            # If we got this far, we've the correct qcow2.xz asset.
-            log.info(f"Found! repo_release_asset '{asset_fn}' ")
-            self.gh_asset_filename = asset_fn
-            self.gh_asset_dl_url = asset_dl_url
+        # "..._<slug>_<release>_<branch>_<kernel>-<variant>[-<extra_release>].img.qcow2.xz"
+        searched_fields = (self.slug, self.distro.release, self.distro.branch)
+        repo_release_asset = repo_release.catalog.find_one(".img.qcow2.xz", searched_fields, searched_variant_tail)
+        if repo_release_asset is not None:
+            log.info(f"Found! repo_release_asset '{repo_release_asset.name}' ")
+            self.gh_asset_filename = repo_release_asset.name
+            self.gh_asset_dl_url = repo_release_asset.browser_download_url
             self.gh_release_version = repo_release.tag_name
+            self.qcow2_upstream_digest = gh_asset_digest(repo_release_asset)
 
         if self.gh_release_version is None:
             raise Exception(f"Could not find valid release for {self.slug}")
@@ -0,0 +1,141 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("artifacts")
+
+
+def parse_size(value: str) -> int:
+    # "50G", "512M", "1T" or plain bytes
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = value.strip().upper().removesuffix("B").removesuffix("I")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for downloaded images, keyed by the sha256 of their (decompressed) contents.
+
+    Layout under root:
+      sha256/<hex>  the blobs; workspace files are hardlinks to these
+      index.json    source key (upstream digest, or URL if upstream publishes none) -> sha256, plus LRU info
+      index.lock    flock()ed around every index read-modify-write, so concurrent runs can share one store
+    """
+
+    root: str
+    budget_bytes: int
+
+    def __init__(self, root: str, budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.blob_dir = os.path.join(root, "sha256")
+        self.index_filename = os.path.join(root, "index.json")
+        self.lock_filename = os.path.join(root, "index.lock")
+        self.thread_lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256)
+
+    @contextmanager
+    def _locked_index(self):
+        with self.thread_lock, open(self.lock_filename, "a") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            try:
+                index = {"sources": {}, "blobs": {}}
+                if os.path.exists(self.index_filename):
+                    with open(self.index_filename) as fh:
+                        index = json.load(fh)
+                yield index
+                with open(f"{self.index_filename}.tmp", "w") as fh:
+                    json.dump(index, fh, indent=1, sort_keys=True)
+                os.replace(f"{self.index_filename}.tmp", self.index_filename)
+            finally:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+    def materialize(self, source_key: str, dest_filename: str) -> bool:
+        """Hardlinks the blob for source_key to dest_filename (copying across filesystems); False on a miss."""
+        with self._locked_index() as index:
+            sha256 = index["sources"].get(source_key)
+            if sha256 is None or sha256 not in index["blobs"] or not os.path.exists(self.blob_path(sha256)):
+                log.info(f"Artifact store miss for {source_key}")
+                return False
+            blob = index["blobs"][sha256]
+            if os.path.getsize(self.blob_path(sha256)) != blob["size"]:
+                log.warning(f"Artifact store blob {sha256} has the wrong size, dropping it")
+                self._drop(index, sha256)
+                return False
+            blob["last_used"] = time.time()
+            self._link_or_copy(self.blob_path(sha256), dest_filename)
+        log.info(f"[green]Artifact store hit[/green] for {source_key}: {sha256} -> {dest_filename}")
+        return True
+
+    def ingest(self, filename: str, sha256: str, source_key: str):
+        """Adds an already-hashed file to the store under sha256 (by hardlink), then evicts down to the budget."""
+        with self._locked_index() as index:
+            if not os.path.exists(self.blob_path(sha256)):
+                self._link_or_copy(filename, self.blob_path(sha256))
+            index["blobs"][sha256] = {"size": os.path.getsize(filename), "last_used": time.time()}
+            index["sources"][source_key] = sha256
+            log.info(f"Artifact store: stored {filename} as {sha256} (source {source_key})")
+            self._evict(index, keep=sha256)
+
+    def _evict(self, index: dict, keep: str):
+        total = sum(blob["size"] for blob in index["blobs"].values())
+        lru = sorted(index["blobs"].items(), key=lambda item: item[1]["last_used"])
+        for sha256, blob in lru:
+            if total <= self.budget_bytes:
+                break
+            if sha256 == keep:
+                continue
+            log.info(f"Artifact store over budget ({total} > {self.budget_bytes} bytes), evicting {sha256}")
+            self._drop(index, sha256)
+            total -= blob["size"]
+
+    def _drop(self, index: dict, sha256: str):
+        index["blobs"].pop(sha256, None)
+        index["sources"] = {key: value for key, value in index["sources"].items() if value != sha256}
+        if os.path.exists(self.blob_path(sha256)):
+            os.unlink(self.blob_path(sha256))
+
+    @staticmethod
+    def _link_or_copy(src: str, dest: str):
+        if os.path.exists(dest):
+            os.unlink(dest)
+        try:
+            os.link(src, dest)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            log.warning(f"Cannot hardlink {src} to {dest} ({e.strerror}), copying instead")
+            shutil.copyfile(src, f"{dest}.tmp")
+            os.replace(f"{dest}.tmp", dest)
+
+
+singleton_store: ArtifactStore | None = None
+singleton_store_lock = threading.Lock()
+
+
+def artifact_store() -> ArtifactStore | None:
+    """The process-wide store, configured by ARTIFACT_STORE (dir, or "off") and ARTIFACT_STORE_BUDGET."""
+    global singleton_store
+    with singleton_store_lock:
+        if singleton_store is None:
+            root = os.environ.get("ARTIFACT_STORE", os.path.join("cache", "artifacts"))
+            if root == "off":
+                return None
+            budget = parse_size(os.environ.get("ARTIFACT_STORE_BUDGET", "40G"))
+            log.info(f"Using artifact store at {root} with a budget of {budget} bytes")
+            singleton_store = ArtifactStore(root, budget)
+        return singleton_store
@@ -0,0 +1,77 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+from collections import defaultdict
+
+# Longest first: the extension is the longest of these the asset name ends with.
+KNOWN_EXTENSIONS = sorted(
+    [".img.qcow2.xz", ".img.qcow2.gz", ".img.qcow2", ".qcow2.xz", ".qcow2.gz", ".qcow2", ".img.xz", ".img.gz", ".img"],
+    key=len,
+    reverse=True,
+)
+MAX_SPAN = 4  # longest run of "_"-separated fields a lookup can ask for
+
+
+class AmbiguousAsset(Exception):
+    pass
+
+
+class AssetCatalog:
+    """
+    Release assets indexed once by the structure of their filenames, for O(1) lookups by many arches/entries.
+
+    A name like "Armbian_25.2.0_uefi-arm64_bookworm_edge_6.12.1-metadata-serialconsole-cloud-k8s-1.28.img.qcow2.xz"
+    is split into its extension (".img.qcow2.xz") and "_"-separated fields. It is indexed under
+      - every run of up to MAX_SPAN consecutive fields, e.g. ("uefi-arm64", "bookworm", "edge"); the first field
+        of a run may also be any "-"-suffix of the actual one ("rocky-9" matches "fatso-rocky-9"), and
+      - every "-"-suffix of the last field ("metadata-serialconsole-cloud-k8s-1.28", ..., "k8s-1.28", "1.28"),
+    each together with the extension. That is what substring matching on "<board>_<release>_<branch>" and
+    "-<variant>.img" did, but anchored at field boundaries.
+    """
+
+    def __init__(self, assets: list):
+        self.assets = assets
+        self.by_fields: dict[tuple, list] = defaultdict(list)
+        self.by_tail: dict[tuple, list] = defaultdict(list)
+        for asset in assets:
+            name = asset.name
+            extension = next((ext for ext in KNOWN_EXTENSIONS if name.endswith(ext)), None)
+            if extension is None:
+                continue  # checksums, logs, torrents...
+            fields = name[: -len(extension)].split("_")
+            keys: set[tuple] = set()
+            for start in range(len(fields)):
+                for end in range(start + 1, min(start + MAX_SPAN, len(fields)) + 1):
+                    for first in self.dash_suffixes(fields[start]):
+                        keys.add((extension, False, first, *fields[start + 1 : end]))
+                        if end == len(fields):  # runs ending at the last field can also be asked for at_end
+                            keys.add((extension, True, first, *fields[start + 1 : end]))
+            for key in keys:
+                self.by_fields[key].append(asset)
+            for tail in self.dash_suffixes(fields[-1])[1:]:
+                self.by_tail[(extension, tail)].append(asset)
+
+    @staticmethod
+    def dash_suffixes(field: str) -> list[str]:
+        # "6.12.1-cloud-k8s" -> ["6.12.1-cloud-k8s", "cloud-k8s", "k8s"]
+        parts = field.split("-")
+        return ["-".join(parts[index:]) for index in range(len(parts))]
+
+    def find(self, extension: str, fields: tuple[str, ...], tail: str | None = None, at_end: bool = False) -> list:
+        """
+        All assets with these consecutive fields; at_end: the last of them is the name's last field
+        (right before the extension); tail: the name's last field ends in "-<tail>".
+        """
+        if len(fields) > MAX_SPAN:
+            raise Exception(f"Can look up at most {MAX_SPAN} consecutive fields, not {fields}")
+        found = self.by_fields.get((extension, at_end, *fields), [])
+        if tail is not None:
+            with_tail = {id(asset) for asset in self.by_tail.get((extension, tail), [])}
+            found = [asset for asset in found if id(asset) in with_tail]
+        return found
+
+    def find_one(self, extension: str, fields: tuple[str, ...], tail: str | None = None, at_end: bool = False):
+        """The single matching asset; None if there is none, AmbiguousAsset if there are several."""
+        found = self.find(extension, fields, tail, at_end)
+        if len(found) > 1:
+            names = sorted(asset.name for asset in found)
+            raise AmbiguousAsset(f"{len(found)} assets match {fields} with tail {tail!r} and {extension}: {names}")
+        return found[0] if found else None
@@ -0,0 +1,871 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+#
+# Offline end-to-end benchmark: python3 info/cli.py bench
+# Every distro is driven through resolve, download, build and push against local stand-ins: one HTTP server
+# (in its own process, so its CPU and memory are not counted) serves synthesized mirror trees and feeds,
+# a fake GitHub releases API with its assets, and a minimal OCI registry. Each distro runs in a fresh process
+# and workspace, its stages one after the other, so wall time, CPU time, peak RSS and bytes moved can be
+# attributed to each stage. Results are compared against a stored baseline.
+import email.utils
+import gzip
+import hashlib
+import http.server
+import json
+import logging
+import lzma
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import struct
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from armbian import Armbian
+from artifacts import parse_size
+from bench_hrefs import apache_listing
+from bench_hrefs import nginx_listing
+from debian import Debian
+from distro import DistroBaseInfo
+from fatso import Fatso
+from fedora import Fedora
+from feeds import FEDORA_CANONICAL_MIRROR
+from rocky import Rocky
+from tracing import span
+from tracing import tracer
+from ubuntu import Ubuntu
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("bench")
+
+FIXTURES_VERSION = 1  # bump when the fixture tree changes, so cached fixtures are regenerated
+BLOCK = 64 * 1024
+ZERO_BLOCK = bytes(BLOCK)
+KERNEL_SIZE = 8 * 1024 * 1024
+INITRD_SIZE = 32 * 1024 * 1024
+
+UBUNTU_VERSION = "20250101"
+DEBIAN_VERSION = "20250101-2000"
+FEDORA_COMPOSE = "1.5"
+ROCKY_VERSION = "9.5-20241118.0"
+ARMBIAN_TAG = "25.2.0"
+FATSO_TAG = "v20250101"
+FATSO_FLAVOR = "ka-rocky-cloud-k8s-el-containerd-qemu"
+
+# what each distro is benchmarked as; constructors get the stand-in server's base URL
+BENCH_DISTROS = {
+    "debian": lambda base_url: Debian("bookworm", "generic", f"{base_url}/debian"),
+    "ubuntu": lambda base_url: Ubuntu("noble", f"{base_url}/ubuntu"),
+    "fedora": lambda base_url: Fedora("39", f"{base_url}/fedora"),
+    "rocky": lambda base_url: Rocky("9", "GenericCloud-LVM", f"{base_url}/rocky", f"{base_url}/rocky-vault"),
+    "armbian": lambda base_url: Armbian("bookworm", "edge", ""),
+    "fatso": lambda base_url: Fatso(FATSO_FLAVOR, "rocky9-k8s"),
+}
+
+STAGES = ["resolve", "download", "build", "push"]
+METRICS = ["wall", "cpu", "rss", "bytes_in", "bytes_out"]
+# differences below these are noise, whatever the percentage
+METRIC_FLOORS = {"wall": 0.25, "cpu": 0.25, "rss": 16 * 1024 * 1024, "bytes_in": 256 * 1024, "bytes_out": 256 * 1024}
+
+
+# ---- fixtures ----------------------------------------------------------------------------------------------------
+
+
+class Fixtures:
+    """
+    The tree the stand-in server serves, under root. Images are synthesized deterministically (same size, same
+    bytes, same digests), so the tree is generated once per image size and reused by later runs.
+    """
+
+    def __init__(self, root: str, image_size: int):
+        self.root = root
+        self.image_size = image_size
+
+    def write(self, path: str, data: bytes):
+        filename = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as fh:
+            fh.write(data)
+
+    def image(self, path: str, seed: str, compression: str | None = None) -> tuple[dict[str, str], int]:
+        """Writes a synthetic qcow2 (xz/gz-compressed if asked); returns the digests and size of the file."""
+        filename = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        opener = {None: open, "xz": lzma.open, "gz": gzip.open}[compression]
+        with opener(filename, "wb") as fh:
+            synthetic_disk(fh, seed, self.image_size)
+        digests = {"sha256": hashlib.sha256(), "sha512": hashlib.sha512()}
+        with open(filename, "rb") as fh:
+            while chunk := fh.read(1024 * 1024):
+                for digest in digests.values():
+                    digest.update(chunk)
+        return {algo: digest.hexdigest() for algo, digest in digests.items()}, os.path.getsize(filename)
+
+
+def synthetic_disk(fh, seed: str, size: int):
+    # A qcow2 header, then a mix of what disk images hold: zeroed clusters, repetitive (text-like) data and
+    # incompressible data, so compression and decompression cost about what they do on real images.
+    rng = random.Random(seed)
+    header = struct.pack(">4sIQIIQ", b"QFI\xfb", 3, 0, 0, 16, size * 4)
+    fh.write(header.ljust(BLOCK, b"\0"))
+    for _ in range(1, size // BLOCK):
+        kind = rng.random()
+        if kind < 0.4:
+            fh.write(ZERO_BLOCK)
+        elif kind < 0.6:
+            fh.write(rng.randbytes(256) * (BLOCK // 256))
+        else:
+            fh.write(rng.randbytes(BLOCK))
+
+
+def debian_fixtures(fx: Fixtures):
+    daily = "debian/bookworm/daily"
+    dated = [f"2024{month:02d}{day:02d}-{1000 + day}/" for month in range(1, 13) for day in range(1, 29)]
+    fx.write(f"{daily}/index.html", apache_listing(dated + [f"{DEBIAN_VERSION}/", "latest/"]))
+    manifests = []
+    listing = []
+    sums = []
+    for arch in ["arm64", "amd64"]:
+        for variant in ["generic", "genericcloud", "nocloud"]:
+            manifests.append(f"debian-12-{variant}-{arch}-daily.json")
+            listing += [f"debian-12-{variant}-{arch}-daily-{DEBIAN_VERSION}.{ext}" for ext in ["json", "raw", "tar.xz"]]
+            if variant != "generic":
+                listing.append(f"debian-12-{variant}-{arch}-daily-{DEBIAN_VERSION}.qcow2")
+        name = f"debian-12-generic-{arch}-daily-{DEBIAN_VERSION}.qcow2"
+        digests, size = fx.image(f"{daily}/{DEBIAN_VERSION}/{name}", f"debian-{arch}")
+        listing.append(name)
+        sums.append(f"{digests['sha512']}  {name}")
+        manifest = {
+            "apiVersion": "v1",
+            "kind": "List",
+            "items": [
+                {
+                    "kind": "Build",
+                    "metadata": {"labels": {"cloud.debian.org/version": DEBIAN_VERSION}},
+                    "data": {"info": {"version": DEBIAN_VERSION, "release": "bookworm", "arch": arch}},
+                },
+                {
+                    "kind": "Upload",
+                    "metadata": {
+                        "annotations": {
+                            "cloud.debian.org/digest": f"sha512:{digests['sha512']}",
+                            "cloud.debian.org/size": str(size),
+                        },
+                    },
+                    "data": {"ref": name},
+                },
+            ],
+        }
+        fx.write(f"{daily}/latest/debian-12-generic-{arch}-daily.json", json.dumps(manifest).encode())
+    fx.write(f"{daily}/latest/index.html", apache_listing(sorted(manifests)))
+    fx.write(f"{daily}/{DEBIAN_VERSION}/index.html", apache_listing(sorted(listing) + ["SHA512SUMS"]))
+    fx.write(f"{daily}/{DEBIAN_VERSION}/SHA512SUMS", "\n".join(sums).encode() + b"\n")
+
+
+def ubuntu_fixtures(fx: Fixtures):
+    dated = [f"2024{month:02d}{day:02d}/" for month in range(1, 13) for day in range(1, 29)]
+    fx.write("ubuntu/noble/index.html", apache_listing(dated + [f"{UBUNTU_VERSION}/", "current/"]))
+    products = {}
+    listing = []
+    sums = []
+    for arch in ["amd64", "arm64", "armhf", "ppc64el", "riscv64", "s390x"]:
+        listing += [f"noble-server-cloudimg-{arch}{suffix}" for suffix in [".manifest", ".tar.gz", ".squashfs"]]
+        for release, version in [("jammy", "22.04"), ("noble", "24.04")]:
+            products[f"com.ubuntu.cloud.daily:server:{version}:{arch}"] = {
+                "arch": arch,
+                "release": release,
+                "version": version,
+                "versions": {
+                    "20241215": {
+                        "items": {
+                            "disk1.img": {
+                                "ftype": "disk1.img",
+                                "path": f"server/{release}/20241215/{release}-server-cloudimg-{arch}.img",
+                                "size": 0,
+                                "sha256": hashlib.sha256(f"{release}{arch}".encode()).hexdigest(),
+                            }
+                        }
+                    }
+                },
+            }
+        if arch not in ["amd64", "arm64"]:
+            continue
+        name = f"noble-server-cloudimg-{arch}.img"
+        digests, size = fx.image(f"ubuntu/noble/{UBUNTU_VERSION}/{name}", f"ubuntu-{arch}")
+        listing.append(name)
+        sums.append(f"{digests['sha256']} *{name}")
+        products[f"com.ubuntu.cloud.daily:server:24.04:{arch}"]["versions"][UBUNTU_VERSION] = {
+            "items": {
+                "disk1.img": {
+                    "ftype": "disk1.img",
+                    "path": f"server/noble/{UBUNTU_VERSION}/{name}",
+                    "size": size,
+                    "sha256": digests["sha256"],
+                }
+            }
+        }
+    stream = {"content_id": "com.ubuntu.cloud:daily:download", "format": "products:1.0", "products": products}
+    fx.write("ubuntu/daily/streams/v1/com.ubuntu.cloud:daily:download.json", json.dumps(stream).encode())
+    fx.write(f"ubuntu/noble/{UBUNTU_VERSION}/index.html", apache_listing(sorted(listing) + ["SHA256SUMS"]))
+    fx.write(f"ubuntu/noble/{UBUNTU_VERSION}/SHA256SUMS", "\n".join(sums).encode() + b"\n")
+
+
+def fedora_fixtures(fx: Fixtures):
+    releases = []
+    for slug in ["aarch64", "x86_64"]:
+        images = f"linux/releases/39/Cloud/{slug}/images"
+        name = f"Fedora-Cloud-Base-39-{FEDORA_COMPOSE}.{slug}.qcow2"
+        raw_name = f"Fedora-Cloud-Base-39-{FEDORA_COMPOSE}.{slug}.raw.xz"
+        checksum_name = f"Fedora-Cloud-39-{FEDORA_COMPOSE}-{slug}-CHECKSUM"
+        digests, size = fx.image(f"fedora/{images}/{name}", f"fedora-{slug}")
+        fx.write(f"fedora/{images}/index.html", apache_listing([name, raw_name, checksum_name]))
+        checksum = f"# {name}: {size} bytes\nSHA256 ({name}) = {digests['sha256']}\n"
+        fx.write(f"fedora/{images}/{checksum_name}", checksum.encode())
+        for release, link_name, subvariant in [
+            ("39", name, "Cloud_Base"),
+            ("39", raw_name, "Cloud_Base"),
+            ("38", f"Fedora-Cloud-Base-38-1.6.{slug}.qcow2", "Cloud_Base"),
+            ("39", f"Fedora-Server-dvd-{slug}-39-1.5.iso", "Server"),
+        ]:
+            releases.append(
+                {
+                    "version": release,
+                    "arch": slug,
+                    "link": f"{FEDORA_CANONICAL_MIRROR}/linux/releases/{release}/Cloud/{slug}/images/{link_name}",
+                    "variant": "Cloud",
+                    "subvariant": subvariant,
+                    "sha256": digests["sha256"]
+                    if link_name == name
+                    else hashlib.sha256(link_name.encode()).hexdigest(),
+                    "size": str(size),
+                }
+            )
+    fx.write("fedora-releases.json", json.dumps(releases).encode())
+
+
+def rocky_fixtures(fx: Fixtures):
+    for slug in ["aarch64", "x86_64"]:
+        images = f"rocky/9/images/{slug}"
+        name = f"Rocky-9-GenericCloud-LVM-{ROCKY_VERSION}.{slug}.qcow2"
+        digests, size = fx.image(f"{images}/{name}", f"rocky-{slug}")
+        others = [
+            f"Rocky-9-GenericCloud-Base-{ROCKY_VERSION}.{slug}.qcow2",
+            f"Rocky-9-EC2-Base-{ROCKY_VERSION}.{slug}.qcow2",
+        ]
+        latest = [f"Rocky-9-GenericCloud-LVM.latest.{slug}.qcow2", f"Rocky-9-GenericCloud-Base.latest.{slug}.qcow2"]
+        fx.write(f"{images}/index.html", nginx_listing(sorted([name] + others + latest) + ["CHECKSUM"]))
+        lines = []
+        for entry, entry_size, entry_digest in [(name, size, digests["sha256"])] + [
+            (other, 1, hashlib.sha256(other.encode()).hexdigest()) for other in others
+        ]:
+            lines += [f"# {entry}: {entry_size} bytes", f"SHA256 ({entry}) = {entry_digest}"]
+        fx.write(f"{images}/CHECKSUM", "\n".join(lines).encode() + b"\n")
+
+
+def github_release(fx: Fixtures, org_repo: str, tag: str, names: list[str], real: dict[str, tuple[str, str]]):
+    # real: asset name -> (seed, compression) of the assets the distros download; the rest are only listed
+    assets = []
+    for number, name in enumerate(names):
+        digest, size = hashlib.sha256(name.encode()).hexdigest(), 1
+        if name in real:
+            seed, compression = real[name]
+            digests, size = fx.image(f"github/{org_repo}/releases/download/{tag}/{name}", seed, compression)
+            digest = digests["sha256"]
+        assets.append(
+            {
+                "id": 1000 + number,
+                "name": name,
+                "size": size,
+                "digest": f"sha256:{digest}",
+                "browser_download_url": f"@BASE@/github/{org_repo}/releases/download/{tag}/{name}",
+            }
+        )
+    release = {"id": 42, "tag_name": tag, "name": tag, "assets": assets}
+    fx.write(f"api/repos/{org_repo}/release.json", json.dumps(release).encode())
+
+
+def armbian_fixtures(fx: Fixtures):
+    names = []
+    real = {}
+    for board in ["uefi-arm64", "uefi-x86", "rpi4b", "odroidn2", "rock-5b"]:
+        for release in ["bookworm", "trixie", "noble"]:
+            for branch in ["current", "edge"]:
+                for variant in ["metadata-serialconsole-cloud", "metadata-serialconsole-cloud-k8s-1.28", "minimal"]:
+                    name = f"Armbian_{ARMBIAN_TAG}_{board}_{release}_{branch}_6.12.1-{variant}.img.qcow2.xz"
+                    names += [name, f"{name}.sha", f"{name}.txt"]
+                    if board.startswith("uefi-") and (release, branch, variant) == (
+                        "bookworm",
+                        "edge",
+                        "metadata-serialconsole-cloud",
+                    ):
+                        real[name] = (f"armbian-{board}", "xz")
+    github_release(fx, "armsurvivors/armbian-release", ARMBIAN_TAG, names, real)
+
+
+def fatso_fixtures(fx: Fixtures):
+    names = []
+    real = {}
+    for flavor in [FATSO_FLAVOR, "ka-ubuntu-cloud-k8s-containerd-qemu", "ka-rocky-cloud-el-qemu", "rocky-cloud-k8s"]:
+        for arch in ["arm64", "amd64"]:
+            name = f"{flavor}_{arch}.qcow2.gz"
+            names += [name, f"{flavor}_{arch}.log"]
+            if flavor == FATSO_FLAVOR:
+                real[name] = (f"fatso-{arch}", "gz")
+    github_release(fx, "k8s-avengers/fatso-images", FATSO_TAG, names, real)
+
+
+def prepare_fixtures(work_dir: str, image_size: int) -> str:
+    root = os.path.abspath(os.path.join(work_dir, f"fixtures-{image_size}-v{FIXTURES_VERSION}"))
+    if os.path.exists(os.path.join(root, ".complete")):
+        log.info(f"Using fixtures in {root}")
+        return root
+    log.info(f"Generating fixtures in {root} ({image_size} byte images)")
+    started = time.monotonic()
+    shutil.rmtree(root, ignore_errors=True)
+    fx = Fixtures(root, image_size)
+    generators = [debian_fixtures, ubuntu_fixtures, fedora_fixtures, rocky_fixtures, armbian_fixtures, fatso_fixtures]
+    with ThreadPoolExecutor(max_workers=len(generators)) as tpe:  # lzma and zlib release the GIL
+        list(tpe.map(lambda generate: generate(fx), generators))
+    fx.write(".complete", b"")
+    log.info(f"Generated fixtures in {time.monotonic() - started:.1f}s")
+    return root
+
+
+# ---- stand-in server ---------------------------------------------------------------------------------------------
+
+
+class BenchRegistry:
+    # The OCI distribution API as far as registry.py uses it; blobs go to files so the server stays small.
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, "uploads"), exist_ok=True)
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self.lock = threading.Lock()
+        self.blob_repos: dict[str, set[str]] = {}  # digest -> repositories it is linked into
+        self.manifests: dict[tuple[str, str], tuple[str, bytes]] = {}  # (repository, tag or digest) -> manifest
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest.replace(":", "-"))
+
+    def upload_path(self, upload: str) -> str:
+        return os.path.join(self.root, "uploads", upload)
+
+
+class BenchHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "BenchServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, key: str, nbytes: int):
+        with self.server.counters_lock:
+            self.server.counters[key] += nbytes
+
+    def respond(self, status: int, body: bytes = b"", headers: dict | None = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD" and body:
+            self.wfile.write(body)
+            self.count("sent", len(body))
+
+    def read_body(self, fh=None) -> bytes:
+        remaining = int(self.headers.get("Content-Length", "0"))
+        self.count("received", remaining)
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if fh is not None:
+                fh.write(chunk)
+            else:
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        try:
+            if path == "/_bench/stats":
+                with self.server.counters_lock:
+                    body = json.dumps(self.server.counters).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif path.startswith("/v2/"):
+                self.registry_get(path)
+            elif path.startswith("/api/"):
+                self.github_api(path)
+            else:
+                self.static(path)
+        except ConnectionError:
+            pass  # e.g. a hedged segment the downloader gave up on
+
+    def do_POST(self):
+        self.registry_write()
+
+    def do_PATCH(self):
+        self.registry_write()
+
+    def do_PUT(self):
+        self.registry_write()
+
+    # -- mirrors and release downloads: files under root, with Range support; /mirror-b/... is a second mirror
+
+    def static(self, path: str):
+        relative = unquote(path).removeprefix("/mirror-b").lstrip("/")
+        filename = os.path.normpath(os.path.join(self.server.root, relative))
+        if relative.endswith("/") or relative == "":
+            filename = os.path.join(filename, "index.html")
+        if not filename.startswith(self.server.root + os.sep) or not os.path.isfile(filename):
+            return self.respond(404)
+        stat = os.stat(filename)
+        start, end = 0, stat.st_size - 1
+        status = 200
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+            "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+        }
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match is not None:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start > end:
+                return self.respond(416, headers={"Content-Range": f"bytes */{stat.st_size}"})
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        with open(filename, "rb") as fh:
+            fh.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = fh.read(min(remaining, 256 * 1024))
+                self.wfile.write(chunk)
+                self.count("sent", len(chunk))
+                remaining -= len(chunk)
+
+    # -- GitHub releases API: newest release (assets embedded up to 100, like GitHub) and paged assets
+
+    def github_api(self, path: str):
+        match = re.fullmatch(r"/api/repos/([^/]+/[^/]+)/releases(?:/\d+/assets)?", path)
+        filename = os.path.join(self.server.root, "api", "repos", match.group(1), "release.json") if match else ""
+        if not os.path.isfile(filename):
+            return self.respond(404, b'{"message": "Not Found"}')
+        with open(filename) as fh:
+            release = json.loads(fh.read().replace("@BASE@", f"http://{self.headers['Host']}"))
+        query = parse_qs(urlsplit(self.path).query)
+        if path.endswith("/assets"):
+            per_page = int(query.get("per_page", ["30"])[0])
+            page = int(query.get("page", ["1"])[0])
+            document = release["assets"][(page - 1) * per_page : page * per_page]
+        else:
+            document = [dict(release, assets=release["assets"][:100])]
+        body = json.dumps(document).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self.respond(304, headers={"ETag": etag})
+        self.respond(200, body, {"Content-Type": "application/json", "ETag": etag})
+
+    # -- registry
+
+    def registry_get(self, path: str):
+        registry = self.server.registry
+        if path == "/v2/":
+            return self.respond(200, b"{}")
+        match = re.fullmatch(r"/v2/(.+)/blobs/(sha256:[0-9a-f]{64})", path)
+        if match is not None:
+            repository, digest = match.groups()
+            with registry.lock:
+                linked = repository in registry.blob_repos.get(digest, set())
+            if not linked:
+                return self.respond(404)
+            size = os.path.getsize(registry.blob_path(digest))
+            if self.command == "HEAD":
+                self.send_response(200)
+                self.send_header("Content-Length", str(size))
+                self.send_header("Docker-Content-Digest", digest)
+                return self.end_headers()
+            with open(registry.blob_path(digest), "rb") as fh:
+                return self.respond(200, fh.read(), {"Docker-Content-Digest": digest})
+        match = re.fullmatch(r"/v2/(.+)/manifests/([^/]+)", path)
+        if match is not None:
+            with registry.lock:
+                found = registry.manifests.get((match.group(1), match.group(2)))
+            if found is None:
+                return self.respond(404, b'{"errors": [{"code": "MANIFEST_UNKNOWN"}]}')
+            media_type, body = found
+            digest = f"sha256:{hashlib.sha256(body).hexdigest()}"
+            return self.respond(200, body, {"Content-Type": media_type, "Docker-Content-Digest": digest})
+        match = re.fullmatch(r"/v2/(.+)/tags/list", path)
+        if match is not None:
+            with registry.lock:
+                tags = sorted(ref for repo, ref in registry.manifests if repo == match.group(1) and ":" not in ref)
+            return self.respond(200, json.dumps({"name": match.group(1), "tags": tags}).encode())
+        self.respond(404)
+
+    def registry_write(self):
+        registry = self.server.registry
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        match = re.fullmatch(r"/v2/(.+)/blobs/uploads/([0-9a-f-]*)", parts.path)
+        if match is not None:
+            repository, upload = match.groups()
+            if self.command == "POST":
+                self.read_body()
+                mount, source = query.get("mount", [None])[0], query.get("from", [None])[0]
+                with registry.lock:
+                    if mount is not None and source in registry.blob_repos.get(mount, set()):
+                        registry.blob_repos[mount].add(repository)
+                        return self.respond(201, headers={"Location": f"/v2/{repository}/blobs/{mount}"})
+                upload = uuid.uuid4().hex
+                open(registry.upload_path(upload), "wb").close()
+                return self.respond(202, headers={"Location": f"/v2/{repository}/blobs/uploads/{upload}"})
+            if not os.path.exists(registry.upload_path(upload)):
+                self.read_body()
+                return self.respond(404, b'{"errors": [{"code": "BLOB_UPLOAD_UNKNOWN"}]}')
+            with open(registry.upload_path(upload), "ab") as fh:
+                self.read_body(fh)
+                offset = fh.tell()
+            if self.command == "PATCH":
+                headers = {"Location": f"/v2/{repository}/blobs/uploads/{upload}", "Range": f"0-{offset - 1}"}
+                return self.respond(202, headers=headers)
+            digest = query.get("digest", [""])[0]
+            sha256 = hashlib.sha256()
+            with open(registry.upload_path(upload), "rb") as fh:
+                while chunk := fh.read(1024 * 1024):
+                    sha256.update(chunk)
+            if digest != f"sha256:{sha256.hexdigest()}":
+                os.unlink(registry.upload_path(upload))
+                return self.respond(400, b'{"errors": [{"code": "DIGEST_INVALID"}]}')
+            os.replace(registry.upload_path(upload), registry.blob_path(digest))
+            with registry.lock:
+                registry.blob_repos.setdefault(digest, set()).add(repository)
+            return self.respond(201, headers={"Location": f"/v2/{repository}/blobs/{digest}"})
+        match = re.fullmatch(r"/v2/(.+)/manifests/([^/]+)", parts.path)
+        if match is not None and self.command == "PUT":
+            repository, reference = match.groups()
+            body = self.read_body()
+            digest = f"sha256:{hashlib.sha256(body).hexdigest()}"
+            with registry.lock:
+                for ref in (reference, digest):
+                    registry.manifests[(repository, ref)] = (self.headers["Content-Type"], body)
+            return self.respond(201, headers={"Docker-Content-Digest": digest})
+        self.read_body()
+        self.respond(404)
+
+
+class BenchServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root: str, registry_root: str):
+        super().__init__(("127.0.0.1", 0), BenchHandler)
+        self.root = root
+        self.registry = BenchRegistry(registry_root)
+        self.counters = {"sent": 0, "received": 0}  # body bytes, from the server's side
+        self.counters_lock = threading.Lock()
+
+
+def serve(root: str, registry_root: str, conn):
+    server = BenchServer(root, registry_root)
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+# ---- the distro processes ----------------------------------------------------------------------------------------
+
+
+def reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM, so each stage gets its own peak
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # since the process started
+
+
+def server_counters(base_url: str) -> dict[str, int]:
+    with urlopen(f"{base_url}/_bench/stats", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def measure(base_url: str, name: str, func) -> dict:
+    reset_peak_rss()
+    before = server_counters(base_url)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    with span(name, "stage"):
+        func()
+    wall = time.perf_counter() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    after = server_counters(base_url)
+    cpu = (usage_after.ru_utime + usage_after.ru_stime) - (usage.ru_utime + usage.ru_stime)
+    return {
+        "wall": round(wall, 3),
+        "cpu": round(cpu, 3),
+        "rss": peak_rss(),
+        "bytes_in": after["sent"] - before["sent"],
+        "bytes_out": after["received"] - before["received"],
+    }
+
+
+def bench_env(base_url: str) -> dict[str, str]:
+    return {
+        "GITHUB_API_URL": f"{base_url}/api",
+        "FEDORA_RELEASES_URL": f"{base_url}/fedora-releases.json",
+        "UBUNTU_MIRRORS": f"{base_url}/mirror-b/ubuntu",
+        "DEBIAN_MIRRORS": f"{base_url}/mirror-b/debian",
+        "FEDORA_MIRRORS": f"{base_url}/mirror-b/fedora",
+        "ROCKY_MIRRORS": f"{base_url}/mirror-b/rocky",
+        "BASE_OCI_REF": f"{urlsplit(base_url).netloc}/bench/",
+        "OCI_BUILDER": "native",
+    }
+
+
+# never let a benchmark reach (or report to) anything real
+BENCH_ENV_UNSET = [
+    "DISK_OCI_REF",
+    "KERNEL_OCI_REF",
+    "GITHUB_TOKEN",
+    "GITHUB_OUTPUT",
+    "GITHUB_STEP_SUMMARY",
+    "REGISTRY_USERNAME",
+    "REGISTRY_PASSWORD",
+    "REGISTRY_MOUNT_FROM",
+    "HTTP_CACHE",
+    "ARTIFACT_STORE",
+    "MIRRORS_FILE",
+    "TRACE_DIR",
+]
+
+
+def stand_in_extract(distro: DistroBaseInfo):
+    # Extraction needs root and NBD devices; the kernel images are built from synthetic kernels and initrds.
+    for arch in distro.arches:
+        for filename, size in [
+            (arch.vmlinuz_final_filename, KERNEL_SIZE),
+            (arch.initramfs_final_filename, INITRD_SIZE),
+        ]:
+            with open(filename, "wb") as fh:
+                fh.write(random.Random(filename).randbytes(size))
+
+
+def bench_distro(name: str, base_url: str, workspace: str) -> dict:
+    os.makedirs(os.path.join(workspace, "examples", "kubevirt", "vms"))
+    os.symlink(os.path.dirname(os.path.abspath(__file__)), os.path.join(workspace, "info"))  # for the templates
+    os.chdir(workspace)
+    for key in BENCH_ENV_UNSET:
+        os.environ.pop(key, None)
+    os.environ.update(bench_env(base_url))
+
+    distro = BENCH_DISTROS[name](base_url)
+    registry_workers = int(os.environ.get("EXECUTOR_REGISTRY_WORKERS", "4"))
+
+    def resolve():
+        with ThreadPoolExecutor(max_workers=len(distro.arches)) as tpe:
+            list(tpe.map(distro.grab_arch_version, distro.arches))
+        distro.stage_version()
+
+    def download():
+        with ThreadPoolExecutor(max_workers=len(distro.arches)) as tpe:
+            list(tpe.map(lambda arch: arch.download_arch_qcow2(), distro.arches))
+
+    def build():
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as tpe:
+            pairs = [(image, arch) for image in distro.oci_images for arch in image.arch_images]
+            list(tpe.map(lambda pair: pair[0].build_arch(pair[1]), pairs))
+
+    def push():
+        with ThreadPoolExecutor(max_workers=registry_workers) as tpe:
+            pairs = [(image, arch) for image in distro.oci_images for arch in image.arch_images]
+            list(tpe.map(lambda pair: pair[0].push_arch(pair[1]), pairs))
+            list(tpe.map(lambda image: image.push_manifest(), distro.oci_images))
+
+    stages = {}
+    try:
+        stages["resolve"] = measure(base_url, "resolve", resolve)
+        stages["download"] = measure(base_url, "download", download)
+        stand_in_extract(distro)
+        stages["build"] = measure(base_url, "build", build)
+        stages["push"] = measure(base_url, "push", push)
+    finally:
+        tracer().export(f"bench-{distro.slug()}")
+    return {"slug": distro.slug(), "version": distro.version, "stages": stages}
+
+
+def run_distro(conn, name: str, base_url: str, workspace: str):
+    try:
+        conn.send(bench_distro(name, base_url, workspace))
+    except Exception:
+        conn.send({"error": traceback.format_exc()})
+    finally:
+        conn.close()
+
+
+# ---- runs, baselines and reports ---------------------------------------------------------------------------------
+
+
+def run_bench(distros: list[str], image_size: int, work_dir: str) -> dict:
+    """Runs the given distros (names in BENCH_DISTROS), one process each; returns the results document."""
+    fixtures = prepare_fixtures(work_dir, image_size)
+    run_dir = os.path.abspath(os.path.join(work_dir, "run"))
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    server = context.Process(target=serve, args=(fixtures, os.path.join(run_dir, "registry"), sender), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{receiver.recv()}"
+    log.info(f"Stand-in server at {base_url}, serving {fixtures}")
+
+    results = {
+        "started": time.time(),
+        "config": {
+            "image_size": image_size,
+            "resolver": os.environ.get("VERSION_RESOLVER", "feed"),
+            "download_mode": os.environ.get("DOWNLOAD_MODE", "stream"),
+            "cpus": os.cpu_count(),
+        },
+        "distros": {},
+        "errors": {},
+    }
+    try:
+        for name in distros:
+            log.info(f"Benchmarking {name}")
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=run_distro, args=(sender, name, base_url, os.path.join(run_dir, name)))
+            process.start()
+            sender.close()
+            try:
+                result = receiver.recv()
+            except EOFError:
+                result = None
+            process.join()
+            if result is None:
+                result = {"error": f"benchmark process died with exit code {process.exitcode}"}
+            if "error" in result:
+                log.error(f"Benchmark of {name} failed:\n{result['error']}")
+                results["errors"][name] = result["error"]
+            else:
+                results["distros"][name] = result
+    finally:
+        server.terminate()
+        server.join()
+
+    with open(os.path.join(work_dir, "result.json"), "w") as fh:
+        json.dump(results, fh, indent=1)
+    return results
+
+
+def with_totals(stages: dict[str, dict]) -> dict[str, dict]:
+    total = {metric: sum(stage[metric] for stage in stages.values()) for metric in METRICS if metric != "rss"}
+    total["rss"] = max((stage["rss"] for stage in stages.values()), default=0)
+    return {**stages, "total": total}
+
+
+def comparable(results: dict, baseline: dict | None) -> bool:
+    if baseline is None:
+        return False
+    keys = ["image_size", "resolver", "download_mode"]
+    return all(results["config"].get(key) == baseline["config"].get(key) for key in keys)
+
+
+def regressions(results: dict, baseline: dict | None, tolerance: float) -> list[str]:
+    """Every distro/stage/metric more than tolerance (a fraction) and the metric's noise floor over baseline."""
+    if not comparable(results, baseline):
+        return []
+    found = []
+    for name, result in results["distros"].items():
+        if name not in baseline["distros"]:
+            continue
+        base_stages = with_totals(baseline["distros"][name]["stages"])
+        for stage, metrics in with_totals(result["stages"]).items():
+            for metric in METRICS:
+                before = base_stages.get(stage, {}).get(metric)
+                if before is None:
+                    continue
+                now = metrics[metric]
+                if now - before > METRIC_FLOORS[metric] and now > before * (1 + tolerance):
+                    found.append(f"{name}:{stage}:{metric}")
+    return found
+
+
+def format_metric(metric: str, value: float) -> str:
+    if metric in ("wall", "cpu"):
+        return f"{value:.2f}s"
+    return f"{value / 1024 / 1024:.1f} MiB" if value >= 1024 * 1024 else f"{value / 1024:.1f} KiB"
+
+
+def markdown_report(results: dict, baseline: dict | None, flagged: list[str]) -> str:
+    compare = comparable(results, baseline)
+    lines = [f"### Benchmark ({results['config']['image_size'] / 1024 / 1024:.0f} MiB images)", ""]
+    if baseline is not None and not compare:
+        lines += [f"Baseline not comparable: {baseline['config']} vs {results['config']}", ""]
+    lines += ["| Distro | Stage | " + " | ".join(METRICS) + " |", "|---|---|" + "--:|" * len(METRICS)]
+    for name, result in results["distros"].items():
+        base_stages = (
+            with_totals(baseline["distros"][name]["stages"]) if compare and name in baseline["distros"] else {}
+        )
+        for stage, metrics in with_totals(result["stages"]).items():
+            cells = []
+            for metric in METRICS:
+                cell = format_metric(metric, metrics[metric])
+                before = base_stages.get(stage, {}).get(metric)
+                if before:
+                    change = f"{(metrics[metric] - before) / before * 100:+.0f}%"
+                    cell += f" ({'**' + change + '**' if f'{name}:{stage}:{metric}' in flagged else change})"
+                cells.append(cell)
+            lines.append(f"| {result['slug']} | {stage} | " + " | ".join(cells) + " |")
+    for name in results["errors"]:
+        lines.append(f"| {name} | failed | " + " | ".join([""] * len(METRICS)) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def load_baseline(filename: str) -> dict | None:
+    try:
+        with open(filename) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        log.info(f"No baseline at {filename}")
+        return None
+
+
+def bench_parse_size(value: str) -> int:
+    # whole clusters, at least the qcow2 header and a few more
+    return max(4 * BLOCK, parse_size(value) // BLOCK * BLOCK)
@@ -0,0 +1,101 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+#
+# Micro-benchmark for the href extractor used on every mirror index page: python3 info/bench_hrefs.py
+# The fixtures are synthesized in the shape of the real listings (Apache autoindex tables for
+# cloud.debian.org and cloud-images.ubuntu.com, nginx-style <pre> listings for mirrors), at their real sizes.
+import time
+import tracemalloc
+
+from utils import iter_hrefs
+
+
+def apache_listing(names: list[str]) -> bytes:
+    rows = "\n".join(
+        f'<tr><td valign="top"><img src="/icons/folder.gif" alt="[DIR]"></td><td><a href="{name}">{name}</a></td>'
+        f'<td align="right">2024-01-01 00:00  </td><td align="right">  - </td><td>&nbsp;</td></tr>'
+        for name in names
+    )
+    return (
+        '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">\n<html><head><title>Index of /</title></head>'
+        '<body><h1>Index of /</h1><table><tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">'
+        f'Last modified</a></th></tr><tr><th colspan="5"><hr></th></tr>\n{rows}\n</table></body></html>'
+    ).encode()
+
+
+def nginx_listing(names: list[str]) -> bytes:
+    rows = "\n".join(f'<a href="{name}">{name}</a>{" " * 20}01-Jan-2024 00:00    123456789' for name in names)
+    return f'<html><head><title>Index of /</title></head><body><h1>Index of /</h1><hr><pre><a href="../">../</a>\n{rows}\n</pre><hr></body></html>'.encode()
+
+
+FIXTURES = {
+    # debian daily/: one dated dir per build, a few years' worth
+    "debian-daily": apache_listing(
+        [
+            f"2024{month:02d}{day:02d}-{build}/"
+            for month in range(1, 13)
+            for day in range(1, 29)
+            for build in range(1000, 1003)
+        ]
+    ),
+    # ubuntu <release>/: dated dirs plus current/
+    "ubuntu-release": apache_listing(
+        [f"2024{month:02d}{day:02d}/" for month in range(1, 13) for day in range(1, 29)] + ["current/"]
+    ),
+    # a dated dir's contents: images, manifests, checksums for every arch
+    "ubuntu-dated": apache_listing(
+        [
+            f"noble-server-cloudimg-{arch}{suffix}"
+            for arch in ["amd64", "arm64", "armhf", "ppc64el", "riscv64", "s390x"]
+            for suffix in [".img", ".manifest", ".tar.gz", "-root.tar.xz", ".squashfs", "-lxd.tar.xz", ".vmdk", ".ova"]
+        ]
+        + ["SHA256SUMS", "SHA256SUMS.gpg"]
+    ),
+    "mirror-pre": nginx_listing(
+        [
+            f"Rocky-9-GenericCloud-{variant}-9.{minor}-{date}.0.x86_64.qcow2"
+            for variant in ["Base", "LVM"]
+            for minor in range(6)
+            for date in range(20230000, 20230400, 7)
+        ]
+    ),
+}
+
+
+def bench(parse, document: bytes, rounds: int) -> tuple[float, int, int]:
+    parse(document)  # warm up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        count = len(parse(document))
+    elapsed = (time.perf_counter() - started) / rounds
+    tracemalloc.start()
+    parse(document)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, count
+
+
+def main():
+    parsers = {"incremental": lambda document: list(iter_hrefs(document))}
+    try:
+        from bs4 import BeautifulSoup  # only to compare against, not a dependency anymore
+
+        parsers["beautifulsoup"] = lambda document: [
+            a.get("href") for a in BeautifulSoup(document, "html.parser").find_all("a") if a.get("href") is not None
+        ]
+    except ImportError:
+        print("beautifulsoup4 not installed, benchmarking the incremental extractor alone")
+
+    for fixture, document in FIXTURES.items():
+        results = {}
+        for parser, parse in parsers.items():
+            results[parser] = bench(parse, document, rounds=20)
+        counts = {results[parser][2] for parser in results}
+        assert len(counts) == 1, f"{fixture}: parsers disagree on the number of hrefs: {results}"
+        for parser, (elapsed, peak, count) in results.items():
+            print(
+                f"{fixture:16} {len(document):>9} bytes {count:>6} hrefs  {parser:14} {elapsed * 1000:8.2f} ms  peak {peak / 1024:9.1f} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
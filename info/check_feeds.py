@@ -0,0 +1,45 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+#
+# Checks the feed resolvers against the bench's synthesized feeds: python3 info/check_feeds.py
+# Feeds are memoized per process and some documents (Ubuntu's simplestreams) cover several releases, so each
+# check resolves more than one release in the same process and asserts none gets another's images.
+import os
+import tempfile
+import threading
+
+from bench import UBUNTU_VERSION
+from bench import BenchServer
+from bench import Fixtures
+from bench import ubuntu_fixtures
+from feeds import ubuntu_feed
+
+
+def check_ubuntu(base_url: str):
+    mirror = f"{base_url}/ubuntu"
+    # every release has a 20241215 build; only noble's amd64 and arm64 have a newer one (the bench's images)
+    expected = {"jammy": {}, "noble": {"amd64": UBUNTU_VERSION, "arm64": UBUNTU_VERSION}}
+    for release in ["jammy", "noble", "jammy"]:
+        images = ubuntu_feed(mirror, release)
+        assert images, f"ubuntu {release}: no images"
+        for arch, image in images.items():
+            version = expected[release].get(arch, "20241215")
+            assert image.version == version, f"ubuntu {release} {arch}: got version {image.version}, not {version}"
+            assert f"/{release}/" in image.url, f"ubuntu {release} {arch}: got {image.url}"
+        print(f"ubuntu {release:8} {', '.join(f'{arch} {image.version}' for arch, image in images.items())}")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ["HTTP_CACHE"] = "off"
+        fx = Fixtures(os.path.join(work_dir, "fixtures"), 4 * 64 * 1024)
+        ubuntu_fixtures(fx)
+        server = BenchServer(fx.root, os.path.join(work_dir, "registry"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            check_ubuntu(f"http://127.0.0.1:{server.server_address[1]}")
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
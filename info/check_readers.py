@@ -0,0 +1,319 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+#
+# Checks the in-process kernel extraction against generated disk images: python3 info/check_readers.py
+# Each disk is partitioned (GPT or MBR), holds a FAT32 ESP and an ext4 root (made by mke2fs -d, when e2fsprogs is
+# installed), and is wrapped in a qcow2 with data, compressed and unallocated clusters. Every case goes through
+# what extract_kernel_initrd_from_qcow2() does without NBD: scan_boot(), glob_non_rescue() and stream(), and the
+# extracted files are compared with the ones put in.
+import hashlib
+import os
+import random
+import shutil
+import struct
+import subprocess
+import tempfile
+import uuid
+import zlib
+
+from partitions import FILESYSTEM_READERS
+from partitions import glob_non_rescue
+from partitions import open_disk
+from partitions import scan_boot
+from qcow2 import Qcow2Image
+
+SECTOR = 512
+MIB = 1024 * 1024
+CLUSTER_BITS = 16
+FAT32_CLUSTERS = 66000  # the fewest FAT32 may have is 65525; 512-byte clusters keep the ESP small
+FAT_EOC = 0x0FFFFFFF
+ESP_TYPE = "c12a7328-f81f-11d2-ba4b-00a0c93ec93b"
+BIOS_BOOT_TYPE = "21686148-6449-6e6f-744e-656564454649"
+LINUX_TYPE = "0fc63daf-8483-4772-8e79-3d69d8477de4"
+
+rnd = random.Random(7)
+
+
+def blob(size: int) -> bytes:
+    return rnd.randbytes(size)
+
+
+# ---- FAT32 ---------------------------------------------------------------------------------------------------------
+
+
+def short_name_checksum(raw: bytes) -> int:
+    checksum = 0
+    for byte in raw:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+def fat_entries(name: str, attributes: int, cluster: int, size: int, serial: int) -> bytes:
+    # 8.3 upper-case names as they are; anything else as VFAT long name entries before a made-up short one
+    base, _, ext = name.partition(".")
+    if name == name.upper() and 0 < len(base) <= 8 and len(ext) <= 3 and "." not in ext and " " not in name:
+        raw = base.ljust(8).encode() + ext.ljust(3).encode()
+        long_entries = b""
+    else:
+        raw = f"F{serial:05d}~1".encode().ljust(8) + b"BIN"
+        text = name.encode("utf-16-le") + (b"\0\0" if len(name) % 13 else b"")
+        text += b"\xff" * (-len(text) % 26)
+        parts = [text[i : i + 26] for i in range(0, len(text), 26)]
+        long_entries = b"".join(
+            bytes([number | (0x40 if number == len(parts) else 0)])
+            + parts[number - 1][:10]
+            + bytes([0x0F, 0, short_name_checksum(raw)])
+            + parts[number - 1][10:22]
+            + b"\0\0"
+            + parts[number - 1][22:]
+            for number in range(len(parts), 0, -1)
+        )
+    return long_entries + raw + struct.pack("<BB7xH4xHI", attributes, 0, cluster >> 16, cluster & 0xFFFF, size)
+
+
+def fat32_image(files: dict[str, bytes], label: str) -> bytes:
+    """A FAT32 filesystem (512-byte sectors and clusters) holding files by path; directories are implied."""
+    tree: dict = {}
+    for path, data in files.items():
+        node = tree
+        *dirs, name = path.split("/")
+        for part in dirs:
+            node = node.setdefault(part, {})
+        node[name] = data
+    reserved = 32
+    fat_sectors = -(-(FAT32_CLUSTERS + 2) * 4 // SECTOR)
+    data_offset = (reserved + 2 * fat_sectors) * SECTOR
+    image = bytearray(data_offset + FAT32_CLUSTERS * SECTOR)
+    fat = [0x0FFFFFF8, FAT_EOC] + [0] * FAT32_CLUSTERS
+    next_free = [2]
+    serial = [0]
+
+    def allocate(data: bytes) -> int:
+        if not data:
+            return 0
+        first = next_free[0]
+        count = -(-len(data) // SECTOR)
+        for cluster in range(first, first + count):
+            fat[cluster] = cluster + 1
+        fat[first + count - 1] = FAT_EOC
+        image[data_offset + (first - 2) * SECTOR : data_offset + (first - 2) * SECTOR + len(data)] = data
+        next_free[0] += count
+        return first
+
+    def directory(node: dict, parent: int | None) -> int:
+        # clusters are taken parent first, so the directory's own entries are written once its children are placed
+        entries = []
+        for name, value in node.items():
+            serial[0] += 1
+            if isinstance(value, dict):
+                entries.append((name, value, serial[0]))
+            else:
+                entries.append((name, allocate(value), serial[0], len(value)))
+        # room for ".", ".." (or the root's volume label) and an end marker, besides the entries themselves
+        count = 3 + sum(len(fat_entries(entry[0], 0, 0, 0, entry[2])) // 32 for entry in entries)
+        first = allocate(bytes(count * 32))
+        data = b"" if parent is None else fat_entries(".", 0x10, first, 0, 0) + fat_entries("..", 0x10, parent, 0, 0)
+        if parent is None:
+            data += label.upper().ljust(11).encode() + struct.pack("<B20x", 0x08)
+        for entry in entries:
+            if len(entry) == 3:
+                name, child, number = entry
+                # a ".." pointing at the root says cluster 0, whatever the root's cluster is
+                data += fat_entries(name, 0x10, directory(child, 0 if parent is None else first), 0, number)
+            else:
+                name, cluster, number, size = entry
+                data += fat_entries(name, 0x20, cluster, size, number)
+        image[data_offset + (first - 2) * SECTOR : data_offset + (first - 2) * SECTOR + len(data)] = data
+        return first
+
+    root = directory(tree, None)
+    table = struct.pack(f"<{len(fat)}I", *fat)
+    for copy in range(2):
+        offset = (reserved + copy * fat_sectors) * SECTOR
+        image[offset : offset + len(table)] = table
+    total_sectors = len(image) // SECTOR
+    boot = bytearray(SECTOR)
+    boot[:11] = b"\xeb\x58\x90MSWIN4.1"
+    struct.pack_into("<HBHBHHBHHHII", boot, 11, SECTOR, 1, reserved, 2, 0, 0, 0xF8, 0, 63, 255, 0, total_sectors)
+    struct.pack_into("<IHHIHH", boot, 36, fat_sectors, 0, 0, root, 1, 6)
+    boot[66] = 0x29
+    boot[71:90] = label.upper().ljust(11).encode() + b"FAT32   "
+    boot[510:] = b"\x55\xaa"
+    image[:SECTOR] = boot
+    return bytes(image)
+
+
+# ---- ext4, partition tables, qcow2 ---------------------------------------------------------------------------------
+
+
+def ext4_image(work_dir: str, files: dict[str, bytes], label: str, size: int) -> bytes | None:
+    mke2fs = shutil.which("mke2fs", path=f"{os.environ.get('PATH', '')}:/usr/sbin:/sbin")
+    if mke2fs is None:
+        return None
+    tree = tempfile.mkdtemp(dir=work_dir)
+    for path, data in files.items():
+        os.makedirs(os.path.dirname(os.path.join(tree, path)), exist_ok=True)
+        with open(os.path.join(tree, path), "wb") as fh:
+            fh.write(data)
+    filename = f"{tree}.ext4"
+    subprocess.run(
+        [mke2fs, "-q", "-F", "-t", "ext4", "-L", label, "-d", tree, filename, f"{size // 1024}k"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    with open(filename, "rb") as fh:
+        return fh.read()
+
+
+def gpt_disk(partitions: list[tuple[str, str, bytes | int]]) -> bytearray:
+    """(type GUID, name, contents or size) each, 1 MiB aligned; the backup GPT is left out, it is never read."""
+    entries = bytearray(128 * 128)
+    layout = []
+    lba = MIB // SECTOR
+    for index, (type_guid, name, contents) in enumerate(partitions):
+        size = contents if isinstance(contents, int) else len(contents)
+        sectors = -(-size // MIB) * MIB // SECTOR
+        entry = uuid.UUID(type_guid).bytes_le + uuid.UUID(int=index + 1).bytes_le
+        entry += struct.pack("<QQQ", lba, lba + sectors - 1, 0) + name.encode("utf-16-le").ljust(72, b"\0")
+        entries[index * 128 : (index + 1) * 128] = entry
+        layout.append((lba, contents))
+        lba += sectors
+    disk = bytearray((lba + 34) * SECTOR)
+    for start, contents in layout:
+        if not isinstance(contents, int):
+            disk[start * SECTOR : start * SECTOR + len(contents)] = contents
+    header = bytearray(92)
+    struct.pack_into("<8sIII4xQQQQ", header, 0, b"EFI PART", 0x10000, 92, 0, 1, lba + 33, 34, lba - 1)
+    struct.pack_into("<16sQIII", header, 56, uuid.UUID(int=0).bytes_le, 2, 128, 128, zlib.crc32(entries))
+    struct.pack_into("<I", header, 16, zlib.crc32(header))
+    disk[SECTOR : SECTOR + 92] = header
+    disk[2 * SECTOR : 2 * SECTOR + len(entries)] = entries
+    disk[446:462] = struct.pack("<B3xB3xII", 0, 0xEE, 1, min(len(disk) // SECTOR - 1, 0xFFFFFFFF))
+    disk[510:512] = b"\x55\xaa"
+    return disk
+
+
+def mbr_disk(partitions: list[tuple[int, bytes]]) -> bytearray:
+    """(MBR type, contents) each as a primary partition, 1 MiB aligned."""
+    layout = []
+    lba = MIB // SECTOR
+    for kind, contents in partitions:
+        sectors = -(-len(contents) // MIB) * MIB // SECTOR
+        layout.append((kind, lba, sectors, contents))
+        lba += sectors
+    disk = bytearray(lba * SECTOR)
+    for index, (kind, start, sectors, contents) in enumerate(layout):
+        disk[446 + index * 16 : 462 + index * 16] = struct.pack(
+            "<B3xB3xII", 0x80 if index == 0 else 0, kind, start, sectors
+        )
+        disk[start * SECTOR : start * SECTOR + len(contents)] = contents
+    disk[510:512] = b"\x55\xaa"
+    return disk
+
+
+def write_qcow2(filename: str, disk: bytes):
+    """A qcow2 v3 of disk: all-zero clusters unallocated, every other one zlib-compressed, the rest plain data."""
+    cluster_size = 1 << CLUSTER_BITS
+    clusters = -(-len(disk) // cluster_size)
+    l2_entries = cluster_size // 8
+    l1_size = -(-clusters // l2_entries)
+    l2_tables = [[0] * l2_entries for _ in range(l1_size)]
+    body = bytearray()
+    body_offset = (2 + l1_size) * cluster_size  # header, L1, then the L2 tables
+    offset_bits = 62 - (CLUSTER_BITS - 8)
+    for index in range(clusters):
+        data = disk[index * cluster_size : (index + 1) * cluster_size].ljust(cluster_size, b"\0")
+        if not any(data):
+            continue
+        if index % 2:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -12)
+            compressed = compressor.compress(data) + compressor.flush()
+            host = body_offset + len(body)
+            body += compressed
+            sectors = (host % SECTOR + len(compressed) - 1) // SECTOR  # extra sectors beyond the first
+            entry = (1 << 62) | (sectors << offset_bits) | host
+        else:
+            body += bytes(-len(body) % cluster_size)
+            entry = (1 << 63) | (body_offset + len(body))
+            body += data
+        l2_tables[index // l2_entries][index % l2_entries] = entry
+    header = struct.pack(
+        ">4sIQIIQIIQQIIQ", b"QFI\xfb", 3, 0, 0, CLUSTER_BITS, len(disk), 0, l1_size, cluster_size, 0, 0, 0, 0
+    ) + struct.pack(">QQQII", 0, 0, 0, 4, 104)
+    l1 = struct.pack(f">{l1_size}Q", *((1 << 63) | (2 + n) * cluster_size for n in range(l1_size)))
+    with open(filename, "wb") as fh:
+        fh.write(header.ljust(cluster_size, b"\0"))
+        fh.write(l1.ljust(cluster_size, b"\0"))
+        fh.writelines(struct.pack(f">{l2_entries}Q", *table) for table in l2_tables)
+        fh.write(body)
+
+
+# ---- the checks ----------------------------------------------------------------------------------------------------
+
+
+def check_extract(filename: str, hint: tuple[int, str], vmlinuz_glob, initramfs_glob, expected: dict[str, bytes]):
+    """What extract_from_image() does, from the scan to the copied bytes."""
+    with open_disk(filename) as disk:
+        assert isinstance(disk, Qcow2Image), f"{filename} did not open as qcow2"
+        scan = scan_boot(disk, vmlinuz_glob, *hint)
+        assert scan.found is not None, f"{filename} {hint}: kernel not found, undecided {scan.undecided}"
+        partition, prefix = scan.found
+        filesystem = FILESYSTEM_READERS[partition.filesystem](disk, partition)
+        for glob, want in ((vmlinuz_glob, "vmlinuz"), (initramfs_glob, "initramfs")):
+            path = glob_non_rescue(filesystem.listdir, prefix, glob)
+            digest = hashlib.sha256()
+            for chunk in filesystem.stream(path):
+                digest.update(chunk)
+            assert digest.hexdigest() == hashlib.sha256(expected[want]).hexdigest(), f"{filename}: {path} differs"
+        found = f"partition {partition.number} ({partition.filesystem}) under '{prefix}'"
+        print(f"{os.path.basename(filename):10} hint {hint}: {found}")
+
+
+def main():
+    vmlinuz, initrd = blob(3 * MIB + 1234), blob(5 * MIB + 77)
+    esp_boot = {"EFI/BOOT/BOOTX64.EFI": blob(200_000), "EFI/debian/grub.cfg": b"search --label root\n"}
+    with tempfile.TemporaryDirectory() as work_dir:
+        # a Debian-style GPT disk: the kernel in the ext4 root's boot/, next to a rescue kernel glob_non_rescue skips
+        root = ext4_image(
+            work_dir,
+            {
+                "boot/vmlinuz-6.1.0-13-amd64": vmlinuz,
+                "boot/initrd.img-6.1.0-13-amd64": initrd,
+                "boot/vmlinuz-0-rescue-0123456789abcdef": blob(4096),
+                "boot/grub/grub.cfg": b"linux /boot/vmlinuz-6.1.0-13-amd64\n",
+                "etc/hostname": b"debian\n",
+            },
+            "root",
+            24 * MIB,
+        )
+        if root is None:
+            print("mke2fs not found (e2fsprogs), checking FAT only")
+        else:
+            filename = os.path.join(work_dir, "gpt.qcow2")
+            gpt = gpt_disk(
+                [
+                    (LINUX_TYPE, "root", root),
+                    (BIOS_BOOT_TYPE, "bios", 3 * MIB),
+                    (ESP_TYPE, "esp", fat32_image(esp_boot, "esp")),
+                ]
+            )
+            write_qcow2(filename, gpt)
+            expected = {"vmlinuz": vmlinuz, "initramfs": initrd}
+            for hint in [(1, "boot/"), (2, ""), (3, "")]:  # as hinted, then hints that are wrong
+                check_extract(filename, hint, ["vmlinuz-*"], ["initramfs-*", "initrd.img-*"], expected)
+
+        # a fatso-style MBR disk: the kernel and initrd on the ESP, under the machine id, with VFAT long names
+        esp = dict(esp_boot)
+        esp["2b4f1c9e8a7d4e6f9b0c1d2e3f4a5b6c/6.1.0-13-amd64/vmlinuz"] = vmlinuz
+        esp["2b4f1c9e8a7d4e6f9b0c1d2e3f4a5b6c/initrd"] = initrd
+        esp["loader/entries/2b4f1c9e8a7d4e6f9b0c1d2e3f4a5b6c-6.1.0-13-amd64.conf"] = b"title Fatso\n"
+        filename = os.path.join(work_dir, "mbr.qcow2")
+        write_qcow2(filename, mbr_disk([(0xEF, fat32_image(esp, "esp"))] + ([(0x83, root)] if root else [])))
+        check_extract(filename, (1, ""), ["*/*/vmlinuz"], ["*/initrd"], {"vmlinuz": vmlinuz, "initramfs": initrd})
+        if root is not None:
+            check_extract(
+                filename, (2, "boot/"), ["*/*/vmlinuz"], ["*/initrd"], {"vmlinuz": vmlinuz, "initramfs": initrd}
+            )
+
+
+if __name__ == "__main__":
+    main()
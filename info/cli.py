@@ -1,12 +1,28 @@
 import logging
+import os
+import shutil
 import sys
 
 import click
 
 from armbian import Armbian
+from bench import BENCH_DISTROS
+from bench import bench_parse_size
+from bench import load_baseline
+from bench import markdown_report
+from bench import regressions
+from bench import run_bench
 from debian import Debian
 from fatso import Fatso
 from fedora import Fedora
+from history import perf_report
+from history import run_history
+from matrix import entry_params
+from matrix import load_matrix
+from matrix import run_matrix
+from partitions import open_disk
+from partitions import scan_boot
+from qcow2 import Qcow2Image
 from rocky import Rocky
 from ubuntu import Ubuntu
 from utils import setup_logging
@@ -177,5 +193,163 @@ def fatso(flavor, fid):
         sys.exit(1)
 
 
+# matrix "distro" -> (class, {distro command parameter: constructor keyword}); every parameter must be mapped
+MATRIX_DISTROS = {
+    "rocky": (
+        Rocky,
+        {
+            "release": "rocky_version",
+            "variant": "rocky_variant",
+            "rocky_mirror": "rocky_mirror",
+            "rocky_vault_mirror": "rocky_vault_mirror",
+        },
+    ),
+    "fedora": (Fedora, {"release": "release", "mirror": "mirror"}),
+    "debian": (Debian, {"release": "release", "variant": "variant", "mirror": "mirror"}),
+    "ubuntu": (Ubuntu, {"release": "release", "mirror": "mirror"}),
+    "armbian": (Armbian, {"release": "release", "branch": "branch", "extra_release": "extra_release"}),
+    "fatso": (Fatso, {"flavor": "flavor", "fid": "fid"}),
+}
+
+
+@cli.command(help="Builds all entries of a matrix concurrently in one process, sharing caches and resource limits")
+@click.option(
+    "--matrix-file",
+    envvar="MATRIX_FILE",
+    default=".github/workflows/matrix.yaml",
+    help="GHA workflow (jobs.build.strategy.matrix.include) or a YAML list of {distro, id, env} entries",
+)
+@click.option("--only", multiple=True, help="Only build the entry with this id; can be given multiple times")
+def matrix(matrix_file, only):
+    all_ok = False
+    try:
+        log.info("Matrix")
+        distros = []
+        for entry in load_matrix(matrix_file, list(only)):
+            params = entry_params(cli.commands[entry["distro"]], entry)
+            log.info(f"Matrix entry {entry['id']}: {entry['distro']} {params}")
+            distro_class, keywords = MATRIX_DISTROS[entry["distro"]]
+            if set(params) != set(keywords):
+                raise Exception(f"'{entry['distro']}' options {sorted(params)} do not match {sorted(keywords)}")
+            distros.append(distro_class(**{keywords[name]: value for name, value in params.items()}))
+        all_ok = run_matrix(distros)
+    except:
+        log.exception("CLI failed")
+    if not all_ok:
+        sys.exit(1)
+
+
+@cli.command(
+    help="Offline end-to-end benchmark of every distro against local stand-ins for mirrors, GitHub and a registry"
+)
+@click.option(
+    "--distro",
+    "distros",
+    multiple=True,
+    type=click.Choice(list(BENCH_DISTROS)),
+    help="Only benchmark this distro; can be given multiple times",
+)
+@click.option("--image-size", envvar="BENCH_IMAGE_SIZE", default="64M", help="Size of the synthetic qcow2 images")
+@click.option("--work-dir", envvar="BENCH_DIR", default="cache/bench", help="Fixtures, workspaces and results")
+@click.option(
+    "--baseline", envvar="BENCH_BASELINE", default=None, help="Baseline results; default <work-dir>/baseline.json"
+)
+@click.option("--save-baseline", is_flag=True, help="Store this run's results as the baseline")
+@click.option("--tolerance", default=0.2, help="Slowdown over the baseline (a fraction) that counts as a regression")
+@click.option("--check", is_flag=True, help="Exit non-zero if anything regressed against the baseline")
+def bench(distros, image_size, work_dir, baseline, save_baseline, tolerance, check):
+    ok = False
+    try:
+        log.info("Bench")
+        baseline = baseline or os.path.join(work_dir, "baseline.json")
+        results = run_bench(list(distros or BENCH_DISTROS), bench_parse_size(image_size), work_dir)
+        previous = load_baseline(baseline)
+        flagged = regressions(results, previous, tolerance)
+        report = markdown_report(results, previous, flagged)
+        print(report)
+        if os.environ.get("GITHUB_STEP_SUMMARY") is not None:
+            with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fh:
+                fh.write(report)
+        if flagged:
+            log.warning(f"Regressions against {baseline}: {flagged}")
+        if save_baseline:
+            shutil.copyfile(os.path.join(work_dir, "result.json"), baseline)
+            log.info(f"Saved baseline {baseline}")
+        ok = not results["errors"] and not (check and flagged)
+    except:
+        log.exception("CLI failed")
+    if not ok:
+        sys.exit(1)
+
+
+@cli.command("perf-report", help="Trends of stage durations from the run history, flagging regressions")
+@click.option("--days", default=14, help="Window for the trends and the median each latest run is compared with")
+@click.option("--factor", default=1.5, help="Latest/median ratio that counts as a regression")
+@click.option("--min-seconds", default=10.0, help="Ignore regressions of fewer seconds than this")
+@click.option("--min-runs", default=3, help="Earlier runs needed in the window before a stage is judged")
+@click.option("--slug", "slugs", multiple=True, help="Only this distro slug; can be given multiple times")
+@click.option("--check", is_flag=True, help="Exit non-zero if anything regressed")
+def perf_report_command(days, factor, min_seconds, min_runs, slugs, check):
+    ok = False
+    try:
+        history = run_history()
+        if history is None:
+            raise Exception("RUN_HISTORY is off, there is no run history to report on")
+        report, flagged = perf_report(history, days, factor, min_seconds, min_runs, list(slugs))
+        print(report)
+        if os.environ.get("GITHUB_STEP_SUMMARY") is not None:
+            with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fh:
+                fh.write(report)
+        for trend in flagged:
+            log.warning(trend.describe(days))
+        ok = not (check and flagged)
+    except:
+        log.exception("CLI failed")
+    if not ok:
+        sys.exit(1)
+
+
+@cli.command("qcow2-info", help="Virtual size, cluster size and allocation of a qcow2 image, read without qemu-nbd")
+@click.argument("filename", type=click.Path(exists=True, dir_okay=False))
+@click.option("--map", "show_map", is_flag=True, help="Also print every run of the allocation map")
+def qcow2_info(filename, show_map):
+    try:
+        with Qcow2Image(filename) as image:
+            allocation = image.allocation_map()
+            print(image)
+            for kind in sorted({kind for _, _, kind in allocation}):
+                total = sum(length for _, length, run_kind in allocation if run_kind == kind)
+                print(f"{kind:>12}: {total:>14} bytes ({total * 100 / image.virtual_size:.1f}%)")
+            if show_map:
+                for offset, length, kind in allocation:
+                    print(f"{offset:>14} {length:>14} {kind}")
+    except:
+        log.exception("CLI failed")
+        sys.exit(1)
+
+
+@cli.command(help="Partitions and filesystems of a qcow2/raw image or block device, and where its kernel is")
+@click.argument("filename", type=click.Path(exists=True, dir_okay=False))
+@click.option("--vmlinuz-glob", "vmlinuz_globs", multiple=True, default=["vmlinuz-*"], help="Kernel glob(s)")
+@click.option("--hint-partition", default=2, help="Partition to look in first, as boot_partition_num()")
+@click.option("--hint-prefix", default="", help="Directory to look in first, as boot_dir_prefix()")
+def partitions(filename, vmlinuz_globs, hint_partition, hint_prefix):
+    try:
+        with open_disk(filename) as disk:
+            scan = scan_boot(disk, list(vmlinuz_globs), hint_partition, hint_prefix)
+        for partition in scan.partitions:
+            print(
+                f"{partition.number:>3} {partition.start:>14} {partition.size:>14} {partition.type_name:<24} "
+                f"{partition.filesystem or '-':<12} {partition.label or partition.name}"
+            )
+        if scan.found is not None:
+            print(f"Kernel in partition {scan.found[0].number} under '{scan.found[1]}', readable without mounting")
+        else:
+            print(f"Kernel not found without mounting; partitions to mount and look in: {scan.undecided}")
+    except:
+        log.exception("CLI failed")
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     cli()
@@ -1,14 +1,22 @@
 # Pay attention, work step by step, use modern (3.10+) Python syntax and features.
 import logging
+import os
 import string
 from abc import abstractmethod
 
 import rich.repr
 from rich.syntax import Syntax
 
+from oci import ANNOTATION_DESCRIPTION
+from oci import MEDIA_TYPE_INDEX
+from oci import build_oci_layout
+from oci import image_index
+from oci import layout_manifest
+from registry import push_oci_layout
+from registry import put_manifest_tags
+from tracing import span
 from utils import global_console
 from utils import setup_logging
-from utils import shell
 from utils import shell_passthrough
 
 log: logging.Logger = setup_logging("containerDisk")
@@ -26,6 +34,7 @@ class BaseOCISingleArchImage:
     tag_version: string
     tag_latest: string
     docker_arch: string
+    kind: string  # "disk" or "kernel", set by subclasses
 
     def __init__(self, oci_ref, tag_version, tag_latest, docker_arch):
         self.oci_ref = oci_ref
@@ -33,25 +42,51 @@ class BaseOCISingleArchImage:
         self.tag_latest = tag_latest + "-" + docker_arch
         self.docker_arch = docker_arch
 
+    @staticmethod
+    def builder() -> string:
+        # "native" (default) writes an OCI image layout in-process; "docker" uses docker build
+        builder = os.environ.get("OCI_BUILDER", "native")
+        if builder not in ("native", "docker"):
+            raise Exception(f"Unknown OCI_BUILDER: {builder}")
+        return builder
+
     def build(self):
+        with span("build", "oci", ref=self.full_ref_version, builder=self.builder()) as s:
+            if self.builder() == "native":
+                self.build_native()
+            else:
+                self.build_docker()
+            s.add_bytes(sum(os.path.getsize(filename) for layer in self.image_layers() for filename, _ in layer))
+
+    def build_native(self):
+        log.info(f"Building {self.full_ref_version} and {self.full_ref_latest} as OCI layout {self.oci_layout_dir}")
+        build_oci_layout(
+            self.oci_layout_dir,
+            self.docker_arch,
+            self.image_layers(),
+            {ANNOTATION_DESCRIPTION: self.description()},
+            [self.tag_version, self.tag_latest],
+        )
+
+    def build_docker(self):
         log.info(f"Building {self.full_ref_version} and {self.full_ref_latest}")
         contents = self.dockerfile()
 
         global_console().print(Syntax(contents, "dockerfile"))
 
-        # write contents to "Dockerfile"
-        with open("Dockerfile", "w") as f:
+        # write contents to a per-image Dockerfile, so several images can be built concurrently
+        with open(self.dockerfile_filename, "w") as f:
             f.write(contents)
 
         ignores = self.dockerignore()
         global_console().print(Syntax(ignores, "dockerignore"))
 
-        # write ignores to ".dockerignore"
-        with open(".dockerignore", "w") as f:
+        # write ignores next to it; BuildKit picks up "<Dockerfile>.dockerignore" over ".dockerignore"
+        with open(f"{self.dockerfile_filename}.dockerignore", "w") as f:
             f.write(ignores)
 
         # build the image
-        shell_passthrough(["docker", "build", "-t", f"{self.full_ref_version}", "."])
+        shell_passthrough(["docker", "build", "-f", self.dockerfile_filename, "-t", f"{self.full_ref_version}", "."])
 
         # tag the image as latest
         shell_passthrough(["docker", "tag", f"{self.full_ref_version}", f"{self.full_ref_latest}"])
@@ -64,10 +99,36 @@ class BaseOCISingleArchImage:
     def full_ref_latest(self):
         return f"{self.oci_ref}:{self.tag_latest}"
 
+    @property
+    def workspace_slug(self):
+        # unique per image name and tag (which carries the arch), so many distros can share one workspace
+        return f"{self.kind}-{self.oci_ref.rsplit('/', 1)[-1]}-{self.tag_version}"
+
+    @property
+    def dockerfile_filename(self):
+        return f"Dockerfile.{self.workspace_slug}"
+
+    @property
+    def oci_layout_dir(self):
+        return f"oci-layout.{self.workspace_slug}"
+
     def push(self):
-        # push the image & the latest tag
-        shell_passthrough(["docker", "push", f"{self.full_ref_version}"])
-        shell_passthrough(["docker", "push", f"{self.full_ref_latest}"])
+        with span("push", "registry", ref=self.full_ref_version, builder=self.builder()):
+            if self.builder() == "native":
+                push_oci_layout(self.oci_layout_dir, self.oci_ref, [self.tag_version, self.tag_latest])
+                return
+            # push the image & the latest tag
+            shell_passthrough(["docker", "push", f"{self.full_ref_version}"])
+            shell_passthrough(["docker", "push", f"{self.full_ref_latest}"])
+
+    @abstractmethod
+    def image_layers(self) -> list[list[tuple[str, str]]]:
+        # one list of (filename on disk, path inside the image) per layer
+        pass
+
+    @abstractmethod
+    def description(self) -> string:
+        pass
 
     @abstractmethod
     def dockerfile(self):
@@ -80,6 +141,8 @@ class BaseOCISingleArchImage:
 
 @rich.repr.auto
 class ArchContainerKernelImage(BaseOCISingleArchImage):
+    kind = "kernel"
+
     def dockerignore(self):
         return f"""*
 !{self.kernel_filename}
@@ -102,26 +165,40 @@ class ArchContainerKernelImage(BaseOCISingleArchImage):
         self.kernel_filename = kernel_filename
         self.initramfs_filename = initramfs_filename
 
+    def image_layers(self) -> list[list[tuple[str, str]]]:
+        # separate layers, so an unchanged kernel (or initrd) is the very same blob across versions
+        return [[(self.kernel_filename, "boot/vmlinuz")], [(self.initramfs_filename, "boot/initrd")]]
+
+    def description(self) -> string:
+        return f"Cloud image kernel and initrd image version '{self.tag_version}' for arch {self.docker_arch} containing {self.kernel_filename} as /boot/vmlinuz and {self.initramfs_filename} as /boot/initrd"
+
     def dockerfile(self):
         return f"""FROM scratch
 ADD --chown=107:107 {self.kernel_filename} /boot/vmlinuz
 ADD --chown=107:107 {self.initramfs_filename} /boot/initrd
-LABEL org.opencontainers.image.description="Cloud image kernel and initrd image version '{self.tag_version}' for arch {self.docker_arch} containing {self.kernel_filename} as /boot/vmlinuz and {self.initramfs_filename} as /boot/initrd"
+LABEL org.opencontainers.image.description="{self.description()}"
 """
 
 
 @rich.repr.auto
 class ArchContainerDiskImage(BaseOCISingleArchImage):
+    kind = "disk"
     qcow2_filename: string
 
     def __init__(self, oci_ref, tag_version, tag_latest, docker_arch, qcow2_filename):
         super().__init__(oci_ref, tag_version, tag_latest, docker_arch)
         self.qcow2_filename = qcow2_filename
 
+    def image_layers(self) -> list[list[tuple[str, str]]]:
+        return [[(self.qcow2_filename, f"disk/{self.qcow2_filename}")]]
+
+    def description(self) -> string:
+        return f"Cloud containerDisk qcow2 version '{self.tag_version}' for arch {self.docker_arch} containing /disk/{self.qcow2_filename}"
+
     def dockerfile(self):
         return f"""FROM scratch
 ADD --chown=107:107 {self.qcow2_filename} /disk/{self.qcow2_filename}
-LABEL org.opencontainers.image.description="Cloud containerDisk qcow2 version '{self.tag_version}' for arch {self.docker_arch} containing /disk/{self.qcow2_filename}"
+LABEL org.opencontainers.image.description="{self.description()}"
 """
 
     def dockerignore(self):
@@ -169,62 +246,47 @@ class MultiArchImage:
 
     def build(self):
         log.info(f"Building ({self.type}): {self.full_ref_version} and {self.full_ref_latest}")
-        for arch, arch_image in self.arch_images.items():
-            log.info(f"Building ({self.type}): {self.full_ref_version} and {self.full_ref_latest} for {arch}")
-            arch_image.build()
+        for arch in self.arch_images.keys():
+            self.build_arch(arch)
+
+    def build_arch(self, arch: string):
+        log.info(f"Building ({self.type}): {self.full_ref_version} and {self.full_ref_latest} for {arch}")
+        self.arch_images[arch].build()
 
     def push(self):
         log.info(f"Pushing ({self.type}): {self.full_ref_version} and {self.full_ref_latest}")
-        for arch, arch_image in self.arch_images.items():
-            log.info(f"Pushing ({self.type}): {self.full_ref_version} and {self.full_ref_latest} for {arch}")
-            arch_image.push()
-
-        # Create the manifest for the versioned tag
-        log.info(f"Creating manifest for {self.full_ref_version}")
-        shell(
-            ["docker", "manifest", "create", "--amend", f"{self.full_ref_version}"]
-            + [f"{self.full_ref_version}-{arch}" for arch in self.arch_images.keys()]
-        )
-
-        for arch, arch_image in self.arch_images.items():
-            log.info(f"Annotating {self.full_ref_version}-{arch} as {arch}")
-            shell_passthrough(
-                [
-                    "docker",
-                    "manifest",
-                    "annotate",
-                    f"{self.full_ref_version}",
-                    f"{self.full_ref_version}-{arch}",
-                    "--arch",
-                    arch,
-                ]
-            )
-
-        # Create the manifest for the latest tag
-        log.info(f"Creating manifest for {self.full_ref_latest}")
+        for arch in self.arch_images.keys():
+            self.push_arch(arch)
+        self.push_manifest()
+
+    def push_arch(self, arch: string):
+        log.info(f"Pushing ({self.type}): {self.full_ref_version} and {self.full_ref_latest} for {arch}")
+        self.arch_images[arch].push()
+
+    def push_manifest(self):
+        # One multi-arch index, tagged twice: the versioned and the latest tag point at the same content.
+        with span("push_index", "registry", ref=self.full_ref_version, builder=BaseOCISingleArchImage.builder()):
+            if BaseOCISingleArchImage.builder() == "native":
+                self.push_manifest_native()
+            else:
+                self.push_manifest_docker()
+
+    def push_manifest_native(self):
+        # Built in memory from the per-arch manifests in the OCI layouts (their descriptors carry the platform).
+        manifest_descs = [
+            layout_manifest(arch_image.oci_layout_dir, arch_image.tag_version)[0]
+            for arch_image in self.arch_images.values()
+        ]
+        index_bytes = image_index(manifest_descs)
+        log.info(f"Pushing index for {self.full_ref_version} and {self.full_ref_latest}: {manifest_descs}")
+        digest = put_manifest_tags(self.oci_ref, MEDIA_TYPE_INDEX, index_bytes, [self.tag_version, self.tag_latest])
+        log.info(f"Pushed index {digest} as {self.full_ref_version} and {self.full_ref_latest}")
+
+    def push_manifest_docker(self):
+        # imagetools reads the per-arch manifests (and their platforms) from the registry and pushes one index
+        # under every -t, with no local manifest-list cache involved.
+        log.info(f"Creating index for {self.full_ref_version} and {self.full_ref_latest}")
         shell_passthrough(
-            ["docker", "manifest", "create", "--amend", f"{self.full_ref_latest}"]
-            + [f"{self.full_ref_latest}-{arch}" for arch in self.arch_images.keys()]
+            ["docker", "buildx", "imagetools", "create", "-t", self.full_ref_version, "-t", self.full_ref_latest]
+            + [arch_image.full_ref_version for arch_image in self.arch_images.values()]
         )
-
-        for arch, arch_image in self.arch_images.items():
-            log.info(f"Annotating {self.full_ref_latest}-{arch} as {arch}")
-            shell_passthrough(
-                [
-                    "docker",
-                    "manifest",
-                    "annotate",
-                    f"{self.full_ref_latest}",
-                    f"{self.full_ref_latest}-{arch}",
-                    "--arch",
-                    arch,
-                ]
-            )
-
-        # push the manifest for the versioned tag
-        log.info(f"Pushing manifest for {self.full_ref_version}")
-        shell_passthrough(["docker", "manifest", "push", f"{self.full_ref_version}"])
-
-        # push the manifest for the latest tag
-        log.info(f"Pushing manifest for {self.full_ref_latest}")
-        shell_passthrough(["docker", "manifest", "push", f"{self.full_ref_latest}"])
@@ -2,10 +2,13 @@
 import logging
 import os
 import string
-from urllib.error import HTTPError
 
 from distro import DistroBaseInfo
 from distro_arch import DistroBaseArchInfo
+from feeds import debian_feed
+from feeds import FeedImage
+from mirrors import MirrorPool
+from utils import get_first_index_hrefs
 from utils import get_url_and_parse_html_hrefs
 from utils import setup_logging
 
@@ -42,9 +45,10 @@ class Debian(DistroBaseInfo):
             default_oci_ref_disk="debian-cloud-container-disk",
             default_oci_ref_kernel="debian-cloud-kernel-kv",
         )
+        self.mirrors = MirrorPool("debian", mirror, os.environ.get("DEBIAN_MIRRORS", "").split())
 
     def set_version_from_arch_versions(self, arch_versions: set[string]) -> string:
-        self.version = "-".join(arch_versions)  # just join all distinct versions, hopefully there is only one
+        self.version = "-".join(sorted(arch_versions))  # just join all distinct versions, hopefully there is only one
         self.oci_tag_version = self.release + "-" + self.version
         self.oci_tag_latest = self.release + "-latest"
 
@@ -63,22 +67,16 @@ class DebianArchInfo(DistroBaseArchInfo):
     all_hrefs: list[string]
     qcow2_hrefs: list[string]
 
-    def grab_version(self):
+    def feed_image(self) -> FeedImage | None:
+        return debian_feed(self.distro.mirror, self.distro.release, self.distro.variant).get(self.slug)
+
+    def scrape_version(self):
         indexes_to_try = [f"{self.distro.mirror}/{self.distro.release}/daily/"]
 
         # Log the indexes
         log.info(f"Trying indexes: {indexes_to_try}")
 
-        for index_url in indexes_to_try:
-            try:
-                self.index_url = index_url
-                self.all_hrefs = get_url_and_parse_html_hrefs(self.index_url)
-                break
-            except HTTPError as e:
-                continue
-
-        if self.index_url is None:
-            raise Exception(f"Could not find valid index for {self.slug}")
+        self.index_url, self.all_hrefs = get_first_index_hrefs(indexes_to_try)
 
         datey_hrefs = list(
             set(
@@ -120,9 +118,14 @@ class DebianArchInfo(DistroBaseArchInfo):
         if len(self.qcow2_hrefs) != 1:
             raise Exception(f"Found {len(self.qcow2_hrefs)} qcow2 hrefs for {self.slug}: {self.qcow2_hrefs}")
 
-        self.qcow2_filename = self.qcow2_hrefs[0]
+        self.set_image(self.index_url, self.qcow2_hrefs[0])
+
+    def set_image(self, index_url: string, filename: string):
+        self.index_url = index_url
+        self.qcow2_filename = filename
         qcow2_basename = os.path.basename(self.qcow2_filename)[: -len(".qcow2")]
         self.vmlinuz_final_filename = f"{qcow2_basename}.vmlinuz"
         self.initramfs_final_filename = f"{qcow2_basename}.initramfs"
 
-        self.qcow2_url = self.index_url + self.qcow2_filename
+        self.qcow2_url = index_url + self.qcow2_filename
+        self.qcow2_checksum_url = index_url + "SHA512SUMS"
@@ -1,8 +1,10 @@
 # Pay attention, work step by step, use modern (3.10+) Python syntax and features.
 import logging
 import os
+import shutil
 import string
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 import jinja2
 from rich.pretty import pprint
@@ -10,9 +12,20 @@ from rich.pretty import pretty_repr
 
 from containerdisk import MultiArchImage
 from distro_arch import DistroBaseArchInfo
+from artifacts import parse_size
+from executor import RESOURCE_CPU
+from executor import RESOURCE_DOWNLOAD
+from executor import RESOURCE_NETWORK
+from executor import RESOURCE_REGISTRY
+from executor import StageExecutor
+from history import record_run
+from mirrors import MirrorPool
+from nbd import nbd_pool
+from registry import refs_exist
+from tracing import span
+from tracing import tracer
 from utils import set_gha_output
 from utils import setup_logging
-from utils import skopeo_inspect_remote_ref
 
 log: logging.Logger = setup_logging("distro")
 
@@ -27,6 +40,8 @@ class DistroBaseInfo:
     oci_tag_version: string = None
     oci_tag_latest: string = None
 
+    mirrors: MirrorPool | None = None  # other mirrors of the distro's primary mirror, to download from the fastest
+
     def __init__(
         self,
         arches: list[DistroBaseArchInfo],
@@ -35,6 +50,7 @@ class DistroBaseInfo:
     ):
         self.oci_images: list[MultiArchImage] = None
         self.oci_images_by_type: dict[str, MultiArchImage] = None
+        self.up_to_date: bool = False
         self.arches: list["DistroBaseArchInfo"] = arches
         self.version = None
         self.oci_ref_disk = os.environ.get(
@@ -67,12 +83,19 @@ class DistroBaseInfo:
         return ""
 
     def prepare_version(self) -> string:
-        version_set: set[string] = set()
-        for arch in self.arches:
-            log.info("[green]Grabbing version for arch: [bold]%s[/green][/bold]", arch.slug)
+        # arches resolve concurrently, as the grab stages do in add_stages()
+        with ThreadPoolExecutor(max_workers=len(self.arches)) as tpe:
+            list(tpe.map(self.grab_arch_version, self.arches))
+        self.finalize_version()
+
+    def grab_arch_version(self, arch: DistroBaseArchInfo):
+        log.info("[green]Grabbing version for arch: [bold]%s[/green][/bold]", arch.slug)
+        with span("grab_version", "version", distro=self.slug(), arch=arch.slug) as s:
             arch.grab_version()
-            version_set.add(arch.version)
+            s.set(version=arch.version)
 
+    def finalize_version(self):
+        version_set: set[string] = {arch.version for arch in self.arches}  # joined sorted(), independent of arch order
         log.info(f"version_set: {version_set}")
         pprint(version_set)
         self.set_version_from_arch_versions(version_set)
@@ -91,13 +114,11 @@ class DistroBaseInfo:
             arch.download_arch_qcow2()
 
     def extract_kernel_initrd(self):
-        nbd_counter = 1
         for arch in self.arches:
-            nbd_counter = nbd_counter + 1
-            self.handle_extract_kernel_initrd(arch, nbd_counter)
+            self.handle_extract_kernel_initrd(arch, nbd_pool().lease)
 
-    def handle_extract_kernel_initrd(self, arch, nbd_counter):
-        arch.extract_kernel_initrd_from_qcow2(nbd_counter)
+    def handle_extract_kernel_initrd(self, arch, nbd_lease):
+        arch.extract_kernel_initrd_from_qcow2(nbd_lease)
 
     def get_oci_image_definitions(self) -> list[MultiArchImage]:
         return [self.get_oci_def_disk(), self.get_oci_def_kernel()]
@@ -129,19 +150,154 @@ class DistroBaseInfo:
         return image
 
     def cli_the_whole_shebang(self):
-        self.prepare_version()
+        executor = StageExecutor()
+        self.add_stages(executor)
+        ok = False
+        try:
+            executor.run()
+            ok = True
+        finally:
+            tracer().export(self.slug())
+            record_run(self, ok)
+        log.info("Done.")
+
+    def add_stages(self, executor: StageExecutor, matrix: bool = False):
+        # Per-arch graph: grab_version -> download -> extract -> build -> push, joined by the manifest push.
+        # Only the tags need every arch's version, so downloads start as soon as each arch's version is known.
+        # In a matrix run (many distros in one graph) downloads also wait for a share of the disk budget, and
+        # once everything is pushed the workspace files are removed to hand that share back.
+        s = self.slug()
+        grab_stages = [
+            executor.add(
+                f"{s}:grab:{arch.docker_slug}", lambda arch=arch: self.grab_arch_version(arch), [], RESOURCE_NETWORK
+            )
+            for arch in self.arches
+        ]
+        version_stage = executor.add(f"{s}:version", self.stage_version, grab_stages, RESOURCE_NETWORK)
+
+        # If running on Darwin, stop there. We need Linux to run qemu-nbd.
+        if os.uname().sysname != "Linux":
+            log.warning("Not on Linux, cannot run qemu-nbd to extract kernel and initrd from qcow2.")
+            return
+
+        do_download = os.environ.get("DO_DOWNLOAD_QCOW2", "") == "yes"
+        do_extract = os.environ.get("DO_EXTRACT_KERNEL", "") == "yes"
+        do_build = os.environ.get("DO_DOCKER_BUILD", "") == "yes"
+        do_push = os.environ.get("DO_DOCKER_PUSH", "") == "yes"
+
+        # Matrix runs skip distros whose versioned images are already pushed (what the workflow's "uptodate"
+        # output does per job), so the heavy stages wait for the version stage there.
+        def unless_up_to_date(func):
+            return (lambda: None if self.up_to_date else func()) if matrix else func
+
+        # no resource: waiting on the disk budget must not hold a network slot other distros need to finish
+        admit_stage = None
+        if matrix and do_download:
+            admit_stage = executor.add(
+                f"{s}:admit", unless_up_to_date(lambda: self.reserve_disk(executor)), [version_stage]
+            )
+
+        ready_by_type: dict[str, dict[str, str]] = {"disk": {}, "kernel": {}}
+        for arch, grab_stage in zip(self.arches, grab_stages):
+            ready_by_type["disk"][arch.docker_slug] = grab_stage
+            if do_download:
+                ready_by_type["disk"][arch.docker_slug] = executor.add(
+                    f"{s}:download:{arch.docker_slug}",
+                    unless_up_to_date(arch.download_arch_qcow2),
+                    [grab_stage, admit_stage],
+                    RESOURCE_DOWNLOAD,
+                )
+            ready_by_type["kernel"][arch.docker_slug] = ready_by_type["disk"][arch.docker_slug]
+            if do_extract:
+                ready_by_type["kernel"][arch.docker_slug] = executor.add(
+                    f"{s}:extract:{arch.docker_slug}",
+                    unless_up_to_date(lambda arch=arch: self.stage_extract(executor, arch)),
+                    [ready_by_type["disk"][arch.docker_slug]],
+                    RESOURCE_CPU,
+                )
+
+        # The image definitions only exist after the version stage, so the stages look them up lazily by type.
+        manifest_stages = []
+        for image_type, ready_by_arch in ready_by_type.items():
+            push_stages = []
+            for arch_slug, ready_stage in ready_by_arch.items():
+                image_stage = ready_stage
+                if do_build:
+                    image_stage = executor.add(
+                        f"{s}:build:{image_type}:{arch_slug}",
+                        unless_up_to_date(lambda t=image_type, a=arch_slug: self.oci_images_by_type[t].build_arch(a)),
+                        [version_stage, image_stage],
+                        RESOURCE_CPU,
+                    )
+                if do_push:
+                    push_stages.append(
+                        executor.add(
+                            f"{s}:push:{image_type}:{arch_slug}",
+                            unless_up_to_date(
+                                lambda t=image_type, a=arch_slug: self.oci_images_by_type[t].push_arch(a)
+                            ),
+                            [version_stage, image_stage],
+                            RESOURCE_REGISTRY,
+                        )
+                    )
+            if do_push:
+                manifest_stages.append(
+                    executor.add(
+                        f"{s}:manifest:{image_type}",
+                        unless_up_to_date(lambda t=image_type: self.oci_images_by_type[t].push_manifest()),
+                        push_stages,
+                        RESOURCE_REGISTRY,
+                    )
+                )
+
+        if admit_stage is not None:
+            entry_stages = [name for name in executor.nodes if name.startswith(f"{s}:")]
+            executor.add(
+                f"{s}:cleanup",
+                lambda: self.cleanup_workspace(executor, remove_files=do_push and not self.failed_in(executor)),
+                entry_stages,
+                always=True,
+            )
+
+    def stage_extract(self, executor: StageExecutor, arch: DistroBaseArchInfo):
+        self.handle_extract_kernel_initrd(arch, executor.pool.lease_nbd)
+
+    def reserve_disk(self, executor: StageExecutor):
+        # A rough per-distro estimate: both arches' qcow2s plus the (compressed) disk layers built from them.
+        estimate = parse_size(os.environ.get("MATRIX_DISK_PER_DISTRO", "12G"))
+        executor.pool.disk.reserve(self.slug(), estimate)
+
+    def failed_in(self, executor: StageExecutor) -> bool:
+        return any(name.startswith(f"{self.slug()}:") for name in list(executor.failures) + executor.skipped)
+
+    def cleanup_workspace(self, executor: StageExecutor, remove_files: bool):
+        # The artifact store keeps its own hardlink of each qcow2, so a rerun gets them back without downloading.
+        if remove_files and os.environ.get("MATRIX_CLEANUP", "yes") == "yes":
+            for arch in self.arches:
+                for filename in [arch.qcow2_filename, arch.vmlinuz_final_filename, arch.initramfs_final_filename]:
+                    if filename is not None and os.path.exists(filename):
+                        log.info(f"Removing {filename}")
+                        os.unlink(filename)
+            for oci_image in self.oci_images or []:
+                for arch_image in oci_image.arch_images.values():
+                    if os.path.isdir(arch_image.oci_layout_dir):
+                        log.info(f"Removing {arch_image.oci_layout_dir}")
+                        shutil.rmtree(arch_image.oci_layout_dir)
+        executor.pool.disk.release(self.slug())
+
+    def stage_version(self):
+        self.finalize_version()
         self.oci_images: list[MultiArchImage] = self.get_oci_image_definitions()
         self.oci_images_by_type: dict[str, MultiArchImage] = {}
         for oci_image in self.oci_images:
             self.oci_images_by_type[oci_image.type] = oci_image
+            log.info("oci_image: %s", oci_image)
+            pprint(oci_image)
 
         # check if versioned images already exist; if so, do nothing -- no use in rebuilding
-        all_up_to_date = True
-        for oci_image in self.oci_images:
-            skopeo_result = skopeo_inspect_remote_ref(oci_image.full_ref_version)
-            log.info(f"skopeo_result: '{skopeo_result}' for '{oci_image.full_ref_version}'")
-            if skopeo_result is None:
-                all_up_to_date = False
+        existing = refs_exist([oci_image.full_ref_version for oci_image in self.oci_images])
+        all_up_to_date = all(existing.values())
+        self.up_to_date = all_up_to_date
 
         gha_skopeo = "yes" if all_up_to_date else "no"
         set_gha_output("uptodate", gha_skopeo)
@@ -152,27 +308,6 @@ class DistroBaseInfo:
 
         self.template_example()
 
-        # If running on Darwin, log and return. We need Linux to run qemu-nbd.
-        if os.uname().sysname != "Linux":
-            log.warning("Not on Linux, cannot run qemu-nbd to extract kernel and initrd from qcow2.")
-            return
-
-        if os.environ.get("DO_DOWNLOAD_QCOW2", "") == "yes":
-            self.download_qcow2()
-        if os.environ.get("DO_EXTRACT_KERNEL", "") == "yes":
-            self.extract_kernel_initrd()
-
-        for oci_image in self.oci_images:
-            log.info("oci_image: %s", oci_image)
-            pprint(oci_image)
-            if os.environ.get("DO_DOCKER_BUILD", "") == "yes":
-                oci_image.build()
-            if os.environ.get("DO_DOCKER_PUSH", "") == "yes":
-                oci_image.push()
-            log.info("--------------------------------------------------------------------------------------------")
-
-        log.info("Done.")
-
     def template_example(self):
         # use jinja2 to template yaml file
 
@@ -3,8 +3,23 @@ import logging
 import os
 import string
 from abc import abstractmethod
+from urllib.error import URLError
 
+from artifacts import artifact_store
+from download import download
+from feeds import FeedImage
+from feeds import version_resolver
+from partitions import FILESYSTEM_READERS
+from partitions import Partition
+from partitions import boot_prefixes
+from partitions import directory_lister
+from partitions import find_kernel
+from partitions import glob_non_rescue
+from partitions import open_disk
+from partitions import scan_boot
+from tracing import span
 from utils import DevicePathMounter
+from utils import fetch_checksum_file
 from utils import NBDImageMounter
 from utils import setup_logging
 from utils import shell
@@ -24,9 +39,41 @@ class DistroBaseArchInfo:
     initramfs_final_filename: string = None
     qcow2_is_xz: bool
     qcow2_is_gz: bool
+    qcow2_checksum_url: string = None  # upstream SHA256SUMS/CHECKSUM-style file that lists qcow2_url's basename
+    qcow2_upstream_digest: tuple[str, str] | None = None  # (algo, hexdigest) of the bytes at qcow2_url, if known
+    qcow2_upstream_size: int | None = None  # size of the bytes at qcow2_url, if known
+    download_source: str | None = None  # where the qcow2 came from: "network", "store" or "workspace"
+    artifact_sizes: dict[str, int]  # "qcow2", "vmlinuz", "initramfs" -> bytes, noted as they are produced
 
-    @abstractmethod
     def grab_version(self) -> string:
+        # VERSION_RESOLVER=feed (default) reads the distro's machine-readable metadata, which also has the image's
+        # size and checksum; without a feed, or if it cannot be read or has no image for us, scrape the index pages.
+        if version_resolver() == "feed":
+            try:
+                image = self.feed_image()
+            except Exception as e:
+                log.warning(f"Feed for {self.slug} failed, falling back to scraping: {e}")
+                image = None
+            if image is not None:
+                log.info(f"Feed image for {self.slug}: {image}")
+                self.version = image.version
+                index_url, filename = image.url.rsplit("/", 1)
+                self.set_image(f"{index_url}/", filename)
+                self.qcow2_upstream_digest = image.digest
+                self.qcow2_upstream_size = image.size
+                return
+        self.scrape_version()
+
+    def feed_image(self) -> FeedImage | None:
+        return None  # no structured feed for this distro
+
+    @abstractmethod
+    def scrape_version(self):
+        pass
+
+    @abstractmethod
+    def set_image(self, index_url: string, filename: string):
+        # qcow2_url and the local filenames, for the image filename in index_url; self.version is already set
         pass
 
     def __init__(self, distro, docker_slug, slug):
@@ -35,45 +82,102 @@ class DistroBaseArchInfo:
         self.slug = slug
         self.qcow2_is_xz = False
         self.qcow2_is_gz = False
+        self.qcow2_checksum_url = None
+        self.qcow2_upstream_digest = None
+        self.qcow2_upstream_size = None
+        self.download_source = None
+        self.artifact_sizes = {}
+
+    @property
+    def qcow2_compression(self) -> str | None:
+        if self.qcow2_is_xz:
+            return "xz"
+        if self.qcow2_is_gz:
+            return "gz"
+        return None
 
     def download_arch_qcow2(self):
         log.info(f"Architecture: {self.slug}: {self}")
         log.info(f"Downloading {self.qcow2_url} to {self.qcow2_filename}")
         # Only download if filename is not already downloaded.
-        if not os.path.exists(self.qcow2_filename):
-            log.info(f"Downloading {self.qcow2_url} to {self.qcow2_filename}")
+        if os.path.exists(self.qcow2_filename):
+            log.info(f"Skipping download, {self.qcow2_filename} already exists")
+            self.download_source = "workspace"
+        else:
+            # "stream" (default) downloads in ranged segments (see DOWNLOAD_SEGMENTS) and decompresses on the fly;
+            # "curl" is the old curl + pixz/pigz two-step.
+            download_mode = os.environ.get("DOWNLOAD_MODE", "stream")
+            if download_mode == "stream":
+                self.download_arch_qcow2_stream()
+            elif download_mode == "curl":
+                self.download_arch_qcow2_curl()
+            else:
+                raise Exception(f"Unknown DOWNLOAD_MODE: {download_mode}")
+        # the workspace files may be cleaned up before the run is recorded in the history
+        self.artifact_sizes["qcow2"] = os.path.getsize(self.qcow2_filename)
+
+    def upstream_checksum(self) -> tuple[str, str] | None:
+        if self.qcow2_upstream_digest is None and self.qcow2_checksum_url is not None:
+            try:
+                checksums = fetch_checksum_file(self.qcow2_checksum_url)
+                self.qcow2_upstream_digest = checksums.get(os.path.basename(self.qcow2_url))
+            except URLError as e:
+                log.warning(f"Could not fetch upstream checksums from {self.qcow2_checksum_url}: {e}")
+            if self.qcow2_upstream_digest is None:
+                log.warning(f"No upstream checksum for {self.qcow2_url} in {self.qcow2_checksum_url}")
+        return self.qcow2_upstream_digest
+
+    def download_arch_qcow2_stream(self):
+        expected = self.upstream_checksum()
+        # Upstream digests identify content; without one, the URL (which carries the version) has to do.
+        source_key = f"{expected[0]}:{expected[1]}" if expected is not None else self.qcow2_url
+        store = artifact_store()
+        if store is not None and store.materialize(source_key, self.qcow2_filename):
+            self.download_source = "store"
+            return
 
-            # Use the shell to do the download, using curl -o's output filename option. -L follows redirects.
-            down_output_fn = f"{self.qcow2_filename}.tmp"
+        # noinspection PyUnresolvedReferences
+        mirrors = self.distro.mirrors
+        sources = mirrors.urls_for(self.qcow2_url) if mirrors is not None else None
+        result = download(self.qcow2_url, self.qcow2_filename, self.qcow2_compression, expected, sources)
+        self.download_source = "network"
+        if store is not None:
+            store.ingest(self.qcow2_filename, result.sha256, source_key)
 
-            if self.qcow2_is_xz:
-                log.info(f"Adding .xz extension to {down_output_fn}")
-                down_output_fn += ".xz"
+    def download_arch_qcow2_curl(self):
+        log.info(f"Downloading {self.qcow2_url} to {self.qcow2_filename}")
 
-            if self.qcow2_is_gz:
-                log.info(f"Adding .gz extension to {down_output_fn}")
-                down_output_fn += ".gz"
+        # Use the shell to do the download, using curl -o's output filename option. -L follows redirects.
+        down_output_fn = f"{self.qcow2_filename}.tmp"
 
-            shell_passthrough([f"curl", "-L", "-o", down_output_fn, f"{self.qcow2_url}"])
-            log.info(f"Downloaded {self.qcow2_url} to {down_output_fn}")
+        if self.qcow2_is_xz:
+            log.info(f"Adding .xz extension to {down_output_fn}")
+            down_output_fn += ".xz"
 
-            if self.qcow2_is_xz:  # uncompress, using pixz
-                log.info(f"Uncompressing {down_output_fn} to {self.qcow2_filename}")
-                shell_passthrough([f"pixz", "-d", f"{down_output_fn}"])
-                down_output_fn = down_output_fn[:-3]  # # remove the .xz extension from the filename
+        if self.qcow2_is_gz:
+            log.info(f"Adding .gz extension to {down_output_fn}")
+            down_output_fn += ".gz"
 
-            if self.qcow2_is_gz:  # uncompress, using pigz
-                log.info(f"Uncompressing {down_output_fn} to {self.qcow2_filename}")
-                shell_passthrough([f"pigz", "-d", f"{down_output_fn}"])
-                down_output_fn = down_output_fn[:-3]  # # remove the .gz extension from the filename
+        shell_passthrough([f"curl", "-L", "-o", down_output_fn, f"{self.qcow2_url}"])
+        self.download_source = "network"
+        log.info(f"Downloaded {self.qcow2_url} to {down_output_fn}")
 
-            # Rename the temp file to the final filename.
-            log.info(f"Renaming {down_output_fn} to {self.qcow2_filename}")
-            os.rename(f"{down_output_fn}", self.qcow2_filename)
-        else:
-            log.info(f"Skipping download, {self.qcow2_filename} already exists")
+        if self.qcow2_is_xz:  # uncompress, using pixz
+            log.info(f"Uncompressing {down_output_fn} to {self.qcow2_filename}")
+            shell_passthrough([f"pixz", "-d", f"{down_output_fn}"])
+            down_output_fn = down_output_fn[:-3]  # # remove the .xz extension from the filename
 
-    def extract_kernel_initrd_from_qcow2(self, nbd_counter, vmlinuz_glob=None, initramfs_glob=None):
+        if self.qcow2_is_gz:  # uncompress, using pigz
+            log.info(f"Uncompressing {down_output_fn} to {self.qcow2_filename}")
+            shell_passthrough([f"pigz", "-d", f"{down_output_fn}"])
+            down_output_fn = down_output_fn[:-3]  # # remove the .gz extension from the filename
+
+        # Rename the temp file to the final filename.
+        log.info(f"Renaming {down_output_fn} to {self.qcow2_filename}")
+        os.rename(f"{down_output_fn}", self.qcow2_filename)
+
+    def extract_kernel_initrd_from_qcow2(self, nbd_lease, vmlinuz_glob=None, initramfs_glob=None):
+        # nbd_lease() leases an NBD device number, only needed if the kernel's filesystem has to be mounted
         if initramfs_glob is None:
             initramfs_glob = ["initramfs-*", "initrd.img-*"]
         if vmlinuz_glob is None:
@@ -82,31 +186,83 @@ class DistroBaseArchInfo:
             log.info(
                 f"Skipping extraction, {self.vmlinuz_final_filename} and {self.initramfs_final_filename} already exist"
             )
-            return
+        else:
+            found, candidates = self.locate_kernel(vmlinuz_glob)
+            if found is not None:
+                self.extract_from_image(*found, vmlinuz_glob, initramfs_glob)
+            else:
+                with nbd_lease() as nbd_counter:
+                    self.extract_mounted(nbd_counter, candidates, vmlinuz_glob, initramfs_glob)
+        self.artifact_sizes["vmlinuz"] = os.path.getsize(self.vmlinuz_final_filename)
+        self.artifact_sizes["initramfs"] = os.path.getsize(self.initramfs_final_filename)
+
+    def locate_kernel(
+        self, vmlinuz_glob: list[str]
+    ) -> tuple[tuple[Partition, str] | None, list[tuple[int, str | None]]]:
+        """
+        The partition and directory prefix of the kernel, if found without mounting; else the (partition, prefix)
+        to mount and look in, in order, a None prefix meaning look for it. The distro's hint comes last, as the
+        definitive attempt, whose failure lists what the partition does hold.
+        """
+        hint = (self.boot_partition_num(), self.boot_dir_prefix())
+        try:
+            with span("scan_partitions", "extract", image=self.qcow2_filename), open_disk(self.qcow2_filename) as disk:
+                scan = scan_boot(disk, vmlinuz_glob, *hint)
+        except Exception as e:
+            log.warning(f"Could not scan the partitions of {self.qcow2_filename}, using partition {hint[0]}: {e}")
+            return None, [hint]
+        if scan.found is not None:
+            partition, prefix = scan.found
+            if (partition.number, prefix) != hint:
+                log.warning(f"Kernel is in partition {partition.number} under '{prefix}', not {hint} as hinted")
+            return scan.found, []
+        return None, [(number, None) for number in scan.undecided] + [hint]
+
+    def extract_from_image(self, partition: Partition, prefix: str, vmlinuz_glob, initramfs_glob):
+        # read straight out of the qcow2: no NBD device, no mount, no root
+        with open_disk(self.qcow2_filename) as disk:
+            filesystem = FILESYSTEM_READERS[partition.filesystem](disk, partition)
+            vmlinuz_filename = glob_non_rescue(filesystem.listdir, prefix, vmlinuz_glob)
+            log.info(f"vmlinuz_filename: {vmlinuz_filename}")
+            self.copy_from_image(filesystem, vmlinuz_filename, self.vmlinuz_final_filename)
+
+            initramfs_filename = glob_non_rescue(filesystem.listdir, prefix, initramfs_glob)
+            log.info(f"initramfs_filename: {initramfs_filename}")
+            self.copy_from_image(filesystem, initramfs_filename, self.initramfs_final_filename)
+
+    def extract_mounted(self, nbd_counter, candidates: list[tuple[int, str | None]], vmlinuz_glob, initramfs_glob):
+        with NBDImageMounter(nbd_counter, self.qcow2_filename, candidates[0][0]) as nbd:
+            for partition, prefix in candidates:
+                nbd.wait_for_partitions(partition)
+                with DevicePathMounter(nbd.nbd_device, partition, f"mnt-{self.qcow2_filename}") as mp:
+                    if prefix is None:
+                        lister = directory_lister(mp.mountpoint)
+                        prefix = find_kernel(lister, vmlinuz_glob, boot_prefixes(self.boot_dir_prefix()))
+                    if prefix is None:
+                        log.info(f"No {vmlinuz_glob} in partition {partition}")
+                        continue
+                    vmlinuz_filename = mp.glob_non_rescue(prefix, vmlinuz_glob)
+                    log.info(f"vmlinuz_filename: {vmlinuz_filename}")
+                    self.copy_out(f"{mp.mountpoint}/{vmlinuz_filename}", self.vmlinuz_final_filename)
+
+                    initramfs_filename = mp.glob_non_rescue(prefix, initramfs_glob)
+                    log.info(f"initramfs_filename: {initramfs_filename}")
+                    self.copy_out(f"{mp.mountpoint}/{initramfs_filename}", self.initramfs_final_filename)
+                    return
+
+    @staticmethod
+    def copy_from_image(filesystem, src: string, dst: string):
+        with span("copy", "extract", src=src) as s, open(f"{dst}.tmp", "wb") as fh:
+            for chunk in filesystem.stream(src):
+                fh.write(chunk)
+                s.add_bytes(len(chunk))
+        os.replace(f"{dst}.tmp", dst)
 
-        with NBDImageMounter(nbd_counter, self.qcow2_filename) as nbd:
-            with DevicePathMounter(nbd.nbd_device, self.boot_partition_num(), f"mnt-{self.qcow2_filename}") as mp:
-                vmlinuz_filename = mp.glob_non_rescue(self.boot_dir_prefix(), vmlinuz_glob)
-                log.info(f"vmlinuz_filename: {vmlinuz_filename}")
-                shell(
-                    [
-                        "cp",
-                        "-v",
-                        f"{mp.mountpoint}/{vmlinuz_filename}",
-                        f"{self.vmlinuz_final_filename}",
-                    ]
-                )
-
-                initramfs_filename = mp.glob_non_rescue(self.boot_dir_prefix(), initramfs_glob)
-                log.info(f"initramfs_filename: {initramfs_filename}")
-                shell(
-                    [
-                        "cp",
-                        "-v",
-                        f"{mp.mountpoint}/{initramfs_filename}",
-                        f"{self.initramfs_final_filename}",
-                    ]
-                )
+    @staticmethod
+    def copy_out(src: string, dst: string):
+        with span("copy", "extract", src=src) as s:
+            shell(["cp", "-v", src, dst])
+            s.add_bytes(os.path.getsize(dst))
 
     def kernel_cmdline(self) -> list[string]:
         if self.docker_slug == "arm64":
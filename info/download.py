@@ -0,0 +1,664 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import hashlib
+import json
+import logging
+import lzma
+import os
+import re
+import queue
+import threading
+import time
+import zlib
+from urllib.request import Request
+from urllib.request import urlopen
+
+from artifacts import parse_size
+from tracing import span
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("download")
+
+CHUNK_SIZE = 1024 * 1024
+QUEUE_DEPTH = 16
+USER_AGENT = "cloud-container-disk"
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+SEGMENT_RETRIES = 5
+JOURNAL_SAVE_INTERVAL = 1.0  # seconds
+STALL_WINDOW = 5.0  # seconds over which a request's throughput is judged
+HEDGE_LEAD = 2 * CHUNK_SIZE  # a request this far behind another one racing for the same segment gives up
+
+
+class StageMeter:
+    name: str
+    bytes_in: int
+    bytes_out: int
+    seconds: float
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def add(self, bytes_in: int, bytes_out: int, seconds: float):
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.seconds += seconds
+
+    def throughput(self) -> float:
+        return self.bytes_out / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.bytes_in / 1024 / 1024:.1f} MiB in, {self.bytes_out / 1024 / 1024:.1f} MiB out, "
+            f"{self.seconds:.2f}s busy, {self.throughput() / 1024 / 1024:.1f} MiB/s"
+        )
+
+
+class Decompressor:
+    """Incremental xz/gz decompressor that copes with concatenated streams/members (pixz, pigz)."""
+
+    def __init__(self, compression: str | None):
+        if compression not in (None, "xz", "gz"):
+            raise Exception(f"Unknown compression '{compression}'")
+        self.compression = compression
+        self.impl = self._new()
+        self.in_stream = False  # True while the current stream/member has started but not reached its end
+
+    def _new(self):
+        if self.compression == "xz":
+            return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+        if self.compression == "gz":
+            return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        return None
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.impl is None:
+            return data
+        out = []
+        while data:
+            self.in_stream = True
+            out.append(self.impl.decompress(data))
+            if not self.impl.eof:
+                break
+            # end of one stream/member; anything left over belongs to the next one
+            data = self.impl.unused_data
+            self.impl = self._new()
+            self.in_stream = False
+        return b"".join(out)
+
+    def truncated(self) -> bool:
+        return self.in_stream
+
+    def flush(self) -> bytes:
+        if self.impl is None or self.compression != "gz":
+            return b""
+        return self.impl.flush()
+
+
+def _pump(name: str, src, dst: queue.Queue, abort: threading.Event, errors: list, func):
+    # Generic pipeline stage: pull from src (a callable returning b"" at EOF, or a queue), push results into dst.
+    eof = False
+    with span(name, "download") as s:
+        try:
+            while not abort.is_set():
+                chunk = src() if callable(src) else src.get()
+                if chunk is None or chunk == b"":
+                    eof = True
+                    result = func(None)
+                    if result:
+                        s.add_bytes(len(result))
+                        dst.put(result)
+                    break
+                result = func(chunk)
+                if result:
+                    s.add_bytes(len(result))
+                    dst.put(result)
+        except BaseException as e:
+            log.error(f"Download pipeline stage '{name}' failed: {e}")
+            s.set(error=f"{type(e).__name__}: {e}"[:300])
+            errors.append(e)
+            abort.set()
+        finally:
+            dst.put(None)
+            # keep draining, so the upstream stage never blocks forever on a full queue
+            while not eof and not callable(src):
+                eof = src.get() is None
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class DownloadResult:
+    """Meters and digests of one download; hashes are computed while the bytes stream past, never in a second pass."""
+
+    meters: dict[str, StageMeter]
+    source_hashes: dict[str, "hashlib._Hash"]  # over the bytes as downloaded (possibly compressed)
+    output_hash: "hashlib._Hash"  # sha256 over the final, decompressed bytes
+
+    def __init__(self, compression: str | None, expected: tuple[str, str] | None):
+        self.meters = {name: StageMeter(name) for name in ("network", "decompress", "write")}
+        self.expected = expected
+        self.output_hash = hashlib.sha256()
+        self.source_hashes = {}
+        if expected is not None:
+            self.source_hashes[expected[0]] = hashlib.new(expected[0])
+        if compression is None:
+            # the downloaded bytes are the output bytes; don't hash them twice
+            self.source_hashes["sha256"] = self.output_hash
+
+    def update_source(self, chunk: bytes):
+        for source_hash in self.source_hashes.values():
+            if source_hash is not self.output_hash:
+                source_hash.update(chunk)
+
+    def update_output(self, chunk: bytes):
+        self.output_hash.update(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self.output_hash.hexdigest()
+
+    def verify(self, src: str):
+        if self.expected is None:
+            log.info(f"No upstream checksum for {src}; sha256 of output is {self.sha256}")
+            return
+        algo, expected_hex = self.expected
+        actual_hex = self.source_hashes[algo].hexdigest()
+        if actual_hex != expected_hex.lower():
+            raise ChecksumMismatch(f"Checksum mismatch for {src}: {algo} expected {expected_hex} got {actual_hex}")
+        log.info(f"[green]Verified {algo} of {src}[/green]: {actual_hex}")
+
+
+def _run_pipeline(read_chunk, output_filename: str, compression: str | None, result: DownloadResult, src: str):
+    """
+    Pulls compressed chunks via read_chunk() (b"" at EOF) and decompresses them into output_filename.
+    Reading, decompression and disk writes each run in their own thread, connected by bounded queues.
+    The output is written to a .tmp file, verified, and atomically renamed when complete.
+    """
+    meters = result.meters
+    tmp_filename = f"{output_filename}.tmp"
+    errors: list[BaseException] = []
+    abort = threading.Event()
+    compressed_q: queue.Queue = queue.Queue(maxsize=QUEUE_DEPTH)
+    plain_q: queue.Queue = queue.Queue(maxsize=QUEUE_DEPTH)
+    decompressor = Decompressor(compression)
+
+    log.info(f"Streaming {src} to {output_filename} (compression: {compression})")
+    started = time.monotonic()
+    with open(tmp_filename, "wb") as out:
+
+        def decompress(chunk: bytes | None) -> bytes:
+            t0 = time.monotonic()
+            result = decompressor.flush() if chunk is None else decompressor.decompress(chunk)
+            meters["decompress"].add(len(chunk or b""), len(result), time.monotonic() - t0)
+            return result
+
+        def write(chunk: bytes | None) -> None:
+            if chunk is None:
+                return
+            t0 = time.monotonic()
+            out.write(chunk)
+            result.update_output(chunk)
+            meters["write"].add(len(chunk), len(chunk), time.monotonic() - t0)
+
+        def hash_source(chunk: bytes | None) -> bytes | None:
+            if chunk is not None:
+                result.update_source(chunk)
+            return chunk
+
+        threads = [
+            threading.Thread(target=_pump, args=("read", read_chunk, compressed_q, abort, errors, hash_source)),
+            threading.Thread(target=_pump, args=("decompress", compressed_q, plain_q, abort, errors, decompress)),
+        ]
+        for thread in threads:
+            thread.start()
+        _pump("write", plain_q, queue.Queue(), abort, errors, write)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        os.unlink(tmp_filename)
+        raise errors[0]
+    if decompressor.truncated():
+        os.unlink(tmp_filename)
+        raise Exception(f"Truncated {compression} stream downloading {src}")
+    try:
+        result.verify(src)
+    except Exception:
+        os.unlink(tmp_filename)
+        raise
+
+    os.replace(tmp_filename, output_filename)
+    elapsed = time.monotonic() - started
+    for meter in meters.values():
+        log.info(f"[bold]{meter}[/bold]")
+    log.info(
+        f"Streamed {src} to {output_filename}: {meters['write'].bytes_out / 1024 / 1024:.1f} MiB "
+        f"in {elapsed:.2f}s ({meters['write'].bytes_out / 1024 / 1024 / max(elapsed, 0.001):.1f} MiB/s)"
+    )
+
+
+def stream_download(
+    url: str, output_filename: str, compression: str | None = None, expected: tuple[str, str] | None = None
+) -> DownloadResult:
+    """Single-connection download, decompressed on the fly into output_filename; the final bytes are written once."""
+    result = DownloadResult(compression, expected)
+    with urlopen(Request(url, headers={"User-Agent": USER_AGENT})) as response:
+
+        def read_network():
+            t0 = time.monotonic()
+            chunk = response.read(CHUNK_SIZE)
+            result.meters["network"].add(len(chunk), len(chunk), time.monotonic() - t0)
+            return chunk
+
+        _run_pipeline(read_network, output_filename, compression, result, url)
+    return result
+
+
+class RangeProbe:
+    size: int | None
+    accepts_ranges: bool
+    etag: str | None
+    last_modified: str | None
+
+    def __init__(self, url: str):
+        # A 1-byte ranged GET is more reliable than HEAD: some servers answer HEAD differently, or not at all.
+        headers = {"User-Agent": USER_AGENT, "Range": "bytes=0-0"}
+        with urlopen(Request(url, headers=headers)) as response:
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            content_range = response.headers.get("Content-Range", "")
+            match = re.fullmatch(r"bytes 0-0/(\d+)", content_range.strip())
+            if response.status == 206 and match:
+                self.accepts_ranges = True
+                self.size = int(match.group(1))
+            else:
+                self.accepts_ranges = False
+                length = response.headers.get("Content-Length")
+                self.size = int(length) if length is not None else None
+        log.debug(f"RangeProbe {url}: {self}")
+
+    def validator(self) -> str | None:
+        # Weak ETags are not allowed in If-Range; fall back to Last-Modified then.
+        if self.etag is not None and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+    def __repr__(self):
+        return f"RangeProbe(size={self.size}, ranges={self.accepts_ranges}, etag={self.etag}, lm={self.last_modified})"
+
+
+class Segment:
+    start: int
+    end: int  # exclusive
+    done: int
+
+    def __init__(self, start, end, done=0):
+        self.start = start
+        self.end = end
+        self.done = done
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start
+
+    @property
+    def complete(self) -> bool:
+        return self.done >= self.length
+
+
+class Fetch:
+    # One HTTP request filling (the rest of) a segment from one of the sources.
+    segment: Segment
+    source: int
+    window_start: float
+    window_bytes: int
+    hedged: bool
+
+    def __init__(self, segment: Segment, source: int):
+        self.segment = segment
+        self.source = source
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.hedged = False
+
+
+class RangeDownloader:
+    """
+    Fetches url into a preallocated sparse part_filename using N concurrent HTTP Range requests.
+    Progress is kept in a sidecar JSON journal, so an interrupted download resumes where each segment stopped;
+    the journal holds the validators of the source they were probed from, which a resume has to probe again.
+    The contiguous downloaded prefix can be consumed in order with read_tail(), while segments are still running.
+    With several sources (the same file on other mirrors, best first), a request that stays below
+    MIRROR_STALL_SPEED (default 1M per second) for STALL_WINDOW gets a hedge: the rest of its segment is also
+    requested from the next source, both race, and the one that falls behind gives up. Failed segments are
+    retried on the next source.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        part_filename: str,
+        probe: RangeProbe,
+        num_segments: int,
+        meter: StageMeter,
+        sources: list[str] | None = None,
+    ):
+        self.url = url
+        self.sources = sources or [url]
+        self.stall_speed = parse_size(os.environ.get("MIRROR_STALL_SPEED", "1M"))
+        self.fetches: set[Fetch] = set()
+        self.part_filename = part_filename
+        self.journal_filename = f"{part_filename}.journal"
+        self.probe = probe
+        self.meter = meter
+        self.cond = threading.Condition()
+        self.errors: list[BaseException] = []
+        self.aborted = False
+        self.threads: list[threading.Thread] = []
+        self.tail_pos = 0
+        self.journal_saved_at = 0.0
+        self.segments = self._load_journal() or self._plan_segments(num_segments)
+        self.fd = os.open(part_filename, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self.fd, probe.size)  # sparse preallocation
+
+    def _journal_identity(self) -> dict:
+        # the probe (and so the ETag and Last-Modified) is of sources[0], which is not always the same mirror
+        return {
+            "url": self.url,
+            "source": self.sources[0],
+            "size": self.probe.size,
+            "etag": self.probe.etag,
+            "last_modified": self.probe.last_modified,
+        }
+
+    @staticmethod
+    def journal_source(part_filename: str) -> str | None:
+        """The source the journal of part_filename was probed from, None without a (readable) journal."""
+        try:
+            with open(f"{part_filename}.journal") as fh:
+                return json.load(fh).get("identity", {}).get("source")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _load_journal(self) -> list[Segment] | None:
+        if not (os.path.exists(self.journal_filename) and os.path.exists(self.part_filename)):
+            return None
+        try:
+            with open(self.journal_filename) as fh:
+                journal = json.load(fh)
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring unreadable journal {self.journal_filename}: {e}")
+            return None
+        if journal.get("identity") != self._journal_identity():
+            log.warning(f"Journal {self.journal_filename} is for a different upstream file, starting over")
+            return None
+        segments = [Segment(seg["start"], seg["end"], seg["done"]) for seg in journal["segments"]]
+        done = sum(seg.done for seg in segments)
+        log.info(f"Resuming {self.url} from journal: {done}/{self.probe.size} bytes already downloaded")
+        return segments
+
+    def _plan_segments(self, num_segments: int) -> list[Segment]:
+        size = self.probe.size
+        num_segments = max(1, min(num_segments, size // MIN_SEGMENT_SIZE))
+        step = -(-size // num_segments)  # ceil
+        segments = [Segment(start, min(start + step, size)) for start in range(0, size, step)]
+        log.info(f"Downloading {self.url} ({size} bytes) in {len(segments)} segments")
+        return segments
+
+    def _save_journal(self, force=False):
+        # called with self.cond held
+        now = time.monotonic()
+        if not force and now - self.journal_saved_at < JOURNAL_SAVE_INTERVAL:
+            return
+        self.journal_saved_at = now
+        journal = {
+            "identity": self._journal_identity(),
+            "segments": [{"start": seg.start, "end": seg.end, "done": seg.done} for seg in self.segments],
+        }
+        with open(f"{self.journal_filename}.tmp", "w") as fh:
+            json.dump(journal, fh)
+        os.replace(f"{self.journal_filename}.tmp", self.journal_filename)
+
+    def start(self):
+        with self.cond:
+            self._save_journal(force=True)
+        for num, segment in enumerate(self.segments):
+            if segment.complete:
+                continue
+            thread = threading.Thread(target=self._run_segment, args=(segment,), name=f"segment-{num}")
+            self.threads.append(thread)
+            thread.start()
+        if len(self.sources) > 1:
+            threading.Thread(target=self._watch_stalls, name="stall-watch", daemon=True).start()
+
+    def _watch_stalls(self):
+        while True:
+            with self.cond:
+                if self.aborted or all(segment.complete for segment in self.segments):
+                    return
+                now = time.monotonic()
+                for fetch in list(self.fetches):
+                    elapsed = now - fetch.window_start
+                    if elapsed < STALL_WINDOW:
+                        continue
+                    speed = fetch.window_bytes / elapsed
+                    if speed < self.stall_speed and not fetch.hedged:
+                        fetch.hedged = True
+                        self._start_hedge(fetch, speed)
+                    fetch.window_start, fetch.window_bytes = now, 0
+            time.sleep(1.0)
+
+    def _start_hedge(self, fetch: Fetch, speed: float):
+        # called with self.cond held
+        segment, source = fetch.segment, (fetch.source + 1) % len(self.sources)
+        log.info(
+            f"Segment {segment.start}-{segment.end} stalled at {speed / 1024:.0f} KiB/s on "
+            f"{self.sources[fetch.source]}; hedging on {self.sources[source]}"
+        )
+
+        def hedge():
+            try:
+                self._fetch_segment(segment, source)
+            except Exception as e:
+                log.warning(f"Hedge of segment {segment.start}-{segment.end} on {self.sources[source]} failed: {e}")
+
+        thread = threading.Thread(target=hedge, name=f"hedge-{segment.start}")
+        self.threads.append(thread)
+        thread.start()
+
+    def _run_segment(self, segment: Segment):
+        attempt = 0
+        source = 0
+        while not segment.complete and not self.aborted:
+            with self.cond:
+                if any(fetch.segment is segment for fetch in self.fetches):
+                    # a hedge got ahead of this segment's request; let it finish (or fail) before going again
+                    self.cond.wait(1.0)
+                    continue
+            try:
+                self._fetch_segment(segment, source)
+            except Exception as e:
+                attempt += 1
+                source = (source + 1) % len(self.sources)
+                if attempt > SEGMENT_RETRIES:
+                    log.error(f"Segment {segment.start}-{segment.end} of {self.url} failed for good: {e}")
+                    with self.cond:
+                        self.errors.append(e)
+                        self.aborted = True
+                        self.cond.notify_all()
+                    return
+                log.warning(f"Segment {segment.start}-{segment.end} of {self.url} failed (attempt {attempt}): {e}")
+                time.sleep(min(2**attempt, 30))
+
+    def _fetch_segment(self, segment: Segment, source: int = 0):
+        # Another request (a hedge, or the stalled one it hedges) may be filling the same segment: each writes
+        # where it is, the segment counts as done up to the furthest of them, and one that falls behind gives up.
+        with self.cond:
+            pos = segment.start + segment.done
+            fetch = Fetch(segment, source)
+            self.fetches.add(fetch)
+        headers = {"User-Agent": USER_AGENT, "Range": f"bytes={pos}-{segment.end - 1}"}
+        if source == 0 and self.probe.validator() is not None:
+            # a changed upstream answers 200 instead of 206; other mirrors have their own validators
+            headers["If-Range"] = self.probe.validator()
+        t0 = time.monotonic()
+        try:
+            with urlopen(Request(self.sources[source], headers=headers), timeout=60) as response:
+                if response.status != 206:
+                    raise Exception(f"Expected 206 Partial Content, got {response.status}; did upstream change?")
+                total = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+                if total != str(self.probe.size):
+                    raise Exception(f"{self.sources[source]} has {total} bytes, expected {self.probe.size}")
+                while not self.aborted:
+                    with self.cond:
+                        if segment.complete:
+                            return
+                        if segment.start + segment.done - pos >= HEDGE_LEAD:
+                            log.info(f"Segment {segment.start}-{segment.end}: {self.sources[source]} fell behind")
+                            return
+                    # read1: whatever has arrived, so a stalled request still gets to notice it has lost the race
+                    chunk = response.read1(min(CHUNK_SIZE, segment.end - pos))
+                    if not chunk:
+                        raise Exception(f"Short read at {pos}")
+                    os.pwrite(self.fd, chunk, pos)
+                    pos += len(chunk)
+                    now = time.monotonic()
+                    with self.cond:
+                        fetch.window_bytes += len(chunk)
+                        advanced = pos - segment.start - segment.done
+                        if advanced > 0:
+                            segment.done += advanced
+                            self.meter.add(advanced, advanced, now - t0)
+                            self._save_journal()
+                            self.cond.notify_all()
+                    t0 = now
+        finally:
+            with self.cond:
+                self.fetches.discard(fetch)
+
+    def _watermark(self) -> int:
+        # end of the contiguous prefix that is already on disk; called with self.cond held
+        for segment in self.segments:
+            if not segment.complete:
+                return segment.start + segment.done
+        return self.probe.size
+
+    def read_tail(self) -> bytes:
+        """Returns the next chunk of the contiguous downloaded prefix, blocking until there is one; b"" at EOF."""
+        with self.cond:
+            while self.tail_pos >= self._watermark() and self.tail_pos < self.probe.size:
+                if self.errors:
+                    raise self.errors[0]
+                if self.aborted:
+                    raise Exception(f"Download of {self.url} aborted")
+                self.cond.wait(1.0)
+            length = min(CHUNK_SIZE, self._watermark() - self.tail_pos)
+        if length <= 0:
+            return b""
+        chunk = os.pread(self.fd, length, self.tail_pos)
+        self.tail_pos += len(chunk)
+        return chunk
+
+    def stop(self):
+        # abort the segments and persist how far each one got, for the next run to resume from
+        with self.cond:
+            self.aborted = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        with self.cond:
+            self._save_journal(force=True)
+
+    def wait(self):
+        for thread in self.threads:
+            thread.join()
+        with self.cond:
+            self._save_journal(force=True)
+        if self.errors:
+            raise self.errors[0]
+        if not all(segment.complete for segment in self.segments):
+            raise Exception(f"Download of {self.url} incomplete")
+
+    def close(self, completed: bool):
+        if self.fd is None:
+            return
+        os.close(self.fd)
+        self.fd = None
+        if completed and os.path.exists(self.journal_filename):
+            os.unlink(self.journal_filename)
+
+
+def download(
+    url: str,
+    output_filename: str,
+    compression: str | None = None,
+    expected: tuple[str, str] | None = None,
+    sources: list[str] | None = None,
+) -> DownloadResult:
+    """
+    Downloads url into output_filename, decompressing on the fly.
+    Uses DOWNLOAD_SEGMENTS (default 4) concurrent Range requests when the server supports them, resuming
+    from the journal left by an interrupted run; falls back to a single stream otherwise.
+    sources are the URLs of the same file on mirrors, best first (default just url); see RangeDownloader.
+    If expected (algo, hexdigest) is given, the downloaded bytes are verified against it before the final rename.
+    """
+    with span("download", "download", url=url, compression=compression) as s:
+        result = _download(url, output_filename, compression, expected, sources)
+        s.add_bytes(result.meters["network"].bytes_in)
+        s.set(output_bytes=result.meters["write"].bytes_out or result.meters["network"].bytes_out)
+        return result
+
+
+def _download(
+    url: str, output_filename: str, compression: str | None, expected: tuple[str, str] | None, sources: list[str] | None
+) -> DownloadResult:
+    sources = sources or [url]
+    num_segments = int(os.environ.get("DOWNLOAD_SEGMENTS", "4"))
+    part_filename = f"{output_filename}.part"
+    resume_source = RangeDownloader.journal_source(part_filename)
+    if resume_source in sources[1:] and os.path.exists(part_filename):
+        # the mirror ranking may have changed since the interrupted run; its journal is only good against the
+        # validators of the mirror it was probed from, so that one goes first (hedging still covers a slow one)
+        log.info(f"Resuming from {resume_source}, the source {part_filename} was started from")
+        sources = [resume_source] + [source for source in sources if source != resume_source]
+    probe = RangeProbe(sources[0])
+    if num_segments <= 1 or not probe.accepts_ranges or not probe.size:
+        log.info(f"Server does not support ranges for {sources[0]} (or DOWNLOAD_SEGMENTS<=1), using a single stream")
+        return stream_download(sources[0], output_filename, compression, expected)
+
+    result = DownloadResult(compression, expected)
+    downloader = RangeDownloader(url, part_filename, probe, num_segments, result.meters["network"], sources)
+    completed = False
+    try:
+        downloader.start()
+        if compression is None:
+            # the part file is the final output already; just hash the contiguous prefix as it grows
+            while chunk := downloader.read_tail():
+                result.update_source(chunk)
+                result.update_output(chunk)
+            downloader.wait()
+            result.verify(url)
+            os.replace(part_filename, output_filename)
+            log.info(f"[bold]{result.meters['network']}[/bold]")
+        else:
+            _run_pipeline(downloader.read_tail, output_filename, compression, result, url)
+            downloader.wait()
+            os.unlink(part_filename)
+        completed = True
+    except ChecksumMismatch:
+        # resuming from a corrupt part file would only fail again; start over next time
+        downloader.stop()
+        downloader.close(completed=True)
+        if os.path.exists(part_filename):
+            os.unlink(part_filename)
+        raise
+    except BaseException:
+        downloader.stop()
+        log.warning(f"Download of {url} interrupted; {part_filename} and its journal are kept for resuming")
+        raise
+    finally:
+        downloader.close(completed)
+    return result
@@ -0,0 +1,215 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+
+from artifacts import parse_size
+from nbd import nbd_pool
+from tracing import span
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("executor")
+
+# Resource classes a stage can be bound to; each is a separate concurrency limit.
+RESOURCE_NETWORK = "network"  # index pages, APIs, checksums: short requests
+RESOURCE_DOWNLOAD = "download"  # qcow2 downloads: the bulk of the inbound bandwidth
+RESOURCE_REGISTRY = "registry"  # blob uploads and manifest pushes
+RESOURCE_CPU = "cpu"
+RESOURCE_NBD = "nbd"
+
+
+class DiskBudget:
+    """
+    Byte budget for workspaces (qcow2s, kernels, OCI layouts). A holder reserves its estimate once and keeps it
+    until release(); a reservation bigger than what is free only waits for the budget to drain completely.
+    """
+
+    budget_bytes: int
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.reserved: dict[str, int] = {}
+        self.condition = threading.Condition()
+
+    def reserve(self, holder: str, nbytes: int):
+        with self.condition:
+            if holder in self.reserved:
+                return
+            while self.reserved and sum(self.reserved.values()) + nbytes > self.budget_bytes:
+                log.info(f"Disk budget: {holder} waits for {nbytes} bytes, reserved: {self.reserved}")
+                self.condition.wait()
+            self.reserved[holder] = nbytes
+
+    def release(self, holder: str):
+        with self.condition:
+            self.reserved.pop(holder, None)
+            self.condition.notify_all()
+
+
+class ResourcePool:
+    limits: dict[str, int]
+
+    def __init__(self, limits: dict[str, int] | None = None):
+        if limits is None:
+            limits = {
+                RESOURCE_NETWORK: int(os.environ.get("EXECUTOR_NETWORK_WORKERS", "4")),
+                RESOURCE_DOWNLOAD: int(os.environ.get("EXECUTOR_DOWNLOAD_WORKERS", "4")),
+                RESOURCE_REGISTRY: int(os.environ.get("EXECUTOR_REGISTRY_WORKERS", "4")),
+                RESOURCE_CPU: int(os.environ.get("EXECUTOR_CPU_WORKERS", str(os.cpu_count() or 2))),
+                RESOURCE_NBD: int(os.environ.get("EXECUTOR_NBD_WORKERS", "2")),
+            }
+        self.limits = limits
+        self.semaphores = {name: threading.BoundedSemaphore(max(1, limit)) for name, limit in limits.items()}
+
+        disk_budget = os.environ.get("EXECUTOR_DISK_BUDGET", "")
+        if disk_budget:
+            budget_bytes = parse_size(disk_budget)
+        else:
+            budget_bytes = int(shutil.disk_usage(".").free * 0.8)
+        self.disk = DiskBudget(budget_bytes)
+        log.debug(f"ResourcePool limits: {self.limits}, disk budget {budget_bytes} bytes")
+
+    def semaphore(self, resource: str) -> threading.BoundedSemaphore:
+        if resource not in self.semaphores:
+            raise Exception(f"Unknown resource '{resource}', known: {list(self.semaphores.keys())}")
+        return self.semaphores[resource]
+
+    @contextmanager
+    def lease_nbd(self):
+        # An NBD slot and a distinct /dev/nbdN, which the host-wide pool hands out; taken by the extract stages
+        # only when they have to mount the image
+        with self.semaphore(RESOURCE_NBD), nbd_pool().lease() as device:
+            yield device
+
+
+class StageNode:
+    name: str
+    func: Callable[[], None]
+    deps: list[str]
+    resource: str | None
+    always: bool  # runs once its deps settled, even if some failed or were skipped (cleanups)
+
+    def __init__(self, name, func, deps, resource, always=False):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.resource = resource
+        self.always = always
+
+    def __repr__(self):
+        return f"StageNode({self.name}, deps={self.deps}, resource={self.resource}, always={self.always})"
+
+
+class StageExecutor:
+    """
+    Runs a DAG of stages; a stage starts as soon as its deps are done and its resource has a free slot.
+    By default the first failure stops scheduling and is re-raised. With keep_going, only the stages that
+    depend on a failed one are skipped (so independent distros in one graph carry on) and run() returns;
+    failures and skipped are then left for the caller.
+    """
+
+    nodes: dict[str, StageNode]
+    failures: dict[str, BaseException]
+    skipped: list[str]
+
+    def __init__(self, pool: ResourcePool | None = None, keep_going: bool = False):
+        self.pool = pool if pool is not None else ResourcePool()
+        self.keep_going = keep_going
+        self.nodes = {}
+        self.failures = {}
+        self.skipped = []
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], None],
+        deps: list[str] | None = None,
+        resource: str | None = None,
+        always: bool = False,
+    ):
+        if name in self.nodes:
+            raise Exception(f"Duplicate stage '{name}'")
+        deps = [dep for dep in (deps or []) if dep is not None]
+        for dep in deps:
+            if dep not in self.nodes:
+                raise Exception(f"Stage '{name}' depends on unknown stage '{dep}'")
+        if resource is not None:
+            self.pool.semaphore(resource)  # validate early
+        self.nodes[name] = StageNode(name, func, deps, resource, always)
+        return name
+
+    def _run_node(self, node: StageNode):
+        if node.resource is None:
+            log.info(f"[cyan]Stage start: [bold]{node.name}[/bold][/cyan]")
+            with span(node.name, "stage"):
+                node.func()
+            log.info(f"[cyan]Stage done: [bold]{node.name}[/bold][/cyan]")
+            return
+        queued = time.monotonic()
+        with self.pool.semaphore(node.resource):
+            log.info(f"[cyan]Stage start: [bold]{node.name}[/bold] ({node.resource})[/cyan]")
+            with span(node.name, "stage", resource=node.resource, waited=round(time.monotonic() - queued, 3)):
+                node.func()
+            log.info(f"[cyan]Stage done: [bold]{node.name}[/bold] ({node.resource})[/cyan]")
+
+    def _ready(self, pending: list[StageNode], done: set[str]) -> list[StageNode]:
+        """Moves stages that can no longer run to skipped; returns the ones that can start now."""
+        ready = []
+        changed = True
+        while changed:
+            changed = False
+            settled = done | set(self.failures) | set(self.skipped)
+            for node in list(pending):
+                blocked = any(dep in self.failures or dep in self.skipped for dep in node.deps)
+                blocked = blocked or (bool(self.failures) and not self.keep_going)
+                if not blocked:
+                    if all(dep in done for dep in node.deps):
+                        pending.remove(node)
+                        ready.append(node)
+                elif node.always:
+                    if all(dep in settled for dep in node.deps):
+                        pending.remove(node)
+                        ready.append(node)
+                else:
+                    log.warning(f"Skipping stage {node.name}, a stage it needs failed")
+                    pending.remove(node)
+                    self.skipped.append(node.name)
+                    changed = True
+        return ready
+
+    def run(self):
+        done: set[str] = set()
+        running: dict[Future, StageNode] = {}
+        pending: list[StageNode] = list(self.nodes.values())
+
+        # One thread per node at most; the ResourcePool semaphores are what actually bound concurrency.
+        with ThreadPoolExecutor(max_workers=max(1, len(self.nodes)), thread_name_prefix="stage") as tpe:
+            while pending or running:
+                for node in self._ready(pending, done):
+                    running[tpe.submit(self._run_node, node)] = node
+
+                if not running:
+                    if pending:
+                        raise Exception(f"Stage graph is stuck, unresolvable deps: {pending}")
+                    break
+
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    exc = future.exception()
+                    if exc is not None:
+                        log.error(f"Stage failed: {node.name}: {exc}")
+                        self.failures[node.name] = exc
+                        continue
+                    done.add(node.name)
+
+        if self.failures and not self.keep_going:
+            raise next(iter(self.failures.values()))
@@ -0,0 +1,324 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import logging
+import struct
+import threading
+from collections.abc import Iterator
+
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("ext4")
+
+EXT4_MAGIC = 0xEF53
+ROOT_INODE = 2
+READ_CHUNK = 4 * 1024 * 1024  # bytes per read of contiguous blocks
+MAX_SYMLINKS = 40
+
+INCOMPAT_FILETYPE = 0x2
+INCOMPAT_RECOVER = 0x4
+INCOMPAT_JOURNAL_DEV = 0x8
+INCOMPAT_META_BG = 0x10
+INCOMPAT_64BIT = 0x80
+
+RO_COMPAT_SPARSE_SUPER = 0x1
+
+INODE_FLAG_ENCRYPT = 0x800
+INODE_FLAG_EXTENTS = 0x80000
+INODE_FLAG_INLINE_DATA = 0x10000000
+
+S_IFMT = 0xF000
+S_IFDIR = 0x4000
+S_IFREG = 0x8000
+S_IFLNK = 0xA000
+
+EXTENT_MAGIC = 0xF30A
+EXTENT_UNINIT = 32768  # ee_len above this: an unwritten (preallocated) extent, reads as zeros
+
+
+class Ext4Error(Exception):
+    pass
+
+
+class Inode:
+    number: int
+    mode: int
+    size: int
+    flags: int
+    block: bytes  # i_block: the extent tree root, the block map, or a fast symlink's target
+
+    def __init__(self, number: int, raw: bytes):
+        self.number = number
+        self.mode, _, size_lo = struct.unpack_from("<HHI", raw, 0)
+        self.flags = struct.unpack_from("<I", raw, 0x20)[0]
+        self.block = raw[0x28 : 0x28 + 60]
+        self.size = size_lo | struct.unpack_from("<I", raw, 0x6C)[0] << 32
+
+    @property
+    def is_dir(self) -> bool:
+        return self.mode & S_IFMT == S_IFDIR
+
+    @property
+    def is_file(self) -> bool:
+        return self.mode & S_IFMT == S_IFREG
+
+    @property
+    def is_symlink(self) -> bool:
+        return self.mode & S_IFMT == S_IFLNK
+
+
+class Ext4Filesystem:
+    """
+    Read-only ext2/3/4 over a disk's read(offset, length) (a Qcow2Image, a RawDisk), from the partition at
+    offset: superblock and group descriptors, extent trees and the indirect block maps of ext2/3, linear and
+    htree directories (an htree's interior blocks are invisible to a linear read, which is what keeps them
+    compatible), fast and slow symlinks. No mount, no root, no journal replay: a cloud image's /boot is not
+    written to, so whatever the journal may hold does not matter. Inline data and encryption are not supported.
+    """
+
+    def __init__(self, disk, offset: int):
+        self.disk = disk
+        self.offset = offset
+        sb = disk.read(offset + 1024, 1024)
+        if len(sb) < 1024 or struct.unpack_from("<H", sb, 56)[0] != EXT4_MAGIC:
+            raise Ext4Error(f"No ext2/3/4 superblock at {offset}")
+        (
+            _,
+            blocks_lo,
+            _,
+            _,
+            _,
+            self.first_data_block,
+            log_block_size,
+            _,
+            self.blocks_per_group,
+            _,
+            self.inodes_per_group,
+        ) = struct.unpack_from("<11I", sb, 0)
+        rev_level = struct.unpack_from("<I", sb, 76)[0]
+        self.inode_size = struct.unpack_from("<H", sb, 88)[0] if rev_level >= 1 else 128
+        self.incompat = struct.unpack_from("<I", sb, 96)[0]
+        if self.incompat & INCOMPAT_JOURNAL_DEV:
+            raise Ext4Error(f"Unsupported ext4 features {self.incompat:#x} at {offset}")
+        if self.incompat & INCOMPAT_RECOVER:
+            log.warning(f"ext4 at {offset} has a journal to replay; reading without replaying it")
+        self.block_size = 1024 << log_block_size
+        self.desc_size = struct.unpack_from("<H", sb, 0xFE)[0] if self.incompat & INCOMPAT_64BIT else 32
+        blocks_hi = struct.unpack_from("<I", sb, 0x150)[0] if self.incompat & INCOMPAT_64BIT else 0
+        self.blocks_count = blocks_lo | blocks_hi << 32
+        self.first_meta_bg = struct.unpack_from("<I", sb, 0x104)[0]
+        self.sparse_super = bool(struct.unpack_from("<I", sb, 100)[0] & RO_COMPAT_SPARSE_SUPER)
+        self.label = sb[120:136].split(b"\0", 1)[0].decode("utf-8", errors="replace")
+        self.lock = threading.Lock()
+        self.inode_tables: dict[int, int] = {}
+        self.directories: dict[int, dict[str, int]] = {}
+
+    def read_blocks(self, block: int, count: int = 1) -> bytes:
+        if block + count > self.blocks_count:
+            raise Ext4Error(f"Block {block}+{count} is past the end of the filesystem ({self.blocks_count} blocks)")
+        return self.disk.read(self.offset + block * self.block_size, count * self.block_size)
+
+    def inode_table(self, group: int) -> int:
+        with self.lock:
+            table = self.inode_tables.get(group)
+        if table is None:
+            desc = self.disk.read(self.offset + self.descriptor_offset(group), self.desc_size)
+            table = struct.unpack_from("<I", desc, 8)[0]
+            if self.desc_size >= 64:
+                table |= struct.unpack_from("<I", desc, 0x28)[0] << 32
+            with self.lock:
+                self.inode_tables[group] = table
+        return table
+
+    def descriptor_offset(self, group: int) -> int:
+        per_block = self.block_size // self.desc_size
+        meta_group, index = divmod(group, per_block)
+        if not self.incompat & INCOMPAT_META_BG or meta_group < self.first_meta_bg:
+            # the descriptors follow the superblock's block: block 2 with 1 KiB blocks, block 1 otherwise
+            return (self.first_data_block + 1) * self.block_size + group * self.desc_size
+        # meta_bg: each meta group's descriptors are in its first group's first block, after a superblock backup
+        first = meta_group * per_block
+        block = self.first_data_block + first * self.blocks_per_group + (1 if self.has_super(first) else 0)
+        return block * self.block_size + index * self.desc_size
+
+    def has_super(self, group: int) -> bool:
+        if not self.sparse_super or group <= 1:
+            return True
+        for base in (3, 5, 7):
+            power = base
+            while power < group:
+                power *= base
+            if power == group:
+                return True
+        return False
+
+    def inode(self, number: int) -> Inode:
+        group, index = divmod(number - 1, self.inodes_per_group)
+        raw = self.disk.read(
+            self.offset + self.inode_table(group) * self.block_size + index * self.inode_size, max(self.inode_size, 128)
+        )
+        inode = Inode(number, raw)
+        if inode.flags & (INODE_FLAG_ENCRYPT | INODE_FLAG_INLINE_DATA):
+            raise Ext4Error(f"Inode {number} is encrypted or has inline data, which is not supported")
+        return inode
+
+    def runs(self, inode: Inode) -> list[tuple[int, int, int, bool]]:
+        """(logical block, physical block, block count, unwritten) of the inode's data, in logical order."""
+        runs: list[tuple[int, int, int, bool]] = []
+        if inode.flags & INODE_FLAG_EXTENTS:
+            self.extent_runs(inode.block, runs)
+        else:
+            self.mapped_runs(inode, runs)
+        runs.sort()
+        return runs
+
+    def extent_runs(self, node: bytes, runs: list):
+        magic, entries, _, depth = struct.unpack_from("<HHHH", node, 0)
+        if magic != EXTENT_MAGIC:
+            raise Ext4Error(f"Bad extent header magic {magic:#x}")
+        for index in range(entries):
+            if depth == 0:
+                logical, length, start_hi, start_lo = struct.unpack_from("<IHHI", node, 12 + 12 * index)
+                unwritten = length > EXTENT_UNINIT
+                runs.append(
+                    (logical, start_hi << 32 | start_lo, length - EXTENT_UNINIT if unwritten else length, unwritten)
+                )
+            else:
+                _, leaf_lo, leaf_hi = struct.unpack_from("<IIH", node, 12 + 12 * index)
+                self.extent_runs(self.read_blocks(leaf_hi << 32 | leaf_lo), runs)
+
+    def mapped_runs(self, inode: Inode, runs: list):
+        # ext2/3: 12 direct blocks, then single, double and triple indirect ones; a zero pointer is a hole
+        blocks = -(-inode.size // self.block_size)
+        per_block = self.block_size // 4
+        pointers = struct.unpack("<15I", inode.block)
+
+        def add(logical: int, physical: int):
+            if (
+                runs
+                and not runs[-1][3]
+                and runs[-1][0] + runs[-1][2] == logical
+                and runs[-1][1] + runs[-1][2] == physical
+            ):
+                runs[-1] = (runs[-1][0], runs[-1][1], runs[-1][2] + 1, False)
+            else:
+                runs.append((logical, physical, 1, False))
+
+        def walk(block: int, level: int, logical: int) -> int:
+            span = per_block**level
+            if block == 0 or logical >= blocks:
+                return logical + span
+            if level == 0:
+                add(logical, block)
+                return logical + 1
+            for pointer in struct.unpack(f"<{per_block}I", self.read_blocks(block)):
+                logical = walk(pointer, level - 1, logical)
+                if logical >= blocks:
+                    break
+            return logical
+
+        logical = 0
+        for pointer in pointers[:12]:
+            logical = walk(pointer, 0, logical)
+        for level, pointer in enumerate(pointers[12:], start=1):
+            logical = walk(pointer, level, logical)
+
+    def stream_inode(self, inode: Inode) -> Iterator[bytes]:
+        # contiguous blocks are read READ_CHUNK at a time; holes and unwritten extents come out as zeros
+        position = 0
+        for logical, physical, count, unwritten in self.runs(inode):
+            start = logical * self.block_size
+            if start >= inode.size:
+                break
+            if start > position:
+                yield from zeros(start - position)
+            length = min(count * self.block_size, inode.size - start)
+            if unwritten:
+                yield from zeros(length)
+            else:
+                base = self.offset + physical * self.block_size
+                if physical + count > self.blocks_count:
+                    raise Ext4Error(f"Inode {inode.number} maps blocks past the end of the filesystem")
+                for chunk in range(0, length, READ_CHUNK):
+                    yield self.disk.read(base + chunk, min(READ_CHUNK, length - chunk))
+            position = start + length
+        if position < inode.size:
+            yield from zeros(inode.size - position)
+
+    def read_inode(self, inode: Inode) -> bytes:
+        return b"".join(self.stream_inode(inode))
+
+    def directory(self, inode: Inode) -> dict[str, int]:
+        with self.lock:
+            entries = self.directories.get(inode.number)
+        if entries is not None:
+            return entries
+        data = self.read_inode(inode)
+        entries = {}
+        for block in range(0, len(data), self.block_size):
+            position, end = block, block + self.block_size
+            while position + 8 <= end:
+                number, rec_len, name_len, file_type = struct.unpack_from("<IHBB", data, position)
+                if not self.incompat & INCOMPAT_FILETYPE:
+                    name_len |= file_type << 8
+                if rec_len < 8 or position + rec_len > end:
+                    raise Ext4Error(f"Corrupt directory entry in inode {inode.number} at {position}")
+                if number and name_len:
+                    name = data[position + 8 : position + 8 + name_len].decode("utf-8", errors="surrogateescape")
+                    entries[name] = number
+                position += rec_len
+        with self.lock:
+            self.directories[inode.number] = entries
+        return entries
+
+    def readlink(self, inode: Inode) -> str:
+        if inode.size < 60 and not inode.flags & INODE_FLAG_EXTENTS:
+            target = inode.block[: inode.size]  # a fast symlink: the target is in i_block itself
+        else:
+            target = self.read_inode(inode)
+        return target.decode("utf-8", errors="surrogateescape")
+
+    def lookup(self, path: str) -> Inode | None:
+        """The inode at path (from the filesystem's root), following symlinks; None if there is none."""
+        parts = [part for part in path.split("/") if part not in ("", ".")]
+        stack = [self.inode(ROOT_INODE)]
+        followed = 0
+        while parts:
+            part = parts.pop(0)
+            current = stack[-1]
+            if not current.is_dir:
+                return None
+            if part == "..":
+                if len(stack) > 1:
+                    stack.pop()
+                continue
+            number = self.directory(current).get(part)
+            if number is None:
+                return None
+            inode = self.inode(number)
+            if inode.is_symlink:
+                followed += 1
+                if followed > MAX_SYMLINKS:
+                    raise Ext4Error(f"Too many levels of symbolic links in {path}")
+                target = self.readlink(inode)
+                if target.startswith("/"):
+                    stack = stack[:1]
+                parts = [part for part in target.split("/") if part not in ("", ".")] + parts
+                continue
+            stack.append(inode)
+        return stack[-1]
+
+    def listdir(self, path: str) -> list[str] | None:
+        inode = self.lookup(path)
+        if inode is None or not inode.is_dir:
+            return None
+        return [name for name in self.directory(inode) if name not in (".", "..")]
+
+    def stream(self, path: str) -> Iterator[bytes]:
+        inode = self.lookup(path)
+        if inode is None or not inode.is_file:
+            raise Ext4Error(f"{path} is not a regular file")
+        return self.stream_inode(inode)
+
+
+def zeros(length: int) -> Iterator[bytes]:
+    for chunk in range(0, length, READ_CHUNK):
+        yield bytes(min(READ_CHUNK, length - chunk))
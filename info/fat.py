@@ -0,0 +1,234 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import logging
+import struct
+import threading
+from collections.abc import Iterator
+
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("fat")
+
+READ_CHUNK = 4 * 1024 * 1024  # bytes per read of contiguous clusters
+
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_LONG_NAME = 0x0F
+LAST_LONG_ENTRY = 0x40
+NT_LOWERCASE_BASE = 0x08
+NT_LOWERCASE_EXT = 0x10
+
+
+class FatError(Exception):
+    pass
+
+
+class DirEntry:
+    name: str  # the long (VFAT) name if there is one, else the 8.3 name
+    attributes: int
+    cluster: int  # first cluster; 0 for an empty file, or a subdirectory's ".." pointing at the root
+    size: int
+
+    def __init__(self, name: str, attributes: int, cluster: int, size: int):
+        self.name = name
+        self.attributes = attributes
+        self.cluster = cluster
+        self.size = size
+
+    @property
+    def is_dir(self) -> bool:
+        return bool(self.attributes & ATTR_DIRECTORY)
+
+
+def short_name(raw: bytes, nt_flags: int) -> str:
+    base, ext = raw[:8].rstrip(b" "), raw[8:11].rstrip(b" ")
+    if base[:1] == b"\x05":
+        base = b"\xe5" + base[1:]  # 0x05 stands in for a leading 0xE5, which marks deleted entries
+    base_text, ext_text = base.decode("cp437"), ext.decode("cp437")
+    if nt_flags & NT_LOWERCASE_BASE:
+        base_text = base_text.lower()
+    if nt_flags & NT_LOWERCASE_EXT:
+        ext_text = ext_text.lower()
+    return f"{base_text}.{ext_text}" if ext_text else base_text
+
+
+def short_name_checksum(raw: bytes) -> int:
+    checksum = 0
+    for byte in raw[:11]:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+class FatFilesystem:
+    """
+    Read-only FAT12/16/32 over a disk's read(offset, length) (a Qcow2Image, a RawDisk), from the partition at
+    offset: the BPB, the first FAT (read whole, an ESP's is small), cluster chains, the fixed root directory of
+    FAT12/16, and VFAT long names, checked against their short entry's checksum. Names are looked up
+    case-insensitively, as FAT does.
+    """
+
+    def __init__(self, disk, offset: int):
+        self.disk = disk
+        self.offset = offset
+        boot = disk.read(offset, 512)
+        if len(boot) < 512 or boot[510:512] != b"\x55\xaa":
+            raise FatError(f"No FAT boot sector at {offset}")
+        (
+            self.sector_size,
+            self.sectors_per_cluster,
+            reserved_sectors,
+            fat_count,
+            root_entries,
+            total_sectors_16,
+            _,
+            fat_size_16,
+        ) = struct.unpack_from("<HBHBHHBH", boot, 11)
+        total_sectors_32, fat_size_32, _, _, self.root_cluster = struct.unpack_from("<IIHHI", boot, 32)
+        if self.sector_size not in (512, 1024, 2048, 4096) or self.sectors_per_cluster == 0 or fat_count == 0:
+            raise FatError(f"Invalid FAT BPB at {offset}")
+        fat_size = fat_size_16 or fat_size_32
+        total_sectors = total_sectors_16 or total_sectors_32
+        root_sectors = -(-root_entries * 32 // self.sector_size)
+        self.fat_offset = reserved_sectors * self.sector_size
+        self.root_offset = (reserved_sectors + fat_count * fat_size) * self.sector_size
+        self.root_size = root_entries * 32
+        self.data_offset = self.root_offset + root_sectors * self.sector_size
+        self.cluster_size = self.sector_size * self.sectors_per_cluster
+        self.clusters = (total_sectors - reserved_sectors - fat_count * fat_size - root_sectors) // (
+            self.sectors_per_cluster
+        )
+        # the FAT type follows from the cluster count alone, whatever the "FAT16"/"FAT32" string says
+        self.fat_bits = 12 if self.clusters < 4085 else 16 if self.clusters < 65525 else 32
+        if self.fat_bits == 32 and fat_size_16:
+            raise FatError(f"FAT at {offset} has FAT32's cluster count but a FAT12/16 BPB")
+        self.fat_bytes = fat_size * self.sector_size
+        self.fat: bytes | None = None
+        self.lock = threading.Lock()
+        self.directories: dict[int, dict[str, DirEntry]] = {}
+
+    def load_fat(self) -> bytes:
+        with self.lock:
+            if self.fat is None:
+                self.fat = self.disk.read(self.offset + self.fat_offset, self.fat_bytes)
+            return self.fat
+
+    def next_cluster(self, cluster: int) -> int | None:
+        """The cluster after this one in its chain, None at the end of the chain."""
+        fat = self.load_fat()
+        if self.fat_bits == 32:
+            value = struct.unpack_from("<I", fat, cluster * 4)[0] & 0x0FFFFFFF
+            end = 0x0FFFFFF8
+        elif self.fat_bits == 16:
+            value = struct.unpack_from("<H", fat, cluster * 2)[0]
+            end = 0xFFF8
+        else:
+            pair = struct.unpack_from("<H", fat, cluster * 3 // 2)[0]
+            value = pair >> 4 if cluster & 1 else pair & 0xFFF
+            end = 0xFF8
+        if value >= end:
+            return None
+        if value < 2 or value >= self.clusters + 2:
+            raise FatError(f"Cluster {cluster} links to {value:#x}, which is free, bad or out of range")
+        return value
+
+    def chain(self, first: int) -> list[int]:
+        clusters = []
+        cluster = first
+        while cluster is not None:
+            if len(clusters) > self.clusters:
+                raise FatError(f"Cluster chain from {first} loops")
+            clusters.append(cluster)
+            cluster = self.next_cluster(cluster)
+        return clusters
+
+    def runs(self, first: int) -> list[tuple[int, int]]:
+        """(first cluster, cluster count) of the chain from first, contiguous clusters merged."""
+        runs: list[tuple[int, int]] = []
+        for cluster in self.chain(first):
+            if runs and runs[-1][0] + runs[-1][1] == cluster:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((cluster, 1))
+        return runs
+
+    def stream_chain(self, first: int, size: int | None) -> Iterator[bytes]:
+        # contiguous clusters are read READ_CHUNK at a time; size None reads every cluster (directories)
+        remaining = size
+        for cluster, count in self.runs(first) if first else []:
+            base = self.offset + self.data_offset + (cluster - 2) * self.cluster_size
+            length = count * self.cluster_size if remaining is None else min(count * self.cluster_size, remaining)
+            for chunk in range(0, length, READ_CHUNK):
+                yield self.disk.read(base + chunk, min(READ_CHUNK, length - chunk))
+            if remaining is not None:
+                remaining -= length
+                if remaining <= 0:
+                    return
+        if remaining:
+            raise FatError(f"Cluster chain from {first} ends {remaining} bytes short of the file's size")
+
+    def directory(self, cluster: int) -> dict[str, DirEntry]:
+        """The entries of the directory at cluster (0: the root), by case-folded name."""
+        with self.lock:
+            entries = self.directories.get(cluster)
+        if entries is not None:
+            return entries
+        if cluster == 0 and self.fat_bits != 32:
+            data = self.disk.read(self.offset + self.root_offset, self.root_size)
+        else:
+            data = b"".join(self.stream_chain(cluster or self.root_cluster, None))
+        entries = {}
+        long_parts: list[str] = []
+        long_checksum = None
+        for position in range(0, len(data) - 31, 32):
+            raw = data[position : position + 32]
+            if raw[0] == 0x00:
+                break
+            if raw[0] == 0xE5:
+                long_parts = []
+                continue
+            attributes = raw[11]
+            if attributes & 0x3F == ATTR_LONG_NAME:
+                # long name entries precede their short entry, last part first
+                if raw[0] & LAST_LONG_ENTRY:
+                    long_parts = []
+                long_checksum = raw[13]
+                chars = raw[1:11] + raw[14:26] + raw[28:32]
+                long_parts.insert(0, chars.decode("utf-16-le", errors="replace"))
+                continue
+            name = short_name(raw[:11], raw[12])
+            if long_parts and long_checksum == short_name_checksum(raw[:11]):
+                name = "".join(long_parts).split("\0", 1)[0]
+            long_parts = []
+            if attributes & ATTR_VOLUME_ID:
+                continue
+            cluster_hi, cluster_lo, size = struct.unpack_from("<H4xHI", raw, 20)
+            first = cluster_lo | (cluster_hi << 16 if self.fat_bits == 32 else 0)
+            entries[name.casefold()] = DirEntry(name, attributes, first, size)
+        with self.lock:
+            self.directories[cluster] = entries
+        return entries
+
+    def lookup(self, path: str) -> DirEntry | None:
+        """The entry at path (from the root), None if there is none; the root is a DirEntry of cluster 0."""
+        entry = DirEntry("", ATTR_DIRECTORY, 0, 0)
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if not entry.is_dir:
+                return None
+            found = self.directory(entry.cluster).get(part.casefold())
+            if found is None:
+                return None
+            entry = found
+        return entry
+
+    def listdir(self, path: str) -> list[str] | None:
+        entry = self.lookup(path)
+        if entry is None or not entry.is_dir:
+            return None
+        return [found.name for found in self.directory(entry.cluster).values() if found.name not in (".", "..")]
+
+    def stream(self, path: str) -> Iterator[bytes]:
+        entry = self.lookup(path)
+        if entry is None or entry.is_dir:
+            raise FatError(f"{path} is not a regular file")
+        return self.stream_chain(entry.cluster, entry.size)
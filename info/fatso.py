@@ -7,7 +7,7 @@ import rich.repr
 
 from distro import DistroBaseInfo
 from distro_arch import DistroBaseArchInfo
-from utils import setup_logging, GitHubReleaseReleaseAssets
+from utils import setup_logging, GitHubReleaseReleaseAssets, gh_asset_digest
 
 log: logging.Logger = setup_logging("fatso")
 
@@ -33,7 +33,7 @@ class Fatso(DistroBaseInfo):
         )
 
     def set_version_from_arch_versions(self, arch_versions: set[str]) -> string:
-        self.version = "-".join(arch_versions)  # just join all distinct versions, hopefully there is only one
+        self.version = "-".join(sorted(arch_versions))  # just join all distinct versions, hopefully there is only one
         self.oci_tag_version = f"{self.fid}-{self.version}"
         self.oci_tag_latest = f"{self.fid}-latest"
 
@@ -47,9 +47,9 @@ class Fatso(DistroBaseInfo):
         log.info(f"Fatso {self.flavor} uses UKI-like booting from the ESP, directly in the root")
         return ""
 
-    def handle_extract_kernel_initrd(self, arch: "FatsoArchInfo", nbd_counter):
+    def handle_extract_kernel_initrd(self, arch: "FatsoArchInfo", nbd_lease):
         log.info(f"Fatso (mkosi) uses UKI-like even for Grub booting!")
-        arch.extract_kernel_initrd_from_qcow2(nbd_counter, ["*/*/vmlinuz"], ["*/initrd"])
+        arch.extract_kernel_initrd_from_qcow2(nbd_lease, ["*/*/vmlinuz"], ["*/initrd"])
 
 
 @rich.repr.auto
@@ -71,28 +71,20 @@ class FatsoArchInfo(DistroBaseArchInfo):
         self.gh_release_version = None
         self.gh_asset_filename = None
         self.gh_asset_dl_url = None
-        searched_variant_token = f"{self.distro.flavor}_{self.docker_slug}.qcow2.gz"
-
+        self.qcow2_upstream_digest = None
         ghra = GitHubReleaseReleaseAssets(github_org_repo="k8s-avengers/fatso-images", release_tag=None)
         release_info_assets = ghra.get_release_assets()
-        repo_release_assets = release_info_assets["assets"]
         repo_release = release_info_assets["repo_release"]
 
-        log.debug(f"repo_release_assets: {repo_release_assets}")
-        for repo_release_asset in repo_release_assets:
-            asset_fn = repo_release_asset.name
-            asset_dl_url = repo_release_asset.browser_download_url
-            log.debug(f"Trying repo_release_asset '{asset_fn}' ")
-            if searched_variant_token not in asset_fn:
-                log.debug(
-                    f"Skipping repo_release_asset '{asset_fn}' because it does not contain '{searched_variant_token}'"
-                )
-                continue
-            # If we got this far, we've the correct qcow2.xz asset.
-            log.info(f"Found! repo_release_asset '{asset_fn}' ")
-            self.gh_asset_filename = asset_fn
-            self.gh_asset_dl_url = asset_dl_url
+        # "...<flavor>_<docker_slug>.qcow2.gz"
+        searched_fields = (*self.distro.flavor.split("_"), self.docker_slug)
+        repo_release_asset = repo_release.catalog.find_one(".qcow2.gz", searched_fields, at_end=True)
+        if repo_release_asset is not None:
+            log.info(f"Found! repo_release_asset '{repo_release_asset.name}' ")
+            self.gh_asset_filename = repo_release_asset.name
+            self.gh_asset_dl_url = repo_release_asset.browser_download_url
             self.gh_release_version = repo_release.tag_name
+            self.qcow2_upstream_digest = gh_asset_digest(repo_release_asset)
 
         if self.gh_release_version is None:
             raise Exception(f"Could not find valid release for {self.slug}")
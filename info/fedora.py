@@ -2,11 +2,13 @@
 import logging
 import os
 import string
-from urllib.error import HTTPError
 
 from distro import DistroBaseInfo
 from distro_arch import DistroBaseArchInfo
-from utils import get_url_and_parse_html_hrefs
+from feeds import fedora_feed
+from feeds import FeedImage
+from mirrors import MirrorPool
+from utils import get_first_index_hrefs
 from utils import setup_logging
 
 log: logging.Logger = setup_logging("fedora")
@@ -43,9 +45,12 @@ class Fedora(DistroBaseInfo):
             default_oci_ref_disk="fedora-cloud-container-disk",
             default_oci_ref_kernel="fedora-cloud-kernel-kv",
         )
+        # download.fedoraproject.org redirects to some mirror near-ish; the master is often faster from CI
+        candidates = os.environ.get("FEDORA_MIRRORS", "https://dl.fedoraproject.org/pub/fedora")
+        self.mirrors = MirrorPool("fedora", mirror, candidates.split())
 
     def set_version_from_arch_versions(self, arch_versions: set[string]) -> string:
-        self.version = "-".join(arch_versions)  # just join all distinct versions, hopefully there is only one
+        self.version = "-".join(sorted(arch_versions))  # just join all distinct versions, hopefully there is only one
         self.oci_tag_version = self.release + "-" + self.version
         self.oci_tag_latest = self.release + "-latest"
 
@@ -56,22 +61,16 @@ class FedoraArchInfo(DistroBaseArchInfo):
     all_hrefs: list[string]
     qcow2_hrefs: list[string]
 
-    def grab_version(self):
+    def feed_image(self) -> FeedImage | None:
+        return fedora_feed(self.distro.mirror, self.distro.release).get(self.slug)
+
+    def scrape_version(self):
         indexes_to_try = [f"{self.distro.mirror}/linux/releases/{self.distro.release}/Cloud/{self.slug}/images/"]
 
         # Log the indexes
         log.info(f"Trying indexes: {indexes_to_try}")
 
-        for index_url in indexes_to_try:
-            try:
-                self.index_url = index_url
-                self.all_hrefs = get_url_and_parse_html_hrefs(self.index_url)
-                break
-            except HTTPError as e:
-                continue
-
-        if self.index_url is None:
-            raise Exception(f"Could not find valid index for {self.slug}")
+        self.index_url, self.all_hrefs = get_first_index_hrefs(indexes_to_try)
 
         self.qcow2_hrefs = [href for href in self.all_hrefs if href.endswith(".qcow2") and ".latest." not in href]
 
@@ -79,13 +78,8 @@ class FedoraArchInfo(DistroBaseArchInfo):
         if len(self.qcow2_hrefs) != 1:
             raise Exception(f"Found {len(self.qcow2_hrefs)} qcow2 hrefs for {self.slug}: {self.qcow2_hrefs}")
 
-        self.qcow2_filename = self.qcow2_hrefs[0]
-        qcow2_basename = os.path.basename(self.qcow2_filename)[: -len(".qcow2")]
-        self.vmlinuz_final_filename = f"{qcow2_basename}.vmlinuz"
-        self.initramfs_final_filename = f"{qcow2_basename}.initramfs"
-
         # Parse version out of the qcow2_href. very fragile.
-        dash_split = self.qcow2_filename.split("-")
+        dash_split = self.qcow2_hrefs[0].split("-")
         log.info(f"dash_split: {dash_split}")
 
         release_from_split = dash_split[3]
@@ -94,6 +88,19 @@ class FedoraArchInfo(DistroBaseArchInfo):
         )
 
         self.version = dash_split[4].replace(f".{self.slug}.qcow2", "")
+        self.set_image(self.index_url, self.qcow2_hrefs[0])
+
+        # Fedora publishes a single e.g. Fedora-Cloud-41-1.4-x86_64-CHECKSUM next to the images
+        checksum_hrefs = [href for href in self.all_hrefs if href.endswith("-CHECKSUM")]
+        if len(checksum_hrefs) == 1:
+            self.qcow2_checksum_url = self.index_url + checksum_hrefs[0]
+
+    def set_image(self, index_url: string, filename: string):
+        self.index_url = index_url
+        self.qcow2_filename = filename
+        qcow2_basename = os.path.basename(self.qcow2_filename)[: -len(".qcow2")]
+        self.vmlinuz_final_filename = f"{qcow2_basename}.vmlinuz"
+        self.initramfs_final_filename = f"{qcow2_basename}.initramfs"
 
         # full url
-        self.qcow2_url = self.index_url + self.qcow2_filename
+        self.qcow2_url = index_url + self.qcow2_filename
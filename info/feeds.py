@@ -0,0 +1,217 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import json
+import logging
+import os
+import re
+import threading
+from typing import Callable
+
+from httpcache import http_get
+from utils import get_url_and_parse_html_hrefs
+from utils import parse_checksum_file
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("feeds")
+
+
+class FeedError(Exception):
+    pass
+
+
+class FeedImage:
+    # One arch's newest image as published in an upstream metadata feed.
+    version: str
+    url: str
+    size: int | None
+    digest: tuple[str, str] | None  # (hashlib algo, hexdigest), as parse_checksum_file() returns
+
+    def __init__(self, version: str, url: str, size: int | None, digest: tuple[str, str] | None):
+        self.version = version
+        self.url = url
+        self.size = size
+        self.digest = digest
+
+    def __repr__(self):
+        return f"FeedImage({self.version}, {self.url}, size={self.size}, digest={self.digest})"
+
+
+def version_resolver() -> str:
+    # "feed" (default): read the distro's structured metadata, falling back to scraping; "scrape": index pages only
+    resolver = os.environ.get("VERSION_RESOLVER", "feed")
+    if resolver not in ("feed", "scrape"):
+        raise Exception(f"Unknown VERSION_RESOLVER: {resolver}")
+    return resolver
+
+
+# Each feed document is fetched (by the HTTP cache) and parsed once per process; every arch of the distro then
+# picks its image out of the parsed result, so a distro costs one request however many arches it has.
+feed_memo: dict[str, dict[str, FeedImage]] = {}
+feed_locks: dict[str, threading.Lock] = {}
+feed_locks_lock = threading.Lock()
+
+
+def memoized_feed(key: str, parse: Callable[[], dict[str, FeedImage]]) -> dict[str, FeedImage]:
+    with feed_locks_lock:
+        lock = feed_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in feed_memo:
+            feed_memo[key] = parse()
+            log.info(f"Feed {key}: {feed_memo[key]}")
+        return feed_memo[key]
+
+
+def version_key(version: str) -> tuple[int, ...]:
+    # "9.5-20241118.0" sorts as (9, 5, 20241118, 0); plain string sorting gets 9.10 vs 9.9 wrong
+    return tuple(int(number) for number in re.findall(r"\d+", version))
+
+
+# ---- Ubuntu: simplestreams ---------------------------------------------------------------------------------------
+
+
+def parse_ubuntu_simplestreams(document: bytes, release: str, mirror: str) -> dict[str, FeedImage]:
+    """
+    The daily download stream lists every build of every release/arch as products -> versions -> items, with
+    the path (relative to the stream's root), size and sha256 of each file. The image URL is rebuilt under
+    <mirror>/<release>/<version>/, where the index pages have it, so it is the same URL scraping would find.
+    """
+    images = {}
+    for product in json.loads(document)["products"].values():
+        if product.get("release") != release:
+            continue
+        disks = {
+            version: items["disk1.img"]
+            for version, items in ((version, data.get("items", {})) for version, data in product["versions"].items())
+            if "disk1.img" in items
+        }
+        if not disks:
+            continue
+        version = max(disks)  # serials are YYYYMMDD[.N]
+        disk = disks[version]
+        url = f"{mirror}/{release}/{version}/{os.path.basename(disk['path'])}"
+        images[product["arch"]] = FeedImage(version, url, disk.get("size"), ("sha256", disk["sha256"]))
+    return images
+
+
+def ubuntu_feed(mirror: str, release: str) -> dict[str, FeedImage]:
+    url = f"{mirror}/daily/streams/v1/com.ubuntu.cloud:daily:download.json"
+    # one stream covers every release, but the memo holds one release's images, so the key names the release
+    return memoized_feed(f"{url}#{release}", lambda: parse_ubuntu_simplestreams(http_get(url), release, mirror))
+
+
+# ---- Debian: per-build JSON manifests ----------------------------------------------------------------------------
+
+
+def parse_debian_build_manifest(document: bytes, index_url: str) -> FeedImage:
+    """
+    A build's JSON manifest (debian-cloud-images' "List" of Build and Upload items) as published under
+    daily/latest/: the Build item carries the build version; the qcow2 Upload item, if present, its digest.
+    The image itself is in daily/<version>/, as debian-<n>-<variant>-<arch>-daily-<version>.qcow2.
+    """
+    items = json.loads(document)["items"]
+    builds = [item for item in items if item.get("kind") == "Build"]
+    if len(builds) != 1:
+        raise FeedError(f"Expected one Build item in {index_url}, got {len(builds)}")
+    build = builds[0]
+    version = (
+        build.get("data", {}).get("info", {}).get("version") or build["metadata"]["labels"]["cloud.debian.org/version"]
+    )
+
+    manifest_basename = os.path.basename(index_url)[: -len(".json")]
+    filename = f"{manifest_basename}-{version}.qcow2"
+    size, digest = None, None
+    for item in items:
+        if item.get("kind") != "Upload" or not item.get("data", {}).get("ref", "").endswith(".qcow2"):
+            continue
+        annotations = item.get("metadata", {}).get("annotations", {})
+        algo, _, hex_digest = annotations.get("cloud.debian.org/digest", "").partition(":")
+        if algo in ("sha256", "sha512") and re.fullmatch(r"[0-9a-fA-F]+", hex_digest):
+            digest = (algo, hex_digest.lower())
+        if "cloud.debian.org/size" in annotations:
+            size = int(annotations["cloud.debian.org/size"])
+    daily_url = index_url.rsplit("/latest/", 1)[0]
+    return FeedImage(version, f"{daily_url}/{version}/{filename}", size, digest)
+
+
+def debian_feed(mirror: str, release: str, variant: str) -> dict[str, FeedImage]:
+    latest_url = f"{mirror}/{release}/daily/latest/"
+
+    def parse() -> dict[str, FeedImage]:
+        # latest/ holds one stable-named manifest per arch; the debian-<n> prefix is why it is listed, not guessed
+        manifest_re = re.compile(rf"^debian-\d+-{re.escape(variant)}-([a-z0-9]+)-daily\.json$")
+        images = {}
+        for href in set(get_url_and_parse_html_hrefs(latest_url)):
+            match = manifest_re.match(href)
+            if match is not None:
+                manifest_url = latest_url + href
+                images[match.group(1)] = parse_debian_build_manifest(http_get(manifest_url), manifest_url)
+        return images
+
+    return memoized_feed(f"{latest_url}#{variant}", parse)
+
+
+# ---- Fedora: releases.json ---------------------------------------------------------------------------------------
+
+FEDORA_RELEASES_URL = "https://fedoraproject.org/releases.json"
+FEDORA_CANONICAL_MIRROR = "https://download.fedoraproject.org/pub/fedora"
+
+
+def parse_fedora_releases(document: bytes, release: str, mirror: str) -> dict[str, FeedImage]:
+    """
+    releases.json is the list the fedoraproject.org download pages are built from: one entry per
+    version/arch/variant/subvariant with the link, sha256 and size of each deliverable.
+    """
+    images = {}
+    for entry in json.loads(document):
+        link = entry.get("link", "")
+        if entry.get("version") != release or entry.get("subvariant") != "Cloud_Base" or not link.endswith(".qcow2"):
+            continue
+        arch = entry["arch"]
+        if arch in images:
+            raise FeedError(f"More than one Cloud_Base qcow2 for {release} {arch} in releases.json")
+        match = re.search(rf"-{re.escape(release)}-([^-]+)\.{re.escape(arch)}\.qcow2$", link)
+        if match is None:
+            raise FeedError(f"Cannot parse the compose version out of {link}")
+        if link.startswith(FEDORA_CANONICAL_MIRROR):
+            link = mirror + link[len(FEDORA_CANONICAL_MIRROR) :]
+        size = int(entry["size"]) if entry.get("size") else None
+        digest = ("sha256", entry["sha256"].lower()) if entry.get("sha256") else None
+        images[arch] = FeedImage(match.group(1), link, size, digest)
+    return images
+
+
+def fedora_feed(mirror: str, release: str) -> dict[str, FeedImage]:
+    url = os.environ.get("FEDORA_RELEASES_URL", FEDORA_RELEASES_URL)
+    return memoized_feed(f"{url}#{release}", lambda: parse_fedora_releases(http_get(url), release, mirror))
+
+
+# ---- Rocky: CHECKSUM ---------------------------------------------------------------------------------------------
+
+
+def parse_rocky_checksum(document: bytes, index_url: str, variant: str, arch: str) -> FeedImage:
+    """
+    Rocky's per-arch CHECKSUM is BSD-style ("SHA256 (<name>) = <hex>") with a "# <name>: <n> bytes" comment
+    for each file, so it has every image name, size and digest the index page would take two looks to find.
+    Of several dated builds of the variant the newest is taken, not whichever the listing had last.
+    """
+    text = document.decode("utf-8", errors="replace")
+    sizes = {name: int(size) for name, size in re.findall(r"^# (\S+): (\d+) bytes$", text, re.MULTILINE)}
+    name_re = re.compile(rf"^Rocky-\d+-{re.escape(variant)}-([0-9.]+-[0-9.]+)\.{re.escape(arch)}\.qcow2$")
+    candidates = {}
+    for name, digest in parse_checksum_file(text).items():
+        match = name_re.match(name)
+        if match is not None:
+            candidates[match.group(1)] = (name, digest)
+    if not candidates:
+        raise FeedError(f"No {variant} {arch} qcow2 in {index_url}CHECKSUM")
+    version = max(candidates, key=version_key)
+    name, digest = candidates[version]
+    return FeedImage(version, index_url + name, sizes.get(name), digest)
+
+
+def rocky_feed(index_url: str, variant: str, arch: str) -> FeedImage:
+    # Rocky has no feed spanning arches; the CHECKSUM is per arch directory, still one request per arch
+    checksum_url = f"{index_url}CHECKSUM"
+    return memoized_feed(
+        f"{checksum_url}#{variant}",
+        lambda: {arch: parse_rocky_checksum(http_get(checksum_url), index_url, variant, arch)},
+    )[arch]
@@ -0,0 +1,334 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import logging
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+from httpcache import http_cache
+from registry import parse_reference
+from tracing import tracer
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("history")
+
+SCHEMA_VERSION = 2
+# stages of a run that only resolved versions (an info-only or up-to-date run) are none of these
+PROCESSING_STAGES = ("download", "extract", "build", "push", "manifest")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    slug TEXT NOT NULL,
+    started REAL NOT NULL,
+    seconds REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    matrix INTEGER NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    version TEXT,
+    tag TEXT,
+    commit_sha TEXT,
+    workflow_run TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_slug_started ON runs (slug, started);
+CREATE TABLE IF NOT EXISTS arches (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    arch TEXT NOT NULL,
+    version TEXT,
+    qcow2_url TEXT,
+    download_source TEXT,
+    qcow2_bytes INTEGER,
+    vmlinuz_bytes INTEGER,
+    initramfs_bytes INTEGER
+);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    image_type TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    waited REAL,
+    bytes INTEGER,
+    failed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stages_run ON stages (run_id);
+CREATE TABLE IF NOT EXISTS counters (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def parse_stage_name(slug: str, name: str) -> tuple[str, str, str]:
+    """
+    "<slug>:download:arm64" -> ("download", "arm64", ""); "<slug>:build:kernel:amd64" -> ("build", "amd64",
+    "kernel"); "<slug>:manifest:disk" -> ("manifest", "", "disk"); "<slug>:version" -> ("version", "", "").
+    """
+    parts = name.removeprefix(f"{slug}:").split(":")
+    stage, rest = parts[0], parts[1:]
+    if stage in ("build", "push") and len(rest) == 2:
+        return stage, rest[1], rest[0]
+    if stage == "manifest" and len(rest) == 1:
+        return stage, "", rest[0]
+    return stage, rest[0] if rest else "", ""
+
+
+class RunHistory:
+    """
+    One row per distro run (cli_the_whole_shebang, or a distro of a matrix run) in SQLite: versions and artifact
+    sizes per arch, every stage's duration, wait and bytes, and counters (caches, registry uploads).
+    Several jobs on one runner may record at once; SQLite's file locking serializes them.
+    """
+
+    filename: str
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        with self.connect() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise Exception(f"{filename} has schema version {version}, newer than {SCHEMA_VERSION}")
+            if version == 1:
+                self.migrate_v1(db)
+            db.executescript(SCHEMA)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @staticmethod
+    def migrate_v1(db):
+        # v1 did not tell runs that processed images from runs that only resolved versions; their stages do
+        db.execute("ALTER TABLE runs ADD COLUMN processed INTEGER NOT NULL DEFAULT 0")
+        db.execute(
+            f"UPDATE runs SET processed = EXISTS (SELECT 1 FROM stages WHERE stages.run_id = runs.id "
+            f"AND stages.stage IN ({', '.join('?' * len(PROCESSING_STAGES))}))",
+            PROCESSING_STAGES,
+        )
+
+    @contextmanager
+    def connect(self):
+        # one connection per use, committed (or rolled back) and closed; runs record once, reports read once
+        db = sqlite3.connect(self.filename, timeout=60)
+        try:
+            db.execute("PRAGMA foreign_keys = ON")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(self, distro, ok: bool, matrix: bool) -> int:
+        slug = distro.slug()
+        summary = tracer().summary(slug)
+        stages = [stage for stage in summary["stages"] if stage["name"].startswith(f"{slug}:")]
+        started = summary["started"] + min((stage["start"] for stage in stages), default=0.0)
+        seconds = max((stage["start"] + stage["seconds"] for stage in stages), default=0.0) - min(
+            (stage["start"] for stage in stages), default=0.0
+        )
+        counters = self.counters(distro, matrix)
+        parsed = [parse_stage_name(slug, stage["name"]) for stage in stages]
+        processed = any(stage in PROCESSING_STAGES for stage, _, _ in parsed)
+
+        with self.lock, self.connect() as db:
+            run_id = db.execute(
+                "INSERT INTO runs (slug, started, seconds, ok, matrix, processed, version, tag, commit_sha, "
+                "workflow_run) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    slug,
+                    started,
+                    round(seconds, 3),
+                    int(ok),
+                    int(matrix),
+                    int(processed),
+                    distro.version,
+                    distro.oci_tag_version,
+                    os.environ.get("GITHUB_SHA"),
+                    os.environ.get("GITHUB_RUN_ID"),
+                ),
+            ).lastrowid
+            db.executemany(
+                "INSERT INTO arches (run_id, arch, version, qcow2_url, download_source, qcow2_bytes, vmlinuz_bytes, "
+                "initramfs_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        arch.docker_slug,
+                        arch.version,
+                        arch.qcow2_url,
+                        arch.download_source,
+                        arch.artifact_sizes.get("qcow2"),
+                        arch.artifact_sizes.get("vmlinuz"),
+                        arch.artifact_sizes.get("initramfs"),
+                    )
+                    for arch in distro.arches
+                ],
+            )
+            db.executemany(
+                "INSERT INTO stages (run_id, stage, arch, image_type, seconds, waited, bytes, failed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        *parsed_name,
+                        stage["seconds"],
+                        stage.get("waited"),
+                        stage["bytes"],
+                        int(stage["error"] is not None),
+                    )
+                    for stage, parsed_name in zip(stages, parsed)
+                ],
+            )
+            db.executemany(
+                "INSERT INTO counters (run_id, name, value) VALUES (?, ?, ?)",
+                [(run_id, name, value) for name, value in counters.items()],
+            )
+        log.info(f"Recorded run {run_id} of {slug} in {self.filename}: {len(stages)} stages, {counters}")
+        return run_id
+
+    @staticmethod
+    def counters(distro, matrix: bool) -> dict[str, int]:
+        counters = {
+            "artifact_store_hits": sum(1 for arch in distro.arches if arch.download_source == "store"),
+            "artifact_store_misses": sum(1 for arch in distro.arches if arch.download_source == "network"),
+        }
+        # blob uploads are told apart by repository, so they are this distro's even in a matrix run
+        repositories = {parse_reference(f"{oci_ref}:x")[1] for oci_ref in (distro.oci_ref_disk, distro.oci_ref_kernel)}
+        for outcome in ("uploaded", "exists", "mounted"):
+            counters[f"registry_blobs_{outcome}"] = 0
+        counters["registry_bytes_uploaded"] = 0
+        for span in tracer().finished_spans():
+            if span.name != "blob" or "error" in span.args:
+                continue
+            if span.args.get("repository") not in repositories:
+                continue
+            counters[f"registry_blobs_{span.args.get('outcome')}"] += 1
+            counters["registry_bytes_uploaded"] += span.bytes
+        if not matrix:
+            # the HTTP cache is process-wide; in a matrix run its requests cannot be told apart by distro
+            counters.update({f"http_{name}": value for name, value in http_cache().stats.items()})
+        return counters
+
+    def durations(self, since: float, slugs: list[str] | None = None) -> list[tuple]:
+        """
+        (slug, arch, stage, started, seconds) of successful runs since, image types summed; stage "total" too.
+        Runs that only resolved versions (info-only, or nothing to do) are left out: their few seconds would drag
+        the medians down and make every real run look like a regression.
+        """
+        where = "runs.ok = 1 AND runs.processed = 1 AND runs.started >= ?"
+        params: list = [since]
+        if slugs:
+            where += f" AND runs.slug IN ({', '.join('?' * len(slugs))})"
+            params += slugs
+        with self.connect() as db:
+            rows = db.execute(
+                f"SELECT runs.slug, stages.arch, stages.stage, runs.started, SUM(stages.seconds) "
+                f"FROM runs JOIN stages ON stages.run_id = runs.id WHERE {where} "
+                f"GROUP BY runs.id, stages.arch, stages.stage",
+                params,
+            ).fetchall()
+            rows += db.execute(
+                f"SELECT runs.slug, '', 'total', runs.started, runs.seconds FROM runs WHERE {where}", params
+            ).fetchall()
+        return rows
+
+
+class Trend:
+    slug: str
+    arch: str
+    stage: str
+    latest: float  # seconds, most recent run
+    history: list[float]  # seconds, the earlier runs in the window
+
+    def __init__(self, slug, arch, stage, latest, history):
+        self.slug = slug
+        self.arch = arch
+        self.stage = stage
+        self.latest = latest
+        self.history = history
+
+    @property
+    def median(self) -> float | None:
+        return statistics.median(self.history) if self.history else None
+
+    @property
+    def ratio(self) -> float | None:
+        median = self.median
+        return self.latest / median if median else None
+
+    def describe(self, days: int) -> str:
+        what = " ".join(part for part in (self.slug, self.arch, self.stage) if part)
+        return f"{what} {self.ratio:.1f}× slower than {days}-day median ({self.latest:.1f}s vs {self.median:.1f}s)"
+
+
+def trends(rows: list[tuple]) -> list[Trend]:
+    by_key: dict[tuple[str, str, str], list[tuple[float, float]]] = {}
+    for slug, arch, stage, started, seconds in rows:
+        by_key.setdefault((slug, arch, stage), []).append((started, seconds))
+    result = []
+    for (slug, arch, stage), samples in sorted(by_key.items()):
+        samples.sort()
+        result.append(Trend(slug, arch, stage, samples[-1][1], [seconds for _, seconds in samples[:-1]]))
+    return result
+
+
+def regressions(all_trends: list[Trend], factor: float, min_seconds: float, min_runs: int) -> list[Trend]:
+    """Latest runs at least factor times their median, and min_seconds slower, over at least min_runs runs."""
+    return [
+        trend
+        for trend in all_trends
+        if len(trend.history) >= min_runs
+        and trend.ratio is not None
+        and trend.ratio >= factor
+        and trend.latest - trend.median >= min_seconds
+    ]
+
+
+def perf_report(history: RunHistory, days: int, factor: float, min_seconds: float, min_runs: int, slugs: list[str]):
+    """Markdown with the regressions and per distro/arch/stage trends; and the regressions themselves."""
+    all_trends = trends(history.durations(time.time() - days * 86400, slugs))
+    flagged = regressions(all_trends, factor, min_seconds, min_runs)
+    lines = [f"### Performance over the last {days} days", ""]
+    if flagged:
+        lines += [f"- **{trend.describe(days)}**" for trend in flagged] + [""]
+    else:
+        lines += [f"No stage is {factor:.1f}× slower than its {days}-day median.", ""]
+    lines += [
+        "| Distro | Arch | Stage | Runs | Latest | Median | Min | Max | vs median |",
+        "|---|---|---|--:|--:|--:|--:|--:|--:|",
+    ]
+    for trend in all_trends:
+        samples = trend.history + [trend.latest]
+        ratio = f"{trend.ratio:.2f}×" if trend.ratio is not None else ""
+        median = f"{trend.median:.1f}s" if trend.median is not None else ""
+        lines.append(
+            f"| {trend.slug} | {trend.arch} | {trend.stage} | {len(samples)} | {trend.latest:.1f}s | {median} "
+            f"| {min(samples):.1f}s | {max(samples):.1f}s | {'**' + ratio + '**' if trend in flagged else ratio} |"
+        )
+    return "\n".join(lines) + "\n", flagged
+
+
+singleton_history: RunHistory | None = None
+singleton_history_lock = threading.Lock()
+
+
+def run_history() -> RunHistory | None:
+    """The run history at RUN_HISTORY (default cache/history.sqlite), or None if that is "off"."""
+    global singleton_history
+    with singleton_history_lock:
+        if singleton_history is None:
+            filename = os.environ.get("RUN_HISTORY", os.path.join("cache", "history.sqlite"))
+            if filename == "off":
+                return None
+            singleton_history = RunHistory(filename)
+        return singleton_history
+
+
+def record_run(distro, ok: bool, matrix: bool = False):
+    # A history that cannot be written must not fail the build it describes.
+    try:
+        history = run_history()
+        if history is not None:
+            history.record(distro, ok, matrix)
+    except Exception as e:
+        log.warning(f"Could not record the run of {distro.slug()} in the run history: {e}")
@@ -0,0 +1,232 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import email.message
+import gzip
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from urllib.error import HTTPError
+from urllib.error import URLError
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+from urllib.request import Request
+from urllib.request import getproxies
+from urllib.request import urlopen
+
+from tracing import span
+
+# utils imports this module, so no setup_logging() here
+log: logging.Logger = logging.getLogger("httpcache")
+
+USER_AGENT = "cloud-container-disk"
+MAX_REDIRECTS = 5
+
+
+class CachedResponse:
+    url: str  # final URL, after redirects
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    revalidated: bool  # True if the body came from the on-disk cache after a 304
+
+    def __init__(self, url, body, etag, last_modified, revalidated=False):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.revalidated = revalidated
+
+
+class HTTPCache:
+    """
+    GETs small documents (directory listings, checksum files, JSON feeds) for the whole process:
+    keep-alive connections (one per host per thread), identical concurrent requests coalesced into one,
+    each URL fetched at most once per process, and an on-disk ETag/Last-Modified cache under root so
+    the next run revalidates with a conditional GET and usually gets a 304 instead of the whole listing.
+    Errors are raised as urllib.error.HTTPError / URLError, like urlopen() does.
+    """
+
+    root: str | None
+
+    def __init__(self, root: str | None):
+        self.root = root
+        if root is not None:
+            os.makedirs(root, exist_ok=True)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.inflight: dict[str, Future] = {}
+        self.responses: dict[str, CachedResponse] = {}
+        self.stats = {"requests": 0, "coalesced": 0, "memo": 0, "not_modified": 0, "bytes": 0}
+
+    def get(self, url: str) -> CachedResponse:
+        with self.lock:
+            if url in self.responses:
+                self.stats["memo"] += 1
+                return self.responses[url]
+            future = self.inflight.get(url)
+            owner = future is None
+            if owner:
+                future = self.inflight[url] = Future()
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            return future.result()
+        try:
+            response = self._fetch(url)
+            with self.lock:
+                self.responses[url] = response
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[url]
+
+    # ---- on-disk validators ------------------------------------------------------------------------------------
+
+    def _cache_paths(self, url: str) -> tuple[str, str]:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.root, f"{key}.json"), os.path.join(self.root, f"{key}.body")
+
+    def _load(self, url: str) -> CachedResponse | None:
+        if self.root is None:
+            return None
+        meta_filename, body_filename = self._cache_paths(url)
+        try:
+            with open(meta_filename) as fh:
+                meta = json.load(fh)
+            with open(body_filename, "rb") as fh:
+                body = fh.read()
+        except (OSError, ValueError):
+            return None
+        return CachedResponse(meta["url"], body, meta.get("etag"), meta.get("last_modified"))
+
+    def _store(self, url: str, response: CachedResponse):
+        if self.root is None or (response.etag is None and response.last_modified is None):
+            return
+        meta_filename, body_filename = self._cache_paths(url)
+        with open(f"{body_filename}.tmp", "wb") as fh:
+            fh.write(response.body)
+        os.replace(f"{body_filename}.tmp", body_filename)
+        meta = {"url": response.url, "etag": response.etag, "last_modified": response.last_modified}
+        with open(f"{meta_filename}.tmp", "w") as fh:
+            json.dump(meta, fh)
+        os.replace(f"{meta_filename}.tmp", meta_filename)
+
+    # ---- HTTP ----------------------------------------------------------------------------------------------------
+
+    def _fetch(self, url: str) -> CachedResponse:
+        with span("http_get", "http", url=url) as s:
+            response = self._fetch_traced(url)
+            s.add_bytes(len(response.body))
+            s.set(revalidated=response.revalidated)
+            return response
+
+    def _fetch_traced(self, url: str) -> CachedResponse:
+        started = time.monotonic()
+        cached = self._load(url)
+        headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip"}
+        if cached is not None:
+            if cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        final_url, status, response_headers, body = self._request(url, headers)
+        if status == 304 and cached is not None:
+            log.debug(f"GET {url}: 304 Not Modified, {len(cached.body)} bytes from cache")
+            with self.lock:
+                self.stats["not_modified"] += 1
+            cached.revalidated = True
+            return cached
+
+        if response_headers.get("Content-Encoding", "") == "gzip":
+            body = gzip.decompress(body)
+        response = CachedResponse(final_url, body, response_headers.get("ETag"), response_headers.get("Last-Modified"))
+        self._store(url, response)
+        with self.lock:
+            self.stats["bytes"] += len(body)
+        log.debug(f"GET {url}: {status}, {len(body)} bytes in {time.monotonic() - started:.3f}s")
+        return response
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conns = getattr(self.local, "conns", None)
+        if conns is None:
+            conns = self.local.conns = {}
+        key = (scheme, netloc)
+        if key not in conns:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conns[key] = cls(netloc, timeout=60)
+        return conns[key]
+
+    def _request(self, url: str, headers: dict) -> tuple[str, int, email.message.Message, bytes]:
+        """GET following redirects; returns (final url, status, headers, raw body). Raises HTTPError on >= 400."""
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            with self.lock:
+                self.stats["requests"] += 1
+            if parts.scheme in getproxies() or parts.scheme == "file":
+                # http.client knows nothing about proxies (or local fixture files); let urllib deal with them
+                return self._request_urllib(url, headers)
+            status, response_headers, body = self._request_once(parts, headers)
+            if status in (301, 302, 303, 307, 308) and "Location" in response_headers:
+                url = urljoin(url, response_headers["Location"])
+                continue
+            if status >= 400:
+                raise HTTPError(url, status, http.client.responses.get(status, ""), response_headers, None)
+            return url, status, response_headers, body
+        raise URLError(f"Too many redirects for {url}")
+
+    def _request_once(self, parts, headers: dict) -> tuple[int, email.message.Message, bytes]:
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.headers, response.read()
+            except (http.client.HTTPException, ConnectionError) as e:
+                # stale keep-alive connection; reconnect once
+                conn.close()
+                del self.local.conns[(parts.scheme, parts.netloc)]
+                if attempt > 0:
+                    raise URLError(e)
+            except OSError as e:
+                conn.close()
+                del self.local.conns[(parts.scheme, parts.netloc)]
+                raise URLError(e)
+        raise URLError(f"GET {parts.geturl()} failed")
+
+    @staticmethod
+    def _request_urllib(url: str, headers: dict) -> tuple[str, int, email.message.Message, bytes]:
+        try:
+            with urlopen(Request(url, headers=headers), timeout=60) as response:
+                return response.url, response.status or 200, response.headers, response.read()  # file: has none
+        except HTTPError as e:
+            if e.code == 304:
+                return url, 304, e.headers, b""
+            raise
+
+
+singleton_cache: HTTPCache | None = None
+singleton_cache_lock = threading.Lock()
+
+
+def http_cache() -> HTTPCache:
+    """The process-wide client; HTTP_CACHE sets the validator cache dir (default cache/http), or "off"."""
+    global singleton_cache
+    with singleton_cache_lock:
+        if singleton_cache is None:
+            root = os.environ.get("HTTP_CACHE", os.path.join("cache", "http"))
+            singleton_cache = HTTPCache(None if root == "off" else root)
+        return singleton_cache
+
+
+def http_get(url: str) -> bytes:
+    return http_cache().get(url).body
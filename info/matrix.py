@@ -0,0 +1,76 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import logging
+import time
+
+import click
+import yaml
+
+from distro import DistroBaseInfo
+from executor import StageExecutor
+from history import record_run
+from tracing import tracer
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("matrix")
+
+
+def load_matrix(filename: str, only: list[str] | None = None) -> list[dict]:
+    """
+    Reads matrix entries ({distro, id, env}) from either the GHA workflow (jobs.build.strategy.matrix.include),
+    a {include: [...]} mapping, or a plain list of entries. Optionally keeps only the given ids.
+    """
+    with open(filename) as fh:
+        doc = yaml.safe_load(fh)
+    if isinstance(doc, dict) and "jobs" in doc:
+        doc = doc["jobs"]["build"]["strategy"]["matrix"]
+    if isinstance(doc, dict):
+        doc = doc.get("include") or []
+    entries = [entry for entry in doc if not only or entry["id"] in only]
+    if only:
+        missing = set(only) - {entry["id"] for entry in entries}
+        if missing:
+            raise Exception(f"Matrix ids not found in {filename}: {sorted(missing)}")
+    log.info(f"Matrix {filename}: {[entry['id'] for entry in entries]}")
+    return entries
+
+
+def entry_params(command: click.Command, entry: dict) -> dict:
+    """
+    Maps a matrix entry's env onto the command's parameters through their envvar, like a separate
+    `cli.py <distro>` run with that env would; anything the entry does not set gets the default, never the
+    host environment (that would apply to every entry). FID defaults to the entry id, as the workflow does.
+    """
+    env = {key: str(value) for key, value in (entry.get("env") or {}).items()}
+    env.setdefault("FID", entry["id"])
+    by_envvar = {param.envvar: param for param in command.params if param.envvar}
+    unknown = set(env) - set(by_envvar) - {"FID"}
+    if unknown:
+        raise Exception(f"Matrix entry {entry['id']}: {sorted(unknown)} are not options of '{command.name}'")
+    return {param.name: env.get(param.envvar, param.default) for param in command.params}
+
+
+def run_matrix(distros: list[DistroBaseInfo]) -> bool:
+    """
+    Runs every distro's stages in one graph: one set of resource limits (downloads, NBD devices, disk budget,
+    registry uploads) and one set of process-wide caches (artifact store, GitHub assets, registry tokens).
+    A failing distro only takes its own stages down. Returns whether all of them succeeded.
+    """
+    started = time.monotonic()
+    executor = StageExecutor(keep_going=True)
+    for distro in distros:
+        distro.add_stages(executor, matrix=True)
+    executor.run()
+    tracer().export("matrix")
+
+    all_ok = True
+    for distro in distros:
+        prefix = f"{distro.slug()}:"
+        failed = [name for name in executor.failures if name.startswith(prefix)]
+        if failed:
+            all_ok = False
+            log.error(f"[red]{distro.slug()}: failed in {failed}[/red]")
+        else:
+            log.info(f"[green]{distro.slug()}: ok[/green]")
+        record_run(distro, not distro.failed_in(executor), matrix=True)
+    log.info(f"Matrix of {len(distros)} done in {time.monotonic() - started:.1f}s")
+    return all_ok
@@ -0,0 +1,153 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request
+from urllib.request import urlopen
+
+from artifacts import parse_size
+from tracing import span
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("mirrors")
+
+USER_AGENT = "cloud-container-disk"
+PROBE_TIMEOUT = 10  # seconds; a mirror that slow to answer is not worth ranking
+
+
+class MirrorStats:
+    latency: float | None  # seconds to the response headers of a 1-byte ranged GET
+    throughput: float | None  # bytes/s over a short ranged GET, smoothed across runs
+    probed: float  # time.time() of the last throughput sample
+
+    def __init__(self, latency=None, throughput=None, probed=0.0):
+        self.latency = latency
+        self.throughput = throughput
+        self.probed = probed
+
+    def to_json(self) -> dict:
+        return {"latency": self.latency, "throughput": self.throughput, "probed": self.probed}
+
+
+class MirrorRanking:
+    """
+    Per-mirror latency/throughput, persisted in cache/mirrors.json (MIRRORS_FILE) so the next run starts from the
+    last ranking and only re-samples throughput once it is older than MIRROR_PROBE_TTL (default 6h).
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.stats: dict[str, MirrorStats] = {}
+        try:
+            with open(filename) as fh:
+                self.stats = {base: MirrorStats(**stats) for base, stats in json.load(fh).items()}
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def get(self, base: str) -> MirrorStats:
+        with self.lock:
+            return self.stats.setdefault(base, MirrorStats())
+
+    def update(self, base: str, latency: float, throughput: float | None):
+        with self.lock:
+            stats = self.stats.setdefault(base, MirrorStats())
+            stats.latency = latency
+            if throughput is not None:
+                # smoothed: one unlucky sample should not bury a mirror that is usually fast
+                stats.throughput = throughput if stats.throughput is None else (stats.throughput + throughput) / 2
+                stats.probed = time.time()
+            self.save()
+
+    def save(self):
+        # called with self.lock held
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        with open(f"{self.filename}.tmp", "w") as fh:
+            json.dump({base: stats.to_json() for base, stats in self.stats.items()}, fh, indent=1)
+        os.replace(f"{self.filename}.tmp", self.filename)
+
+
+singleton_ranking: MirrorRanking | None = None
+singleton_ranking_lock = threading.Lock()
+
+
+def mirror_ranking() -> MirrorRanking:
+    global singleton_ranking
+    with singleton_ranking_lock:
+        if singleton_ranking is None:
+            singleton_ranking = MirrorRanking(os.environ.get("MIRRORS_FILE", os.path.join("cache", "mirrors.json")))
+        return singleton_ranking
+
+
+class MirrorPool:
+    """
+    Mirrors carrying the same tree under different base URLs. For a file under the primary base, urls_for()
+    probes every candidate concurrently (is the file there, with the same size; how fast does it answer; a short
+    throughput sample) and returns the file's URL on each usable mirror, fastest first. The downloader fetches
+    from the first one and hedges stalled segments onto the next.
+    """
+
+    def __init__(self, name: str, primary: str, candidates: list[str]):
+        self.name = name
+        self.primary = primary.rstrip("/")
+        self.bases = list(dict.fromkeys([self.primary] + [base.rstrip("/") for base in candidates if base]))
+
+    def urls_for(self, url: str) -> list[str]:
+        if len(self.bases) < 2 or not url.startswith(f"{self.primary}/"):
+            return [url]  # e.g. Rocky's vault, which is not mirrored
+        relative = url[len(self.primary) :]
+        with ThreadPoolExecutor(max_workers=len(self.bases)) as tpe:
+            probes = dict(zip(self.bases, tpe.map(lambda base: self.probe(base, base + relative), self.bases)))
+
+        sizes = [size for size in probes.values() if size is not None]
+        if not sizes:
+            log.warning(f"{self.name}: no mirror answered for {relative}; using {url} as is")
+            return [url]
+        # a mirror still syncing may have an older file under the same name; trust the primary, else the majority
+        size = probes[self.primary] if probes[self.primary] is not None else max(sizes, key=sizes.count)
+        usable = [base for base in self.bases if probes[base] == size]
+        ranking = mirror_ranking()
+        usable.sort(
+            key=lambda base: (-(ranking.get(base).throughput or 0.0), ranking.get(base).latency or PROBE_TIMEOUT)
+        )
+        for base in usable:
+            stats = ranking.get(base)
+            log.info(
+                f"{self.name}: {base}: {(stats.throughput or 0) / 1024 / 1024:.1f} MiB/s, "
+                f"{(stats.latency or 0) * 1000:.0f} ms"
+            )
+        return [base + relative for base in usable]
+
+    @staticmethod
+    def probe(base: str, url: str) -> int | None:
+        """Size of url on this mirror (None if unusable); records latency and, if due, a throughput sample."""
+        ranking = mirror_ranking()
+        sample_bytes = parse_size(os.environ.get("MIRROR_PROBE_BYTES", "2M"))
+        due = time.time() - ranking.get(base).probed > int(os.environ.get("MIRROR_PROBE_TTL", str(6 * 3600)))
+        end = sample_bytes - 1 if due else 0
+        started = time.monotonic()
+        try:
+            with (
+                span("mirror_probe", "http", url=url) as s,
+                urlopen(
+                    Request(url, headers={"User-Agent": USER_AGENT, "Range": f"bytes=0-{end}"}), timeout=PROBE_TIMEOUT
+                ) as response,
+            ):
+                latency = time.monotonic() - started
+                match = re.fullmatch(r"bytes 0-\d+/(\d+)", response.headers.get("Content-Range", "").strip())
+                if response.status != 206 or match is None:
+                    log.info(f"Mirror {base} does not serve ranges for {url}, not using it")
+                    return None
+                received = len(response.read())
+                s.add_bytes(received)
+                elapsed = time.monotonic() - started - latency
+        except Exception as e:
+            log.info(f"Mirror {base} failed for {url}: {e}")
+            return None
+        throughput = received / elapsed if due and elapsed > 0 and received > 1 else None
+        ranking.update(base, latency, throughput)
+        return int(match.group(1))
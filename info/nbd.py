@@ -0,0 +1,135 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import fcntl
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import span
+from utils import setup_logging
+from utils import shell
+
+log: logging.Logger = setup_logging("nbd")
+
+SYS_BLOCK = "/sys/block"
+
+
+class NBDPool:
+    """
+    The host's /dev/nbdN devices, shared with every other run on it. A device is free when the kernel has no
+    client attached to it (no /sys/block/nbdN/pid); a lease is an flock() on <lock_dir>/nbdN.lock, so concurrent
+    runs (and stages of one run) never pick the same device. While leased the lock file holds the holder's pid;
+    a clean release empties it. A device still attached when its lock is free, with a holder recorded, was
+    leaked by a run that crashed before disconnecting it: it is unmounted, disconnected and reused. Attached
+    devices without a recorded holder belong to something else on the host and are left alone.
+    """
+
+    def __init__(self, lock_dir: str, devices: list[int] | None = None, sys_block: str = SYS_BLOCK):
+        self.lock_dir = lock_dir
+        self.devices = devices  # restrict leases to these device numbers; None: every nbd device there is
+        self.sys_block = sys_block
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def candidates(self) -> list[int]:
+        if self.devices:
+            return self.devices
+        found = sorted(
+            int(match.group(1))
+            for name in os.listdir(self.sys_block)
+            if (match := re.fullmatch(r"nbd(\d+)", name)) is not None
+        )
+        if not found:
+            raise Exception(f"No nbd devices in {self.sys_block}; load the module first: modprobe nbd max_part=16")
+        return found
+
+    def attached(self, device_num: int) -> bool:
+        return os.path.exists(os.path.join(self.sys_block, f"nbd{device_num}", "pid"))
+
+    def try_lease(self, device_num: int):
+        """The locked lock file if device_num is now ours, else None."""
+        fh = open(os.path.join(self.lock_dir, f"nbd{device_num}.lock"), "a+")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fh.close()
+            return None
+        fh.seek(0)
+        holder = fh.read().strip()
+        if self.attached(device_num):
+            if not holder:
+                fh.close()
+                return None
+            try:
+                self.reclaim(device_num, holder)
+            except Exception as e:
+                log.warning(f"Could not reclaim /dev/nbd{device_num}: {e}")
+                fh.close()
+                return None
+        fh.seek(0)
+        fh.truncate()
+        fh.write(json.dumps({"pid": os.getpid(), "since": time.time()}))
+        fh.flush()
+        return fh
+
+    def reclaim(self, device_num: int, holder: str):
+        device = f"/dev/nbd{device_num}"
+        log.warning(f"{device} was left connected by a run that did not finish ({holder}); reclaiming it")
+        with span("nbd_reclaim", "extract", device=device):
+            with open("/proc/mounts") as mounts:
+                for line in mounts:
+                    source, mountpoint = line.split()[:2]
+                    if re.fullmatch(rf"{re.escape(device)}(p\d+)?", source):
+                        shell(["umount", "--lazy", mountpoint.replace("\\040", " ")])
+            shell(["qemu-nbd", "--disconnect", device])
+            deadline = time.monotonic() + 10
+            while self.attached(device_num):
+                if time.monotonic() > deadline:
+                    raise Exception(f"{device} is still attached after qemu-nbd --disconnect")
+                time.sleep(0.1)
+
+    @contextmanager
+    def lease(self):
+        """with nbd_pool().lease() as device_num: ... /dev/nbd<device_num> is this caller's until the block ends."""
+        timeout = float(os.environ.get("NBD_LEASE_TIMEOUT", "600"))
+        deadline = time.monotonic() + timeout
+        with span("nbd_lease", "extract") as s:
+            while True:
+                leased = next(((num, fh) for num in self.candidates() if (fh := self.try_lease(num)) is not None), None)
+                if leased is not None:
+                    break
+                if time.monotonic() > deadline:
+                    raise Exception(f"No free nbd device among {self.candidates()} within {timeout:.0f}s")
+                time.sleep(1)
+            device_num, fh = leased
+            s.set(device=f"/dev/nbd{device_num}")
+        log.info(f"Leased /dev/nbd{device_num}")
+        try:
+            yield device_num
+        finally:
+            fh.seek(0)
+            fh.truncate()
+            fh.close()  # closing drops the flock
+            log.info(f"Released /dev/nbd{device_num}")
+
+
+singleton_nbd_pool: NBDPool | None = None
+singleton_nbd_pool_lock = threading.Lock()
+
+
+def nbd_pool() -> NBDPool:
+    """
+    The pool over NBD_LOCK_DIR (default /run/lock/cloud-container-disk-nbd) and, if EXECUTOR_NBD_DEVICES lists
+    some (comma-separated numbers), only those devices.
+    """
+    global singleton_nbd_pool
+    with singleton_nbd_pool_lock:
+        if singleton_nbd_pool is None:
+            lock_root = "/run/lock" if os.path.isdir("/run/lock") else tempfile.gettempdir()
+            lock_dir = os.environ.get("NBD_LOCK_DIR", os.path.join(lock_root, "cloud-container-disk-nbd"))
+            devices = os.environ.get("EXECUTOR_NBD_DEVICES", "")
+            singleton_nbd_pool = NBDPool(lock_dir, [int(num) for num in devices.split(",")] if devices else None)
+        return singleton_nbd_pool
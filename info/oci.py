@@ -0,0 +1,226 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import time
+import zlib
+
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("oci")
+
+MEDIA_TYPE_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+MEDIA_TYPE_INDEX = "application/vnd.oci.image.index.v1+json"
+MEDIA_TYPE_CONFIG = "application/vnd.oci.image.config.v1+json"
+MEDIA_TYPE_LAYER_GZIP = "application/vnd.oci.image.layer.v1.tar+gzip"
+
+ANNOTATION_REF_NAME = "org.opencontainers.image.ref.name"
+ANNOTATION_DESCRIPTION = "org.opencontainers.image.description"
+
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def source_date_epoch() -> int:
+    # Every timestamp in layers and config comes from here, so unchanged inputs give identical digests.
+    return int(os.environ.get("SOURCE_DATE_EPOCH", "0"))
+
+
+def descriptor(media_type: str, digest: str, size: int, annotations: dict | None = None) -> dict:
+    desc = {"mediaType": media_type, "digest": digest, "size": size}
+    if annotations:
+        desc["annotations"] = annotations
+    return desc
+
+
+def canonical_json(obj) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+class HashingGzipWriter:
+    """
+    File-like sink for tarfile: gzips what it is given into out_fh, computing in the same pass
+    the sha256 of the uncompressed tar (the diff_id) and of the compressed blob (the layer digest).
+    zlib's own gzip wrapper writes a zero mtime and no filename, so the output only depends on the input,
+    the level and the zlib version.
+    """
+
+    def __init__(self, out_fh, level: int):
+        self.out_fh = out_fh
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.diff_id_hash = hashlib.sha256()
+        self.digest_hash = hashlib.sha256()
+        self.size = 0
+        self.uncompressed_size = 0
+
+    def _emit(self, data: bytes):
+        if data:
+            self.digest_hash.update(data)
+            self.out_fh.write(data)
+            self.size += len(data)
+
+    def write(self, data: bytes) -> int:
+        self.diff_id_hash.update(data)
+        self.uncompressed_size += len(data)
+        self._emit(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        self._emit(self.compressor.flush())
+
+    @property
+    def diff_id(self) -> str:
+        return f"sha256:{self.diff_id_hash.hexdigest()}"
+
+    @property
+    def digest(self) -> str:
+        return f"sha256:{self.digest_hash.hexdigest()}"
+
+
+class OCILayoutWriter:
+    """Writes an OCI image layout (oci-layout, index.json, blobs/sha256/*) directly, with no Docker daemon."""
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        self.blobs_dir = os.path.join(path, "blobs", "sha256")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        with open(os.path.join(path, "oci-layout"), "w") as fh:
+            json.dump({"imageLayoutVersion": "1.0.0"}, fh)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest.removeprefix("sha256:"))
+
+    def write_blob(self, media_type: str, data: bytes, annotations: dict | None = None) -> dict:
+        digest = f"sha256:{hashlib.sha256(data).hexdigest()}"
+        with open(self.blob_path(digest), "wb") as fh:
+            fh.write(data)
+        return descriptor(media_type, digest, len(data), annotations)
+
+    def write_layer(self, files: list[tuple[str, str]], uid: int, gid: int, gzip_level: int) -> tuple[dict, str]:
+        """
+        Streams files [(src_filename, path_in_image)] into one tar+gzip layer blob; returns (descriptor, diff_id).
+        Directories leading to each file are added too; everything is owned by uid:gid.
+        Headers are deterministic: fixed mtime/mode/owner, no user/group names, files in the given order.
+        """
+        tmp_filename = os.path.join(self.blobs_dir, f"layer-{os.getpid()}-{time.monotonic_ns()}.tmp")
+        started = time.monotonic()
+        with open(tmp_filename, "wb") as out_fh:
+            sink = HashingGzipWriter(out_fh, gzip_level)
+            # big bufsize/copybufsize: tarfile's stream defaults (10-16 KiB) make multi-GB layers crawl
+            with tarfile.open(
+                fileobj=sink,
+                mode="w|",
+                format=tarfile.PAX_FORMAT,
+                bufsize=COPY_CHUNK_SIZE,
+                copybufsize=COPY_CHUNK_SIZE,
+            ) as tar:
+                added_dirs: set[str] = set()
+                for src_filename, path_in_image in files:
+                    parts = path_in_image.strip("/").split("/")
+                    for depth in range(1, len(parts)):
+                        dir_name = "/".join(parts[:depth])
+                        if dir_name not in added_dirs:
+                            added_dirs.add(dir_name)
+                            tar.addfile(self._tarinfo(dir_name, tarfile.DIRTYPE, 0o755, 0, uid, gid))
+                    size = os.path.getsize(src_filename)
+                    info = self._tarinfo("/".join(parts), tarfile.REGTYPE, 0o644, size, uid, gid)
+                    with open(src_filename, "rb") as src_fh:
+                        tar.addfile(info, src_fh)
+            sink.close()
+        os.replace(tmp_filename, self.blob_path(sink.digest))
+        elapsed = time.monotonic() - started
+        log.info(
+            f"Layer {sink.digest}: {sink.uncompressed_size} bytes tar, {sink.size} bytes gzip, {elapsed:.2f}s "
+            f"({sink.uncompressed_size / 1024 / 1024 / max(elapsed, 0.001):.1f} MiB/s)"
+        )
+        return descriptor(MEDIA_TYPE_LAYER_GZIP, sink.digest, sink.size), sink.diff_id
+
+    @staticmethod
+    def _tarinfo(name: str, type, mode: int, size: int, uid: int, gid: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.type = type
+        info.mode = mode
+        info.size = size
+        info.uid = uid
+        info.gid = gid
+        info.uname = ""
+        info.gname = ""
+        info.mtime = source_date_epoch()
+        return info
+
+    def write_image(
+        self,
+        arch: str,
+        layers: list[tuple[dict, str]],
+        labels: dict[str, str],
+        tags: list[str],
+    ) -> dict:
+        """Writes config + manifest for the given (descriptor, diff_id) layers and records tags in index.json."""
+        created = datetime.datetime.fromtimestamp(source_date_epoch(), datetime.timezone.utc)
+        created = created.strftime("%Y-%m-%dT%H:%M:%SZ")
+        config = {
+            "architecture": arch,
+            "os": "linux",
+            "created": created,
+            "config": {"Labels": labels},
+            "rootfs": {"type": "layers", "diff_ids": [diff_id for _, diff_id in layers]},
+            "history": [{"created": created, "created_by": "cloud-container-disk"} for _ in layers],
+        }
+        config_desc = self.write_blob(MEDIA_TYPE_CONFIG, canonical_json(config))
+        manifest = {
+            "schemaVersion": 2,
+            "mediaType": MEDIA_TYPE_MANIFEST,
+            "config": config_desc,
+            "layers": [layer_desc for layer_desc, _ in layers],
+            "annotations": {key: value for key, value in labels.items() if key == ANNOTATION_DESCRIPTION},
+        }
+        manifest_desc = self.write_blob(MEDIA_TYPE_MANIFEST, canonical_json(manifest))
+        manifest_desc["platform"] = {"architecture": arch, "os": "linux"}
+
+        index = {"schemaVersion": 2, "mediaType": MEDIA_TYPE_INDEX, "manifests": []}
+        for tag in tags:
+            index["manifests"].append(dict(manifest_desc, annotations={ANNOTATION_REF_NAME: tag}))
+        with open(os.path.join(self.path, "index.json"), "wb") as fh:
+            fh.write(canonical_json(index))
+        log.info(f"Wrote OCI layout {self.path}: manifest {manifest_desc['digest']} tagged {tags}")
+        return manifest_desc
+
+
+def build_oci_layout(
+    path: str, arch: str, layers: list[list[tuple[str, str]]], labels: dict[str, str], tags: list[str]
+) -> dict:
+    """
+    Builds a FROM-scratch image as an OCI layout; each entry of layers is a list of (src_filename, path_in_image)
+    that becomes one layer. Files are owned by 107:107 (qemu in KubeVirt).
+    """
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    writer = OCILayoutWriter(path)
+    gzip_level = int(os.environ.get("OCI_GZIP_LEVEL", "6"))
+    written = [writer.write_layer(files, uid=107, gid=107, gzip_level=gzip_level) for files in layers]
+    return writer.write_image(arch, written, labels, tags)
+
+
+def layout_manifest(layout_dir: str, tag: str) -> tuple[dict, bytes]:
+    """Returns (descriptor incl. platform, manifest bytes) of the manifest tagged tag in an OCI layout."""
+    with open(os.path.join(layout_dir, "index.json")) as fh:
+        index = json.load(fh)
+    by_tag = {desc.get("annotations", {}).get(ANNOTATION_REF_NAME): desc for desc in index["manifests"]}
+    if tag not in by_tag:
+        raise Exception(f"Tag {tag} not found in {layout_dir}, has {list(by_tag.keys())}")
+    desc = {key: value for key, value in by_tag[tag].items() if key != "annotations"}
+    with open(os.path.join(layout_dir, "blobs", "sha256", desc["digest"].removeprefix("sha256:")), "rb") as fh:
+        return desc, fh.read()
+
+
+def image_index(manifest_descs: list[dict]) -> bytes:
+    """An OCI image index over per-arch manifest descriptors (which must carry their platform)."""
+    for desc in manifest_descs:
+        if "platform" not in desc:
+            raise Exception(f"Manifest descriptor {desc['digest']} has no platform")
+    return canonical_json({"schemaVersion": 2, "mediaType": MEDIA_TYPE_INDEX, "manifests": manifest_descs})
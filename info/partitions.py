@@ -0,0 +1,322 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import fnmatch
+import logging
+import os
+import struct
+import uuid
+import zlib
+from typing import Callable
+
+from ext4 import Ext4Filesystem
+from fat import FatFilesystem
+from qcow2 import QCOW2_MAGIC
+from qcow2 import Qcow2Image
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("partitions")
+
+SECTOR = 512
+
+GPT_TYPES = {
+    "c12a7328-f81f-11d2-ba4b-00a0c93ec93b": "EFI System",
+    "21686148-6449-6e6f-744e-656564454649": "BIOS boot",
+    "bc13c2ff-59e6-4262-a352-b275fd6f7172": "Linux extended boot",
+    "0fc63daf-8483-4772-8e79-3d69d8477de4": "Linux filesystem",
+    "4f68bce3-e8cd-4db1-96e7-fbcaf984b709": "Linux root (x86-64)",
+    "b921b045-1df0-41c3-af44-4c6f280d3fae": "Linux root (ARM64)",
+    "0657fd6d-a4ab-43c4-84e5-0933c84b4f4f": "Linux swap",
+    "e6d6d379-f507-44c2-a23c-238f2a3df928": "Linux LVM",
+    "ebd0a0a2-b9e5-4433-87c0-68b6b72699c7": "Microsoft basic data",
+}
+MBR_EXTENDED = (0x05, 0x0F, 0x85)
+MBR_PROTECTIVE = 0xEE
+
+# Filesystems a kernel can be booted from; the rest (swap, LVM PVs, unknown) are not worth looking into
+BOOTABLE_FILESYSTEMS = ("ext2", "ext3", "ext4", "vfat", "xfs", "btrfs")
+PROBE_BYTES = 0x10200  # reaches every magic probe_filesystem() looks at, btrfs' at 64 KiB the farthest
+
+
+class PartitionError(Exception):
+    pass
+
+
+class RawDisk:
+    """A raw image or a block device (a connected /dev/nbdN), with the read(offset, length) of a Qcow2Image."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.fd = os.open(filename, os.O_RDONLY)
+        self.virtual_size = os.lseek(self.fd, 0, os.SEEK_END)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return os.pread(self.fd, max(0, min(length, self.virtual_size - offset)), offset)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_disk(filename: str) -> Qcow2Image | RawDisk:
+    with open(filename, "rb") as fh:
+        is_qcow2 = fh.read(4) == QCOW2_MAGIC
+    return Qcow2Image(filename) if is_qcow2 else RawDisk(filename)
+
+
+class Partition:
+    number: int  # as the kernel numbers it: /dev/nbdNp<number>
+    start: int  # bytes
+    size: int  # bytes
+    type: str  # GPT type GUID, or MBR type as "0x83"
+    name: str  # GPT partition name
+    uuid: str | None  # GPT unique partition GUID
+    filesystem: str | None  # from its superblock magic
+    label: str  # filesystem label
+
+    def __init__(self, number, start, size, type, name="", uuid=None):
+        self.number = number
+        self.start = start
+        self.size = size
+        self.type = type
+        self.name = name
+        self.uuid = uuid
+        self.filesystem = None
+        self.label = ""
+
+    @property
+    def type_name(self) -> str:
+        return GPT_TYPES.get(self.type, self.type)
+
+    def __repr__(self):
+        return (
+            f"Partition({self.number}, start={self.start}, size={self.size}, {self.type_name}, "
+            f"name={self.name!r}, fs={self.filesystem}, label={self.label!r})"
+        )
+
+
+def parse_gpt(disk) -> list[Partition] | None:
+    # The header is in LBA 1; 4Kn disks put it 4096 bytes in instead of 512
+    for sector in (SECTOR, 4096):
+        header = disk.read(sector, 92)
+        if header[:8] != b"EFI PART":
+            continue
+        header_size = struct.unpack_from("<I", header, 12)[0]
+        header = disk.read(sector, header_size)
+        crc = struct.unpack_from("<I", header, 16)[0]
+        if zlib.crc32(header[:16] + b"\0\0\0\0" + header[20:]) != crc:
+            log.warning("GPT header checksum mismatch; reading its partition entries anyway")
+        entries_lba, count, entry_size = struct.unpack_from("<QII", header, 72)
+        entries = disk.read(entries_lba * sector, count * entry_size)
+        partitions = []
+        for index in range(count):
+            entry = entries[index * entry_size : (index + 1) * entry_size]
+            if len(entry) < 128 or entry[:16] == bytes(16):
+                continue
+            first, last = struct.unpack_from("<QQ", entry, 32)
+            name = entry[56:128].decode("utf-16-le", errors="replace").split("\0", 1)[0]
+            partitions.append(
+                Partition(
+                    index + 1,
+                    first * sector,
+                    (last - first + 1) * sector,
+                    str(uuid.UUID(bytes_le=entry[:16])),
+                    name,
+                    str(uuid.UUID(bytes_le=entry[16:32])),
+                )
+            )
+        return partitions
+    return None
+
+
+def parse_mbr(disk) -> list[Partition]:
+    mbr = disk.read(0, SECTOR)
+    if len(mbr) < SECTOR or mbr[510:512] != b"\x55\xaa":
+        raise PartitionError("No GPT and no MBR boot signature")
+    partitions = []
+    for index in range(4):
+        _, kind, lba, sectors = struct.unpack_from("<B3xB3xII", mbr, 446 + index * 16)
+        if kind == 0 or sectors == 0:
+            continue
+        if kind in MBR_EXTENDED:
+            partitions += parse_ebr_chain(disk, lba)
+        else:
+            partitions.append(Partition(index + 1, lba * SECTOR, sectors * SECTOR, f"{kind:#04x}"))
+    return partitions
+
+
+def parse_ebr_chain(disk, extended_lba: int) -> list[Partition]:
+    # Logical partitions, numbered from 5: each EBR describes one and links to the next, relative to the extended one
+    partitions = []
+    ebr_lba = extended_lba
+    seen = set()
+    while ebr_lba not in seen:
+        seen.add(ebr_lba)
+        ebr = disk.read(ebr_lba * SECTOR, SECTOR)
+        if len(ebr) < SECTOR or ebr[510:512] != b"\x55\xaa":
+            break
+        _, kind, lba, sectors = struct.unpack_from("<B3xB3xII", ebr, 446)
+        if kind and sectors:
+            partitions.append(
+                Partition(5 + len(partitions), (ebr_lba + lba) * SECTOR, sectors * SECTOR, f"{kind:#04x}")
+            )
+        _, next_kind, next_lba, _ = struct.unpack_from("<B3xB3xII", ebr, 462)
+        if next_kind not in MBR_EXTENDED or not next_lba:
+            break
+        ebr_lba = extended_lba + next_lba
+    return partitions
+
+
+def probe_filesystem(data: bytes) -> tuple[str | None, str]:
+    """(filesystem, label) from the first PROBE_BYTES of a partition."""
+
+    def label(raw: bytes) -> str:
+        return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace").strip()
+
+    if data[1024 + 56 : 1024 + 58] == b"\x53\xef":
+        compat, incompat = struct.unpack_from("<I4xI", data, 1024 + 92)
+        kind = "ext4" if incompat & 0x2C0 else "ext3" if compat & 0x4 else "ext2"  # extents/64bit/flex_bg; journal
+        return kind, label(data[1024 + 120 : 1024 + 136])
+    if data[510:512] == b"\x55\xaa" and data[82:87] == b"FAT32":
+        return "vfat", label(data[71:82])
+    if data[510:512] == b"\x55\xaa" and data[54:57] == b"FAT":
+        return "vfat", label(data[43:54])
+    if data[:4] == b"XFSB":
+        return "xfs", label(data[108:120])
+    if data[0x10040:0x10048] == b"_BHRfS_M":
+        return "btrfs", label(data[0x1012B:0x1022B])
+    if data[4086:4096] == b"SWAPSPACE2" or data[65526:65536] == b"SWAPSPACE2":
+        return "swap", ""
+    if data[512:520] == b"LABELONE" and data[536:544] == b"LVM2 001":
+        return "LVM2_member", ""
+    return None, ""
+
+
+def read_partitions(disk) -> list[Partition]:
+    """The partitions of a disk (Qcow2Image or RawDisk), with the filesystem each one holds."""
+    partitions = parse_gpt(disk)
+    if partitions is None:
+        partitions = parse_mbr(disk)
+        if any(partition.type == f"{MBR_PROTECTIVE:#04x}" for partition in partitions):
+            raise PartitionError("Protective MBR but no readable GPT header")
+    for partition in partitions:
+        partition.filesystem, partition.label = probe_filesystem(disk.read(partition.start, PROBE_BYTES))
+    return partitions
+
+
+# A directory lister answers lister("boot") with the names in that directory, or None if it is not one.
+Lister = Callable[[str], list[str] | None]
+
+# Filesystems that can be read in-process, without mounting: reader(disk, partition) returns an object whose
+# listdir(path) is a Lister and whose stream(path) yields a regular file's contents in large chunks.
+FILESYSTEM_READERS: dict[str, Callable] = {
+    "ext2": lambda disk, partition: Ext4Filesystem(disk, partition.start),
+    "ext3": lambda disk, partition: Ext4Filesystem(disk, partition.start),
+    "ext4": lambda disk, partition: Ext4Filesystem(disk, partition.start),
+    "vfat": lambda disk, partition: FatFilesystem(disk, partition.start),
+}
+
+
+def directory_lister(path: str) -> Lister:
+    """A lister over a mounted filesystem."""
+
+    def lister(relative: str) -> list[str] | None:
+        full = os.path.join(path, relative)
+        return os.listdir(full) if os.path.isdir(full) else None
+
+    return lister
+
+
+def glob_with(lister: Lister, pattern: str) -> list[str]:
+    # glob.glob()'s matching (no hidden files unless asked for) over a lister, one path component at a time
+    paths = [""]
+    for part in pattern.split("/"):
+        if not part:
+            continue
+        matched = []
+        for base in paths:
+            for name in lister(base) or []:
+                if name.startswith(".") and not part.startswith("."):
+                    continue
+                if fnmatch.fnmatchcase(name, part):
+                    matched.append(f"{base}/{name}" if base else name)
+        paths = matched
+    return paths
+
+
+def find_kernel(lister: Lister, patterns: list[str], prefixes: list[str]) -> str | None:
+    """The first of prefixes under which patterns match a (non-rescue) kernel, as glob_non_rescue() looks."""
+    for prefix in prefixes:
+        for pattern in patterns:
+            if any("-rescue" not in match for match in glob_with(lister, prefix + pattern)):
+                return prefix
+    return None
+
+
+def glob_non_rescue(lister: Lister, prefix: str, patterns: list[str]) -> str:
+    """The one non-rescue match of patterns under prefix, as DevicePathMounter.glob_non_rescue() on a mount."""
+    matches = [match for pattern in patterns for match in glob_with(lister, prefix + pattern)]
+    matches = [match for match in matches if "-rescue" not in match]
+    if len(matches) != 1:
+        raise PartitionError(
+            f"Found {len(matches)} '{patterns}' files under '{prefix}': {matches}; {prefix} holds {lister(prefix)}"
+        )
+    log.info(f"glob single result: {matches[0]}")
+    return matches[0]
+
+
+def boot_prefixes(hint_prefix: str) -> list[str]:
+    # a separate /boot partition has the kernel at its root, a root filesystem in boot/
+    return list(dict.fromkeys([hint_prefix, "", "boot/"]))
+
+
+class BootScan:
+    partitions: list[Partition]
+    found: tuple[Partition, str] | None  # the partition and directory prefix of the kernel, found without mounting
+    undecided: list[int]  # partitions that might hold it but can only be looked into mounted, likeliest first
+
+    def __init__(self, partitions, found, undecided):
+        self.partitions = partitions
+        self.found = found
+        self.undecided = undecided
+
+
+def scan_boot(disk, patterns: list[str], hint_partition: int, hint_prefix: str) -> BootScan:
+    """
+    Looks for the partition holding the kernel: every partition with a bootable filesystem, the distro's hint
+    first, each under the hinted directory prefix, the root and boot/. Filesystems with a registered reader are
+    looked into in-process; the rest are left for the caller to mount, in that order.
+    """
+    partitions = read_partitions(disk)
+    for partition in partitions:
+        log.info(f"{partition}")
+    candidates = sorted(
+        (
+            partition
+            for partition in partitions
+            if partition.filesystem in BOOTABLE_FILESYSTEMS or partition.number == hint_partition
+        ),
+        key=lambda partition: (partition.number != hint_partition, partition.number),
+    )
+    prefixes = boot_prefixes(hint_prefix)
+    undecided = []
+    for partition in candidates:
+        reader = FILESYSTEM_READERS.get(partition.filesystem)
+        if reader is None:
+            undecided.append(partition.number)
+            continue
+        try:
+            prefix = find_kernel(reader(disk, partition).listdir, patterns, prefixes)
+        except Exception as e:
+            log.warning(f"Could not look into partition {partition.number} ({partition.filesystem}): {e}")
+            undecided.append(partition.number)
+            continue
+        if prefix is not None:
+            log.info(f"Kernel {patterns} found in partition {partition.number} under '{prefix}'")
+            return BootScan(partitions, (partition, prefix), undecided)
+    return BootScan(partitions, None, undecided)
@@ -0,0 +1,298 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import io
+import logging
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("qcow2")
+
+QCOW2_MAGIC = b"QFI\xfb"
+HEADER_V2 = struct.Struct(">4sIQIIQIIQQIIQ")  # 72 bytes
+HEADER_V3 = struct.Struct(">QQQII")  # the 32 bytes v3 adds after the v2 header
+
+INCOMPAT_DIRTY = 1 << 0
+INCOMPAT_CORRUPT = 1 << 1
+INCOMPAT_DATA_FILE = 1 << 2
+INCOMPAT_COMPRESSION = 1 << 3
+INCOMPAT_EXTL2 = 1 << 4
+
+L1_OFFSET_MASK = 0x00FF_FFFF_FFFF_FE00
+L2_OFFSET_MASK = 0x00FF_FFFF_FFFF_FE00
+L2_COMPRESSED = 1 << 62
+L2_ZERO = 1 << 0
+
+COMPRESSION_ZLIB = 0
+COMPRESSION_ZSTD = 1
+
+# allocation map kinds
+DATA = "data"
+COMPRESSED = "compressed"
+ZERO = "zero"  # reads as zeros: the v3 zero flag
+UNALLOCATED = "unallocated"  # reads as zeros too, there being no backing file
+
+
+class Qcow2Error(Exception):
+    pass
+
+
+def zstd_decompressor():
+    # zstd-compressed images are rare (qemu-img's default is zlib), so its module is only needed when one shows up
+    try:
+        from compression import zstd  # Python 3.14+
+
+        return lambda data, size: zstd.ZstdDecompressor().decompress(data, max_length=size)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+
+        return lambda data, size: zstandard.ZstdDecompressor().decompressobj().decompress(data)[:size]
+    except ImportError:
+        raise Qcow2Error("Image has zstd-compressed clusters; install zstandard (or use Python 3.14+)") from None
+
+
+class LRUCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: OrderedDict[int, bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: int) -> bytes | None:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: int, value: bytes):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+class Qcow2Image:
+    """
+    Read-only qcow2 (v2 and v3) without qemu-nbd, the nbd module or root: guest offsets are translated through
+    the L1/L2 tables, compressed clusters are inflated (zlib, or zstd with a zstd module), and unallocated and zero
+    clusters read as zeros. L2 tables and inflated clusters are kept in LRU caches; data clusters are pread()
+    straight from the file, whose pages the kernel already caches. Backing files, encryption, external data files
+    and subclusters (extended L2) are not supported; cloud images use none of them.
+    Thread-safe: several readers can share one image.
+    """
+
+    filename: str
+    version: int
+    virtual_size: int
+    cluster_size: int
+    compression_type: int
+
+    def __init__(self, filename: str, cache_clusters: int = 256):
+        self.filename = filename
+        self.fd = os.open(filename, os.O_RDONLY)
+        try:
+            self.parse_header()
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.lock = threading.Lock()
+        self.l2_cache = LRUCache(cache_clusters)
+        self.cluster_cache = LRUCache(cache_clusters)
+        self.decompress_zstd = None
+
+    def parse_header(self):
+        header = os.pread(self.fd, HEADER_V2.size + HEADER_V3.size + 8, 0)
+        if len(header) < HEADER_V2.size or header[:4] != QCOW2_MAGIC:
+            raise Qcow2Error(f"{self.filename} is not a qcow2 image")
+        (
+            _,
+            self.version,
+            backing_file_offset,
+            _,
+            self.cluster_bits,
+            self.virtual_size,
+            crypt_method,
+            self.l1_size,
+            self.l1_table_offset,
+            _,
+            _,
+            _,
+            _,
+        ) = HEADER_V2.unpack_from(header)
+        if self.version not in (2, 3):
+            raise Qcow2Error(f"{self.filename}: unsupported qcow2 version {self.version}")
+        if backing_file_offset:
+            raise Qcow2Error(f"{self.filename} has a backing file, which is not supported")
+        if crypt_method:
+            raise Qcow2Error(f"{self.filename} is encrypted, which is not supported")
+        if not 9 <= self.cluster_bits <= 21:
+            raise Qcow2Error(f"{self.filename}: invalid cluster_bits {self.cluster_bits}")
+        self.cluster_size = 1 << self.cluster_bits
+        self.l2_entries = self.cluster_size // 8
+        self.compression_type = COMPRESSION_ZLIB
+        if self.version == 3:
+            incompatible, _, _, _, header_length = HEADER_V3.unpack_from(header, HEADER_V2.size)
+            unsupported = incompatible & ~(INCOMPAT_DIRTY | INCOMPAT_CORRUPT | INCOMPAT_COMPRESSION)
+            if unsupported:
+                raise Qcow2Error(f"{self.filename}: unsupported incompatible features {unsupported:#x}")
+            if incompatible & INCOMPAT_CORRUPT:
+                log.warning(f"{self.filename} is marked corrupt; reading it anyway")
+            if incompatible & INCOMPAT_COMPRESSION:
+                if header_length <= HEADER_V2.size + HEADER_V3.size:
+                    raise Qcow2Error(f"{self.filename}: compression type bit set but no compression type field")
+                self.compression_type = header[HEADER_V2.size + HEADER_V3.size]
+            if self.compression_type not in (COMPRESSION_ZLIB, COMPRESSION_ZSTD):
+                raise Qcow2Error(f"{self.filename}: unknown compression type {self.compression_type}")
+        if self.l1_size * self.l2_entries * self.cluster_size < self.virtual_size:
+            raise Qcow2Error(f"{self.filename}: L1 table of {self.l1_size} entries cannot map the virtual size")
+        l1 = os.pread(self.fd, self.l1_size * 8, self.l1_table_offset)
+        if len(l1) != self.l1_size * 8:
+            raise Qcow2Error(f"{self.filename}: truncated L1 table")
+        self.l1 = struct.unpack(f">{self.l1_size}Q", l1)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return (
+            f"Qcow2Image({self.filename}, v{self.version}, {self.virtual_size} bytes, "
+            f"{self.cluster_size}-byte clusters, {'zstd' if self.compression_type == COMPRESSION_ZSTD else 'zlib'})"
+        )
+
+    def l2_entry(self, cluster_index: int) -> int:
+        l1_index, l2_index = divmod(cluster_index, self.l2_entries)
+        l2_offset = self.l1[l1_index] & L1_OFFSET_MASK
+        if not l2_offset:
+            return 0
+        with self.lock:
+            table = self.l2_cache.get(l2_offset)
+        if table is None:
+            table = os.pread(self.fd, self.cluster_size, l2_offset)
+            if len(table) != self.cluster_size:
+                raise Qcow2Error(f"{self.filename}: truncated L2 table at {l2_offset}")
+            with self.lock:
+                self.l2_cache.put(l2_offset, table)
+        return struct.unpack_from(">Q", table, l2_index * 8)[0]
+
+    def cluster_kind(self, entry: int) -> str:
+        if entry & L2_COMPRESSED:
+            return COMPRESSED
+        if entry & L2_ZERO and self.version == 3:
+            return ZERO
+        return DATA if entry & L2_OFFSET_MASK else UNALLOCATED
+
+    def compressed_cluster(self, entry: int) -> bytes:
+        # the host offset takes the low 62 - (cluster_bits - 8) bits; above it, the count of extra 512-byte sectors
+        offset_bits = 62 - (self.cluster_bits - 8)
+        host_offset = entry & ((1 << offset_bits) - 1)
+        with self.lock:
+            cluster = self.cluster_cache.get(host_offset)
+        if cluster is not None:
+            return cluster
+        sectors = ((entry & ~L2_COMPRESSED) >> offset_bits) + 1
+        data = os.pread(self.fd, sectors * 512 - (host_offset & 511), host_offset)
+        if self.compression_type == COMPRESSION_ZSTD:
+            if self.decompress_zstd is None:
+                self.decompress_zstd = zstd_decompressor()
+            cluster = self.decompress_zstd(data, self.cluster_size)
+        else:
+            cluster = zlib.decompressobj(-12).decompress(data, self.cluster_size)
+        if len(cluster) != self.cluster_size:
+            raise Qcow2Error(f"{self.filename}: compressed cluster at {host_offset} inflates to {len(cluster)} bytes")
+        with self.lock:
+            self.cluster_cache.put(host_offset, cluster)
+        return cluster
+
+    def read(self, offset: int, length: int) -> bytes:
+        """length bytes at guest offset, fewer only past the end of the virtual disk."""
+        length = max(0, min(length, self.virtual_size - offset))
+        out = bytearray(length)
+        self.readinto(offset, memoryview(out))
+        return bytes(out)
+
+    def readinto(self, offset: int, buffer: memoryview) -> int:
+        length = max(0, min(len(buffer), self.virtual_size - offset))
+        done = 0
+        while done < length:
+            cluster_index, in_cluster = divmod(offset + done, self.cluster_size)
+            chunk = min(self.cluster_size - in_cluster, length - done)
+            entry = self.l2_entry(cluster_index)
+            kind = self.cluster_kind(entry)
+            target = buffer[done : done + chunk]
+            if kind == DATA:
+                data = os.pread(self.fd, chunk, (entry & L2_OFFSET_MASK) + in_cluster)
+                if len(data) != chunk:
+                    raise Qcow2Error(f"{self.filename}: data cluster at {entry & L2_OFFSET_MASK} is past the end")
+                target[:] = data
+            elif kind == COMPRESSED:
+                target[:] = memoryview(self.compressed_cluster(entry))[in_cluster : in_cluster + chunk]
+            else:
+                target[:] = bytes(chunk)
+            done += chunk
+        return length
+
+    def allocation_map(self) -> list[tuple[int, int, str]]:
+        """(guest offset, length, kind) runs covering the whole virtual disk, adjacent clusters of a kind merged."""
+        runs: list[tuple[int, int, str]] = []
+        clusters = -(-self.virtual_size // self.cluster_size)
+        for cluster_index in range(clusters):
+            kind = self.cluster_kind(self.l2_entry(cluster_index))
+            start = cluster_index * self.cluster_size
+            length = min(self.cluster_size, self.virtual_size - start)
+            if runs and runs[-1][2] == kind:
+                runs[-1] = (runs[-1][0], runs[-1][1] + length, kind)
+            else:
+                runs.append((start, length, kind))
+        return runs
+
+    def open(self) -> "Qcow2File":
+        return Qcow2File(self)
+
+
+class Qcow2File(io.RawIOBase):
+    """A seekable, read-only file over the guest view of a Qcow2Image; wrap in io.BufferedReader for small reads."""
+
+    def __init__(self, image: Qcow2Image):
+        super().__init__()
+        self.image = image
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.image.virtual_size
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        count = self.image.readinto(self.position, memoryview(buffer).cast("B"))
+        self.position += count
+        return count
@@ -0,0 +1,438 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import base64
+import hashlib
+import http.client
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+
+from oci import MEDIA_TYPE_INDEX
+from oci import MEDIA_TYPE_MANIFEST
+from oci import layout_manifest
+from tracing import span
+from utils import setup_logging
+
+log: logging.Logger = setup_logging("registry")
+
+MANIFEST_ACCEPT = ",".join(
+    [
+        MEDIA_TYPE_MANIFEST,
+        MEDIA_TYPE_INDEX,
+        "application/vnd.docker.distribution.manifest.v2+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+    ]
+)
+USER_AGENT = "cloud-container-disk"
+
+
+def parse_reference(oci_ref: str) -> tuple[str, str, str]:
+    """Splits "registry/repo/name:tag" (or @digest) into (registry, repository, tag-or-digest)."""
+    if "@" in oci_ref:
+        name, reference = oci_ref.split("@", 1)
+    else:
+        name, _, reference = oci_ref.rpartition(":")
+        if name == "" or "/" in reference:
+            name, reference = oci_ref, "latest"
+    registry, _, repository = name.partition("/")
+    if repository == "" or ("." not in registry and ":" not in registry and registry != "localhost"):
+        registry, repository = "registry-1.docker.io", name  # Docker Hub
+        if "/" not in repository:
+            repository = f"library/{repository}"
+    if registry == "docker.io":
+        registry = "registry-1.docker.io"
+    return registry, repository, reference
+
+
+class RegistryError(Exception):
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+class RegistryResponse:
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class RegistryClient:
+    """
+    Minimal OCI distribution-spec client for one registry: keep-alive connections (one per thread),
+    bearer/basic auth with cached tokens, blob existence checks, cross-repo mounts and chunked uploads.
+    """
+
+    registry: str
+
+    def __init__(self, registry: str):
+        self.registry = registry
+        insecure = os.environ.get("REGISTRY_INSECURE", "").split(",")
+        plain_http = registry.split(":")[0] in ("localhost", "127.0.0.1") or registry in insecure
+        self.base_url = f"{'http' if plain_http else 'https'}://{registry}"
+        self.chunk_size = int(os.environ.get("REGISTRY_CHUNK_SIZE", str(64 * 1024 * 1024)))
+        self.local = threading.local()
+        self.tokens: dict[str, tuple[str, float]] = {}  # scope -> (Authorization header, expiry)
+        self.tokens_lock = threading.Lock()
+        self.challenge: dict[str, str] | None = None
+        self.bytes_uploaded = 0
+        self.stats_lock = threading.Lock()
+
+    # ---- credentials & auth --------------------------------------------------------------------------------------
+
+    def credentials(self) -> tuple[str, str] | None:
+        if os.environ.get("REGISTRY_USERNAME") and os.environ.get("REGISTRY_PASSWORD"):
+            return os.environ["REGISTRY_USERNAME"], os.environ["REGISTRY_PASSWORD"]
+        docker_config = os.path.join(os.environ.get("DOCKER_CONFIG", os.path.expanduser("~/.docker")), "config.json")
+        if os.path.exists(docker_config):
+            with open(docker_config) as fh:
+                auths = json.load(fh).get("auths", {})
+            for key in (self.registry, f"https://{self.registry}", "https://index.docker.io/v1/"):
+                if key in auths and auths[key].get("auth"):
+                    user, _, password = base64.b64decode(auths[key]["auth"]).decode().partition(":")
+                    return user, password
+        if self.registry == "ghcr.io" and os.environ.get("GITHUB_TOKEN"):
+            return os.environ.get("GITHUB_ACTOR", "token"), os.environ["GITHUB_TOKEN"]
+        return None
+
+    @staticmethod
+    def _parse_challenge(header: str) -> dict[str, str]:
+        scheme, _, params = header.partition(" ")
+        challenge = {key: value for key, value in re.findall(r'(\w+)="([^"]*)"', params)}
+        challenge["scheme"] = scheme.lower()
+        return challenge
+
+    def _authorization(self, scope: str) -> str | None:
+        if self.challenge is None:
+            return None
+        if self.challenge["scheme"] == "basic":
+            creds = self.credentials()
+            return None if creds is None else "Basic " + base64.b64encode(":".join(creds).encode()).decode()
+        with self.tokens_lock:
+            cached = self.tokens.get(scope)
+            if cached is not None and cached[1] > time.monotonic():
+                return cached[0]
+        query = {"service": self.challenge.get("service", self.registry)}
+        if scope:
+            query["scope"] = scope
+        url = f"{self.challenge['realm']}?{urlencode(query)}"
+        headers = {}
+        creds = self.credentials()
+        if creds is not None:
+            headers["Authorization"] = "Basic " + base64.b64encode(":".join(creds).encode()).decode()
+        response = self._raw_request("GET", url, headers)
+        if response.status != 200:
+            raise RegistryError(f"Token request for scope '{scope}' failed: {response.status}", response.status)
+        token_json = json.loads(response.body)
+        token = token_json.get("token") or token_json.get("access_token")
+        expires_in = int(token_json.get("expires_in", 60))
+        header = f"Bearer {token}"
+        with self.tokens_lock:
+            self.tokens[scope] = (header, time.monotonic() + max(10, expires_in - 10))
+        log.debug(f"Got registry token for {self.registry} scope '{scope}' valid for {expires_in}s")
+        return header
+
+    # ---- HTTP ----------------------------------------------------------------------------------------------------
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conns = getattr(self.local, "conns", None)
+        if conns is None:
+            conns = self.local.conns = {}
+        key = (scheme, netloc)
+        if key not in conns:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conns[key] = cls(netloc, timeout=300)
+        return conns[key]
+
+    def _raw_request(self, method: str, url: str, headers: dict, body=None) -> RegistryResponse:
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        headers = dict(headers, **{"User-Agent": USER_AGENT})
+        for attempt in range(2):
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                return RegistryResponse(response.status, response.headers, data)
+            except (http.client.HTTPException, ConnectionError) as e:
+                # stale keep-alive connection; reconnect once
+                conn.close()
+                del self.local.conns[(parts.scheme, parts.netloc)]
+                if attempt > 0:
+                    raise RegistryError(f"{method} {url} failed: {e}")
+                if hasattr(body, "seek"):
+                    body.seek(0)
+        raise RegistryError(f"{method} {url} failed")
+
+    def request(self, method: str, url: str, scope: str, headers: dict | None = None, body=None) -> RegistryResponse:
+        url = urljoin(self.base_url, url)
+        headers = dict(headers or {})
+        authorization = self._authorization(scope)
+        if authorization is not None:
+            headers["Authorization"] = authorization
+        response = self._raw_request(method, url, headers, body)
+        if response.status == 401 and "WWW-Authenticate" in response.headers:
+            self.challenge = self._parse_challenge(response.headers["WWW-Authenticate"])
+            with self.tokens_lock:
+                self.tokens.pop(scope, None)
+            if hasattr(body, "seek"):
+                body.seek(0)
+            authorization = self._authorization(scope)
+            if authorization is not None:
+                headers["Authorization"] = authorization
+            response = self._raw_request(method, url, headers, body)
+        return response
+
+    # ---- blobs ---------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def push_scope(repository: str, *mount_from: str) -> str:
+        return " ".join([f"repository:{repository}:pull,push"] + [f"repository:{repo}:pull" for repo in mount_from])
+
+    def blob_exists(self, repository: str, digest: str) -> bool:
+        response = self.request("HEAD", f"/v2/{repository}/blobs/{digest}", self.push_scope(repository))
+        if response.status in (200, 307):
+            return True
+        if response.status == 404:
+            return False
+        raise RegistryError(f"HEAD blob {repository}@{digest}: {response.status}", response.status)
+
+    def start_upload(self, repository: str, digest: str, mount_from: str | None = None) -> str | None:
+        """Starts an upload session; returns its Location, or None if the blob got cross-repo mounted instead."""
+        url = f"/v2/{repository}/blobs/uploads/"
+        scope = self.push_scope(repository)
+        if mount_from is not None:
+            url += "?" + urlencode({"mount": digest, "from": mount_from})
+            scope = self.push_scope(repository, mount_from)
+        response = self.request("POST", url, scope, {"Content-Length": "0"}, b"")
+        if response.status == 201:
+            log.info(f"Mounted {digest} into {repository} from {mount_from}")
+            return None
+        if response.status != 202:
+            raise RegistryError(f"POST upload {repository}: {response.status} {response.body[:200]}", response.status)
+        return urljoin(self.base_url + url, response.headers["Location"])
+
+    def upload_blob(self, repository: str, digest: str, filename: str, location: str):
+        size = os.path.getsize(filename)
+        scope = self.push_scope(repository)
+        started = time.monotonic()
+        with open(filename, "rb") as fh:
+            offset = 0
+            while offset < size:
+                length = min(self.chunk_size, size - offset)
+                fh.seek(offset)
+                headers = {
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(length),
+                    "Content-Range": f"{offset}-{offset + length - 1}",
+                }
+                body = fh.read(length) if length <= 8 * 1024 * 1024 else BoundedReader(fh, offset, length)
+                response = self.request("PATCH", location, scope, headers, body)
+                if response.status != 202:
+                    raise RegistryError(f"PATCH {repository} at {offset}: {response.status}", response.status)
+                location = urljoin(location, response.headers["Location"])
+                offset += length
+                with self.stats_lock:
+                    self.bytes_uploaded += length
+        separator = "&" if "?" in location else "?"
+        response = self.request("PUT", f"{location}{separator}digest={digest}", scope, {"Content-Length": "0"}, b"")
+        if response.status != 201:
+            raise RegistryError(f"PUT blob {repository}@{digest}: {response.status} {response.body[:200]}")
+        elapsed = time.monotonic() - started
+        log.info(
+            f"Uploaded {digest} ({size} bytes) to {repository} in {elapsed:.2f}s "
+            f"({size / 1024 / 1024 / max(elapsed, 0.001):.1f} MiB/s)"
+        )
+
+    def ensure_blob(self, repository: str, digest: str, filename: str, mount_candidates: list[str]) -> str:
+        """Makes sure repository has the blob: already there, cross-repo mounted, or uploaded. Returns which."""
+        with span("blob", "registry", repository=repository, digest=digest) as s:
+            outcome = self._ensure_blob(repository, digest, filename, mount_candidates)
+            s.set(outcome=outcome)
+            if outcome == "uploaded":
+                s.add_bytes(os.path.getsize(filename))
+            return outcome
+
+    def _ensure_blob(self, repository: str, digest: str, filename: str, mount_candidates: list[str]) -> str:
+        if self.blob_exists(repository, digest):
+            log.info(f"Blob {digest} already in {repository}, skipping upload")
+            return "exists"
+        candidates = [repo for repo in mount_candidates if repo != repository]
+        # a failed mount still opens an upload session (202); use that one rather than trying every candidate
+        location = self.start_upload(repository, digest, candidates[0] if candidates else None)
+        if location is None:
+            return "mounted"
+        self.upload_blob(repository, digest, filename, location)
+        return "uploaded"
+
+    # ---- manifests -----------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def pull_scope(repository: str) -> str:
+        return f"repository:{repository}:pull"
+
+    def manifest_digest(self, repository: str, reference: str) -> str | None:
+        """HEADs a manifest; its digest, or None if the registry does not have it (or denies it exists)."""
+        headers = {"Accept": MANIFEST_ACCEPT}
+        response = self.request("HEAD", f"/v2/{repository}/manifests/{reference}", self.pull_scope(repository), headers)
+        if response.status == 200:
+            return response.headers.get("Docker-Content-Digest", "")
+        if response.status in (401, 403, 404):
+            # ghcr.io and Docker Hub answer "denied" rather than 404 for repositories that don't exist yet
+            log.debug(f"HEAD manifest {repository}:{reference}: {response.status}, treating as missing")
+            return None
+        raise RegistryError(f"HEAD manifest {repository}:{reference}: {response.status}", response.status)
+
+    def list_tags(self, repository: str) -> set[str]:
+        """All tags of a repository (following Link pagination); empty if the repository does not exist."""
+        tags: set[str] = set()
+        url = f"/v2/{repository}/tags/list?n=1000"
+        while url is not None:
+            response = self.request("GET", url, self.pull_scope(repository))
+            if response.status in (401, 403, 404):
+                log.debug(f"GET tags {repository}: {response.status}, treating as no tags")
+                return tags
+            if response.status != 200:
+                raise RegistryError(f"GET tags {repository}: {response.status}", response.status)
+            tags.update(json.loads(response.body).get("tags") or [])
+            link = re.match(r"<([^>]+)>", response.headers.get("Link", ""))
+            url = urljoin(self.base_url, link.group(1)) if link else None
+        return tags
+
+    def put_manifest(self, repository: str, reference: str, media_type: str, body: bytes) -> str:
+        headers = {"Content-Type": media_type, "Content-Length": str(len(body))}
+        with span("put_manifest", "registry", repository=repository, reference=reference) as s:
+            response = self.request(
+                "PUT", f"/v2/{repository}/manifests/{reference}", self.push_scope(repository), headers, body
+            )
+            s.add_bytes(len(body))
+        if response.status != 201:
+            raise RegistryError(f"PUT manifest {repository}:{reference}: {response.status} {response.body[:300]}")
+        digest = response.headers.get("Docker-Content-Digest") or f"sha256:{hashlib.sha256(body).hexdigest()}"
+        log.info(f"Put manifest {repository}:{reference} -> {digest}")
+        return digest
+
+
+class BoundedReader:
+    """File-like view of [offset, offset+length) of fh, so http.client streams a chunk without buffering it all."""
+
+    def __init__(self, fh, offset: int, length: int):
+        self.fh = fh
+        self.offset = offset
+        self.remaining = length
+        self.length = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def seek(self, _pos: int):
+        self.fh.seek(self.offset)
+        self.remaining = self.length
+
+
+clients: dict[str, RegistryClient] = {}
+clients_lock = threading.Lock()
+# digest -> "registry/repository" it was last seen in; lets later pushes mount instead of upload
+known_blob_locations: dict[str, str] = {}
+
+
+def registry_client(registry: str) -> RegistryClient:
+    with clients_lock:
+        if registry not in clients:
+            clients[registry] = RegistryClient(registry)
+        return clients[registry]
+
+
+def refs_exist(oci_refs: list[str]) -> dict[str, bool]:
+    """
+    Checks which of the given refs exist, with pooled keep-alive connections and cached pull tokens.
+    REGISTRY_PROBE_MODE=head (default) HEADs every manifest concurrently; =tags does one tags/list per
+    repository and answers all tag refs of it from that (digest refs are still HEADed).
+    """
+    mode = os.environ.get("REGISTRY_PROBE_MODE", "head")
+    started = time.monotonic()
+    parsed = {oci_ref: parse_reference(oci_ref) for oci_ref in oci_refs}
+
+    def head(oci_ref: str) -> bool:
+        registry, repository, reference = parsed[oci_ref]
+        return registry_client(registry).manifest_digest(repository, reference) is not None
+
+    def tags_of(registry_and_repo: tuple[str, str]) -> set[str]:
+        return registry_client(registry_and_repo[0]).list_tags(registry_and_repo[1])
+
+    with ThreadPoolExecutor(max_workers=int(os.environ.get("REGISTRY_PROBE_WORKERS", "8"))) as tpe:
+        if mode == "tags":
+            repos = sorted({(registry, repository) for registry, repository, _ in parsed.values()})
+            tags_by_repo = dict(zip(repos, tpe.map(tags_of, repos)))
+            by_digest = [oci_ref for oci_ref, (_, _, reference) in parsed.items() if reference.startswith("sha256:")]
+            results = dict(zip(by_digest, tpe.map(head, by_digest)))
+            for oci_ref, (registry, repository, reference) in parsed.items():
+                if oci_ref not in results:
+                    results[oci_ref] = reference in tags_by_repo[(registry, repository)]
+        elif mode == "head":
+            results = dict(zip(oci_refs, tpe.map(head, oci_refs)))
+        else:
+            raise Exception(f"Unknown REGISTRY_PROBE_MODE '{mode}', use 'head' or 'tags'")
+    log.info(f"Probed {len(oci_refs)} refs ({mode}) in {time.monotonic() - started:.3f}s: {results}")
+    return results
+
+
+def put_manifest_tags(oci_ref: str, media_type: str, manifest_bytes: bytes, tags: list[str]) -> str:
+    """PUTs one manifest (or index) under every tag; later tags just re-point at the content the registry has."""
+    registry, repository, _ = parse_reference(f"{oci_ref}:x")
+    client = registry_client(registry)
+    digest = f"sha256:{hashlib.sha256(manifest_bytes).hexdigest()}"
+    for tag in tags:
+        client.put_manifest(repository, tag, media_type, manifest_bytes)
+    return digest
+
+
+def push_oci_layout(layout_dir: str, oci_ref: str, tags: list[str]) -> dict:
+    """
+    Pushes the image tagged tags[0] in an OCI layout to oci_ref (a repository, no tag), then points the
+    remaining tags at the very same manifest. Blobs already present are skipped, known ones are mounted.
+    Returns the pushed manifest's descriptor.
+    """
+    registry, repository, _ = parse_reference(f"{oci_ref}:x")
+    client = registry_client(registry)
+    manifest_desc, manifest_bytes = layout_manifest(layout_dir, tags[0])
+    manifest = json.loads(manifest_bytes)
+    blob_dir = os.path.join(layout_dir, "blobs", "sha256")
+
+    extra_mounts = [repo for repo in os.environ.get("REGISTRY_MOUNT_FROM", "").split(",") if repo]
+
+    def ensure(blob_desc: dict) -> str:
+        digest = blob_desc["digest"]
+        candidates = list(extra_mounts)
+        known = known_blob_locations.get(digest)
+        if known is not None and known.startswith(f"{registry}/"):
+            candidates.insert(0, known.removeprefix(f"{registry}/"))
+        outcome = client.ensure_blob(
+            repository, digest, os.path.join(blob_dir, digest.removeprefix("sha256:")), candidates
+        )
+        known_blob_locations[digest] = f"{registry}/{repository}"
+        return outcome
+
+    blobs = [manifest["config"]] + manifest["layers"]
+    with ThreadPoolExecutor(max_workers=int(os.environ.get("REGISTRY_UPLOAD_WORKERS", "4"))) as tpe:
+        outcomes = list(tpe.map(ensure, blobs))
+    log.info(f"Blobs for {oci_ref}: {dict(zip([blob['digest'] for blob in blobs], outcomes))}")
+
+    put_manifest_tags(oci_ref, manifest["mediaType"], manifest_bytes, tags)
+    return manifest_desc
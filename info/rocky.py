@@ -2,11 +2,15 @@
 import logging
 import os
 import string
-from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
 
 from distro import DistroBaseInfo
 from distro_arch import DistroBaseArchInfo
-from utils import get_url_and_parse_html_hrefs
+from feeds import FeedImage
+from feeds import rocky_feed
+from mirrors import MirrorPool
+from utils import get_first_index_hrefs
 from utils import setup_logging
 
 log: logging.Logger = setup_logging("rocky")
@@ -48,9 +52,16 @@ class Rocky(DistroBaseInfo):
             default_oci_ref_disk="rocky-cloud-container-disk",
             default_oci_ref_kernel="rocky-cloud-kernel-kv",
         )
+        # the vault is not mirrored; releases resolved there are downloaded from it directly
+        candidates = os.environ.get(
+            "ROCKY_MIRRORS",
+            "https://rocky-linux-europe-west4.production.gcp.mirrors.ctrliq.cloud/pub/rocky "
+            "https://rocky-linux-us-west1.production.gcp.mirrors.ctrliq.cloud/pub/rocky",
+        )
+        self.mirrors = MirrorPool("rocky", rocky_mirror, candidates.split())
 
     def set_version_from_arch_versions(self, arch_versions: set[string]) -> string:
-        self.version = "-".join(arch_versions)  # just join all distinct versions, hopefully there is only one
+        self.version = "-".join(sorted(arch_versions))  # just join all distinct versions, hopefully there is only one
         self.oci_tag_version = self.ROCKY_RELEASE + "-" + self.version
         self.oci_tag_latest = self.ROCKY_RELEASE + "-latest"
 
@@ -61,25 +72,34 @@ class RockyArchInfo(DistroBaseArchInfo):
     all_hrefs: list[string]
     qcow2_hrefs: list[string]
 
-    def grab_version(self):
-        indexes_to_try = [
+    def indexes_to_try(self) -> list[string]:
+        return [
             f"{self.distro.ROCKY_MIRROR}/{self.distro.ROCKY_RELEASE}/images/{self.slug}/",
             f"{self.distro.ROCKY_VAULT_MIRROR}/{self.distro.ROCKY_RELEASE}/images/{self.slug}/",
         ]
 
+    def feed_image(self) -> FeedImage | None:
+        # the mirror has current releases only, the vault the older ones: both CHECKSUMs are fetched at once, as
+        # get_first_index_hrefs() does for the index pages, and the first one found wins, in that order
+        indexes_to_try = self.indexes_to_try()
+        with ThreadPoolExecutor(max_workers=len(indexes_to_try)) as tpe:
+            futures = [
+                tpe.submit(rocky_feed, index_url, self.distro.ROCKY_VARIANT, self.slug) for index_url in indexes_to_try
+            ]
+            for index_url, future in zip(indexes_to_try[:-1], futures):
+                try:
+                    return future.result()
+                except URLError as e:
+                    log.info(f"No CHECKSUM in {index_url}: {e}")
+            return futures[-1].result()
+
+    def scrape_version(self):
+        indexes_to_try = self.indexes_to_try()
+
         # Log the indexes
         log.info(f"Trying indexes: {indexes_to_try}")
 
-        for index_url in indexes_to_try:
-            try:
-                self.index_url = index_url
-                self.all_hrefs = get_url_and_parse_html_hrefs(self.index_url)
-                break
-            except HTTPError as e:
-                continue
-
-        if self.index_url is None:
-            raise Exception(f"Could not find valid index for {self.slug}")
+        self.index_url, self.all_hrefs = get_first_index_hrefs(indexes_to_try)
 
         self.qcow2_hrefs = [
             href
@@ -91,14 +111,18 @@ class RockyArchInfo(DistroBaseArchInfo):
         if len(self.qcow2_hrefs) != 1:
             raise Exception(f"Found {len(self.qcow2_hrefs)} qcow2 hrefs for {self.slug}: {self.qcow2_hrefs}")
 
-        self.qcow2_filename = self.qcow2_hrefs[0]
+        # Parse version out of the qcow2_href. very fragile.
+        dash_split = self.qcow2_hrefs[0].split("-")
+        self.version = dash_split[4] + "-" + dash_split[5].replace(f".{self.slug}.qcow2", "")
+        self.set_image(self.index_url, self.qcow2_hrefs[0])
+
+    def set_image(self, index_url: string, filename: string):
+        self.index_url = index_url
+        self.qcow2_filename = filename
         qcow2_basename = os.path.basename(self.qcow2_filename)[: -len(".qcow2")]
         self.vmlinuz_final_filename = f"{qcow2_basename}.vmlinuz"
         self.initramfs_final_filename = f"{qcow2_basename}.initramfs"
 
-        # Parse version out of the qcow2_href. very fragile.
-        dash_split = self.qcow2_filename.split("-")
-        self.version = dash_split[4] + "-" + dash_split[5].replace(f".{self.slug}.qcow2", "")
-
         # full url
-        self.qcow2_url = self.index_url + self.qcow2_filename
+        self.qcow2_url = index_url + self.qcow2_filename
+        self.qcow2_checksum_url = index_url + "CHECKSUM"
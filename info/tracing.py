@@ -0,0 +1,235 @@
+# Pay attention, work step by step, use modern (3.10+) Python syntax and features.
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# utils imports this module, so no setup_logging() here
+log: logging.Logger = logging.getLogger("tracing")
+
+
+class Span:
+    name: str  # what kind of work: "http_get", "download", "mount"; stages are named after the stage
+    category: str  # "stage", "http", "download", "extract", "oci", "registry", ...
+    args: dict  # details: url, device, ref, outcome...
+    start_ns: int
+    end_ns: int | None
+    bytes: int
+    tid: int
+    thread_name: str
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.bytes = 0
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        thread = threading.current_thread()
+        self.tid = thread.ident or 0
+        self.thread_name = thread.name
+
+    def add_bytes(self, nbytes: int):
+        self.bytes += nbytes
+
+    def set(self, **args):
+        self.args.update(args)
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end_ns or time.perf_counter_ns()) - self.start_ns) / 1e9
+
+    @property
+    def throughput(self) -> float | None:
+        # bytes/s, for spans that moved bytes
+        return self.bytes / self.seconds if self.bytes and self.seconds > 0 else None
+
+
+class Tracer:
+    """
+    Collects spans from every thread of the process; export() writes them as a Chrome trace (chrome://tracing,
+    ui.perfetto.dev), a summary JSON, and a markdown table for the GitHub Actions job summary.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans: list[Span] = []
+        self.origin_ns = time.perf_counter_ns()
+        self.origin_wall = time.time()
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        span = Span(name, category, args)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}"[:300])
+            raise
+        finally:
+            span.end_ns = time.perf_counter_ns()
+            with self.lock:
+                self.spans.append(span)
+
+    def finished_spans(self) -> list[Span]:
+        with self.lock:
+            return sorted(self.spans, key=lambda span: span.start_ns)
+
+    def chrome_trace(self) -> dict:
+        events = []
+        threads = {}
+        for span in self.finished_spans():
+            threads[span.tid] = span.thread_name
+            args = dict(span.args)
+            if span.bytes:
+                args["bytes"] = span.bytes
+            if span.throughput is not None:
+                args["MiB/s"] = round(span.throughput / 1024 / 1024, 2)
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": (span.start_ns - self.origin_ns) / 1000,
+                    "dur": (span.end_ns - span.start_ns) / 1000,
+                    "pid": os.getpid(),
+                    "tid": span.tid,
+                    "args": args,
+                }
+            )
+        for tid, thread_name in threads.items():
+            events.append(
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": thread_name}}
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    @staticmethod
+    def stage_bytes(stage: Span, spans: list[Span]) -> int:
+        # a stage moves the bytes of the outermost operations it ran (on its own thread)
+        inside = [
+            span
+            for span in spans
+            if span.category != "stage"
+            and span.tid == stage.tid
+            and stage.start_ns <= span.start_ns
+            and span.end_ns <= stage.end_ns
+        ]
+        outermost = [
+            span
+            for span in inside
+            if not any(
+                other is not span and other.start_ns <= span.start_ns and span.end_ns <= other.end_ns
+                for other in inside
+            )
+        ]
+        return sum(span.bytes for span in outermost)
+
+    def summary(self, label: str) -> dict:
+        spans = self.finished_spans()
+        stages = []
+        for span in spans:
+            if span.category != "stage":
+                continue
+            nbytes = self.stage_bytes(span, spans)
+            stages.append(
+                {
+                    "name": span.name,
+                    "start": round((span.start_ns - self.origin_ns) / 1e9, 3),
+                    "seconds": round(span.seconds, 3),
+                    "bytes": nbytes,
+                    "throughput": nbytes / span.seconds if nbytes and span.seconds > 0 else None,
+                    "error": span.args.get("error"),
+                    **{key: value for key, value in span.args.items() if key in ("resource", "waited")},
+                }
+            )
+        operations: dict[tuple[str, str], dict] = {}
+        for span in spans:
+            if span.category == "stage":
+                continue
+            op = operations.setdefault(
+                (span.category, span.name),
+                {"category": span.category, "name": span.name, "count": 0, "seconds": 0.0, "max_seconds": 0.0},
+            )
+            op["count"] += 1
+            op["seconds"] += span.seconds
+            op["max_seconds"] = max(op["max_seconds"], span.seconds)
+            op["bytes"] = op.get("bytes", 0) + span.bytes
+            op["errors"] = op.get("errors", 0) + (1 if "error" in span.args else 0)
+        for op in operations.values():
+            op["throughput"] = op["bytes"] / op["seconds"] if op["bytes"] and op["seconds"] > 0 else None
+            op["seconds"] = round(op["seconds"], 3)
+            op["max_seconds"] = round(op["max_seconds"], 3)
+        return {
+            "label": label,
+            "started": self.origin_wall,
+            "wall_seconds": round((time.perf_counter_ns() - self.origin_ns) / 1e9, 3),
+            "stages": stages,
+            "operations": sorted(operations.values(), key=lambda op: -op["seconds"]),
+        }
+
+    @staticmethod
+    def markdown(summary: dict) -> str:
+        def size(nbytes):
+            if not nbytes:
+                return ""
+            return f"{nbytes / 1024 / 1024:.1f} MiB" if nbytes >= 1024 * 1024 else f"{nbytes / 1024:.1f} KiB"
+
+        def speed(throughput):
+            return f"{throughput / 1024 / 1024:.1f} MiB/s" if throughput else ""
+
+        lines = [
+            f"### Timings: {summary['label']} ({summary['wall_seconds']:.1f}s)",
+            "",
+            "| Stage | Start | Seconds | Waited | Bytes | Throughput | |",
+            "|---|--:|--:|--:|--:|--:|---|",
+        ]
+        for stage in sorted(summary["stages"], key=lambda stage: -stage["seconds"]):
+            lines.append(
+                f"| {stage['name']} | {stage['start']:.1f} | {stage['seconds']:.1f} | {stage.get('waited', 0):.1f} "
+                f"| {size(stage['bytes'])} | {speed(stage['throughput'])} | {'failed' if stage['error'] else ''} |"
+            )
+        lines += [
+            "",
+            "| Operation | Count | Seconds | Max | Bytes | Throughput | Errors |",
+            "|---|--:|--:|--:|--:|--:|--:|",
+        ]
+        for op in summary["operations"]:
+            lines.append(
+                f"| {op['category']}: {op['name']} | {op['count']} | {op['seconds']:.1f} | {op['max_seconds']:.1f} "
+                f"| {size(op['bytes'])} | {speed(op['throughput'])} | {op['errors'] or ''} |"
+            )
+        return "\n".join(lines) + "\n"
+
+    def export(self, label: str) -> dict | None:
+        """
+        Writes <TRACE_DIR>/<label>.trace.json and <label>.summary.json (TRACE_DIR default "traces", or "off"),
+        and appends the markdown tables to $GITHUB_STEP_SUMMARY when running in GitHub Actions.
+        """
+        trace_dir = os.environ.get("TRACE_DIR", "traces")
+        if trace_dir == "off":
+            return None
+        summary = self.summary(label)
+        os.makedirs(trace_dir, exist_ok=True)
+        with open(os.path.join(trace_dir, f"{label}.trace.json"), "w") as fh:
+            json.dump(self.chrome_trace(), fh)
+        with open(os.path.join(trace_dir, f"{label}.summary.json"), "w") as fh:
+            json.dump(summary, fh, indent=1)
+        log.info(f"Wrote trace and summary of {len(self.spans)} spans to {trace_dir}/{label}.*.json")
+
+        if os.environ.get("GITHUB_STEP_SUMMARY") is not None:
+            with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fh:
+                fh.write(self.markdown(summary))
+        return summary
+
+
+singleton_tracer = Tracer()
+
+
+def tracer() -> Tracer:
+    return singleton_tracer
+
+
+def span(name: str, category: str, **args):
+    """with span("mount", "extract", device=...) as s: ...; s.add_bytes(n) for throughput."""
+    return singleton_tracer.span(name, category, **args)
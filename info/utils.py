@@ -1,20 +1,30 @@
 # Pay attention, work step by step, use modern (3.10+) Python syntax and features.
 
+import codecs
 import glob
 import hashlib
+import html
 import json
 import logging
 import os
-import pickle
+import re
 import string
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from urllib.error import HTTPError
+from urllib.request import Request
 from urllib.request import urlopen
 
-from bs4 import BeautifulSoup
-from github import Github
 from rich.console import Console
 from rich.logging import RichHandler
 
+from assetcatalog import AssetCatalog
+from httpcache import http_get
+from tracing import span
+
 log = logging.getLogger("utils")
 
 singleton_console: Console | None = None
@@ -65,30 +75,6 @@ def shell_all_info(arg_list: list[string]) -> dict[str, str]:
     return {"stdout": utf8_stdout, "stderr": utf8_stderr, "exitcode": result.returncode}
 
 
-def skopeo_inspect_remote_ref(oci_ref):
-    log.debug(f"skopeo_inspect_remote_ref: {oci_ref}")
-    output = shell_all_info(
-        [
-            "docker",
-            "run",
-            "quay.io/skopeo/stable:latest",
-            "inspect",
-            f"docker://{oci_ref}",
-        ]
-    )
-    log.debug(f"skopeo_inspect_remote_ref: {output}")
-    if output["exitcode"] != 0:
-        if (
-            "manifest unknown" in output["stderr"]
-            or "manifest unknown" in output["stdout"]
-            or "Requesting bearer token" in output["stderr"]
-        ):
-            log.debug(f"skopeo_inspect_remote_ref: manifest unknown, returning None")
-            return None
-        raise Exception(f"skopeo_inspect_remote_ref: failed: {output}")
-    return json.loads(output["stdout"])
-
-
 # ‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹‹
 #  SPDX-License-Identifier: GPL-2.0
 #  Copyright (c) 2023 Ricardo Pardini <ricardo@pardini.net>
@@ -97,30 +83,76 @@ def skopeo_inspect_remote_ref(oci_ref):
 class NBDImageMounter:
     nbd_device: string
     image_filename: string
+    partition_num: int | None
 
-    def __init__(self, device_num, image_filename):
+    def __init__(self, device_num, image_filename, partition_num=None):
+        self.device_name = f"nbd{device_num}"
         self.nbd_device = f"/dev/nbd{device_num}"
         self.image_filename = image_filename
+        self.partition_num = partition_num  # the partition to wait for; None: any
 
     def __enter__(self):
-        shell(["udevadm", "settle"])
         log.info(f"Connecting {self.image_filename} to nbd device {self.nbd_device}")
-        shell(
-            [
-                "qemu-nbd",
-                "--read-only",
-                f"--connect={self.nbd_device}",
-                f"{self.image_filename}",
-            ]
-        )
-        shell(["partprobe", f"{self.nbd_device}"])
-        shell(["fdisk", "-l", f"{self.nbd_device}"])
-        shell(["lsblk", "-f", f"{self.nbd_device}"])
+        with span("nbd_connect", "extract", device=self.nbd_device, image=self.image_filename):
+            shell(
+                [
+                    "qemu-nbd",
+                    "--read-only",
+                    f"--connect={self.nbd_device}",
+                    f"{self.image_filename}",
+                ]
+            )
+        try:
+            with span("nbd_partitions", "extract", device=self.nbd_device):
+                self.wait_for_partitions(self.partition_num)
+        except BaseException:
+            self.diagnose()
+            self.disconnect()
+            raise
         return self
 
-    def __exit__(self, *args):
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self.diagnose()
+        self.disconnect()
+
+    def partition_nodes(self) -> list[str]:
+        # partitions the kernel found (sysfs) whose device node udev has already created
+        found = glob.glob(f"/sys/block/{self.device_name}/{self.device_name}p*")
+        return sorted(f"/dev/{os.path.basename(p)}" for p in found if os.path.exists(f"/dev/{os.path.basename(p)}"))
+
+    def wait_for_partitions(self, partition_num: int | None):
+        # qemu-nbd returns once the device is attached and the kernel scans its partition table right away; poll
+        # for the nodes instead of `udevadm settle`, which waits out every udev event on the host. Only if none
+        # show up for a while ask for a rescan.
+        timeout = float(os.environ.get("NBD_PARTITION_TIMEOUT", "30"))
+        started = time.monotonic()
+        wanted = None if partition_num is None else f"{self.nbd_device}p{partition_num}"
+        delay = 0.01
+        rescanned = False
+        while True:
+            nodes = self.partition_nodes()
+            if (wanted is None and nodes) or wanted in nodes:
+                log.info(f"{self.nbd_device} partitions ready after {time.monotonic() - started:.2f}s: {nodes}")
+                return
+            elapsed = time.monotonic() - started
+            if elapsed > timeout:
+                raise Exception(f"{wanted or 'No partition'} of {self.nbd_device} after {timeout:.0f}s: {nodes}")
+            if not rescanned and elapsed > min(2.0, timeout / 2):
+                shell(["partprobe", f"{self.nbd_device}"])
+                rescanned = True
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    def diagnose(self):
+        for arg_list in (["fdisk", "-l", f"{self.nbd_device}"], ["lsblk", "-f", f"{self.nbd_device}"]):
+            result = shell_all_info(arg_list)
+            log.warning(f"{' '.join(arg_list)} (exit {result['exitcode']}):\n{result['stdout']}{result['stderr']}")
+
+    def disconnect(self):
         log.info(f"Disconnecting {self.nbd_device}")
-        shell(["qemu-nbd", "--disconnect", f"{self.nbd_device}"])
+        with span("nbd_disconnect", "extract", device=self.nbd_device):
+            shell(["qemu-nbd", "--disconnect", f"{self.nbd_device}"])
 
 
 class DevicePathMounter:
@@ -136,12 +168,14 @@ class DevicePathMounter:
     def __enter__(self):
         log.info(f"Mounting {self.device_path}p{self.partition_num} to {self.mountpoint}")
         shell(["mkdir", "-p", f"{self.mountpoint}"])
-        shell([f"mount", f"{self.device_path}p{self.partition_num}", f"{self.mountpoint}"])
+        with span("mount", "extract", device=f"{self.device_path}p{self.partition_num}"):
+            shell([f"mount", f"{self.device_path}p{self.partition_num}", f"{self.mountpoint}"])
         return self
 
     def __exit__(self, *args):
         log.info(f"Unmounting {self.mountpoint}")
-        shell([f"umount", f"{self.mountpoint}"])
+        with span("umount", "extract", device=f"{self.device_path}p{self.partition_num}"):
+            shell([f"umount", f"{self.mountpoint}"])
         log.info(f"Removing {self.mountpoint}")
         shell(["rmdir", f"{self.mountpoint}"])
 
@@ -176,21 +210,128 @@ class DevicePathMounter:
         return result
 
 
-def get_url_and_parse_html_hrefs(index_url):
-    with urlopen(index_url) as response:
-        # Use beautifulsoup4 to parse the HTML.
-        soup = BeautifulSoup(response, "html.parser")
-        # Find all the hrefs.
-        hrefs = soup.find_all("a")
-        # Loop over the hrefs and print them out.
-        links = []
-        for href in hrefs:
-            href_value = href.get("href")
-            # skip empty hrefs
-            if href_value is None:
+# An <a ...> start tag's href, quoted either way or bare. The leading \s keeps data-href= and friends out.
+HREF_RE = re.compile(r"""<a\s[^>]*?(?<=\s)href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+HREF_CHUNK_SIZE = 64 * 1024
+
+
+class HrefExtractor:
+    """
+    Collects <a href> values from HTML fed in chunks, without building a tree. Text after the last "<" of a
+    chunk is held back until the next one (a tag may be split across chunks); "<!-- -->" comments are skipped.
+    Values are entity-decoded, as an HTML parser would.
+    """
+
+    def __init__(self):
+        self.pending = ""
+        self.in_comment = False
+
+    def feed(self, text: str) -> list[str]:
+        text = self.pending + text
+        self.pending = ""
+        hrefs = []
+        pos = 0
+        while pos < len(text):
+            if self.in_comment:
+                end = text.find("-->", pos)
+                if end < 0:
+                    self.pending = text[max(pos, len(text) - 2) :]
+                    return hrefs
+                self.in_comment = False
+                pos = end + 3
+            comment = text.find("<!--", pos)
+            segment_end = len(text) if comment < 0 else comment
+            last_lt = text.rfind("<", pos, segment_end)
+            if comment < 0 and last_lt >= 0 and text.find(">", last_lt) < 0:
+                segment_end = last_lt  # unfinished tag: keep it for the next chunk
+            hrefs.extend(self._hrefs_in(text[pos:segment_end]))
+            if comment < 0:
+                self.pending = text[segment_end:]
+                return hrefs
+            self.in_comment = True
+            pos = comment + 4
+        return hrefs
+
+    def close(self) -> list[str]:
+        text, self.pending = self.pending, ""
+        return [] if self.in_comment else self._hrefs_in(text)
+
+    @staticmethod
+    def _hrefs_in(text: str) -> list[str]:
+        return [
+            html.unescape(next(group for group in match.groups() if group is not None))
+            for match in HREF_RE.finditer(text)
+        ]
+
+
+def iter_hrefs(document: bytes, chunk_size: int = HREF_CHUNK_SIZE):
+    """Yields hrefs of an already fetched document in order, parsing only as far as the consumer reads."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    extractor = HrefExtractor()
+    for offset in range(0, len(document), chunk_size):
+        yield from extractor.feed(decoder.decode(document[offset : offset + chunk_size]))
+    yield from extractor.feed(decoder.decode(b"", final=True))
+    yield from extractor.close()
+
+
+def get_url_and_parse_html_hrefs(index_url, stop: Callable[[str], bool] | None = None) -> list[str]:
+    # Pooled, coalesced, and revalidated against the on-disk cache; raises HTTPError like urlopen did.
+    # The body is always fetched whole (the cache memoizes, shares and stores whole bodies); only parsing is
+    # incremental. With stop, parsing ends at (and includes) the first href it accepts, which saves CPU, not
+    # bytes on the wire; only safe if the listing's order is known.
+    links = []
+    for href in iter_hrefs(http_get(index_url)):
+        links.append(href)
+        if stop is not None and stop(href):
+            break
+    return links
+
+
+def get_first_index_hrefs(indexes_to_try: list[str]) -> tuple[str, list[str]]:
+    """
+    Fetches every candidate index concurrently and returns (index_url, hrefs) of the first one, in the given
+    order of preference, that did not fail with an HTTPError; so a vault fallback costs no extra round trip.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(indexes_to_try))) as tpe:
+        futures = [tpe.submit(get_url_and_parse_html_hrefs, index_url) for index_url in indexes_to_try]
+        for index_url, future in zip(indexes_to_try, futures):
+            try:
+                return index_url, future.result()
+            except HTTPError as e:
+                log.debug(f"Index {index_url} failed: {e}")
+    raise Exception(f"Could not find a valid index among {indexes_to_try}")
+
+
+def parse_checksum_file(text: string) -> dict[str, tuple[str, str]]:
+    # Parses both GNU coreutils ("<hex>  <name>" / "<hex> *<name>") and BSD ("SHA256 (<name>) = <hex>") style
+    # checksum files, as published by Ubuntu (SHA256SUMS), Debian (SHA512SUMS), Fedora and Rocky (CHECKSUM).
+    # Returns {basename: (hashlib algo, hexdigest)}.
+    algo_by_hex_length = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+    checksums = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line == "" or line.startswith("#") or line.startswith("-----"):
+            continue
+        if " (" in line and ") = " in line:
+            algo, rest = line.split(" (", 1)
+            name, hex_digest = rest.rsplit(") = ", 1)
+            algo = algo.strip().lower().replace("-", "")
+        else:
+            parts = line.split(None, 1)
+            if len(parts) != 2:
                 continue
-            links.append(href_value)
-        return links
+            hex_digest, name = parts
+            algo = algo_by_hex_length.get(len(hex_digest))
+            name = name.lstrip("*")
+        if algo is None or not all(c in "0123456789abcdefABCDEF" for c in hex_digest):
+            continue
+        checksums[os.path.basename(name.strip())] = (algo, hex_digest.lower())
+    return checksums
+
+
+def fetch_checksum_file(checksum_url: string) -> dict[str, tuple[str, str]]:
+    log.info(f"Fetching checksums from {checksum_url}")
+    return parse_checksum_file(http_get(checksum_url).decode("utf-8", errors="replace"))
 
 
 def global_console() -> Console:
@@ -221,15 +362,68 @@ def setup_logging(name: string) -> logging.Logger:
     return logging.getLogger(name)
 
 
+# Release assets already loaded by this process, so concurrent distros (matrix runs) fetch each release once.
+release_assets_memo: dict[str, object] = {}
+release_assets_locks: dict[str, threading.Lock] = {}
+release_assets_locks_lock = threading.Lock()
+
+
+class GitHubReleaseAsset:
+    # only what the distros use; same attribute names as PyGithub's GitReleaseAsset
+    def __init__(self, name: str, browser_download_url: str, size: int, digest: str | None):
+        self.name = name
+        self.browser_download_url = browser_download_url
+        self.size = size
+        self.digest = digest
+
+    def __repr__(self):
+        return f"GitHubReleaseAsset({self.name})"
+
+
+class GitHubRelease:
+    def __init__(self, tag_name: str, assets: list[GitHubReleaseAsset]):
+        self.tag_name = tag_name
+        self.assets = assets
+        self._catalog: AssetCatalog | None = None
+        self._catalog_lock = threading.Lock()
+
+    @property
+    def catalog(self) -> AssetCatalog:
+        # built on first use and shared by every arch/matrix entry looking at this (memoized) release
+        with self._catalog_lock:
+            if self._catalog is None:
+                self._catalog = AssetCatalog(self.assets)
+            return self._catalog
+
+    def to_json(self) -> dict:
+        return {"tag_name": self.tag_name, "assets": [vars(asset) for asset in self.assets]}
+
+    @staticmethod
+    def from_json(obj: dict) -> "GitHubRelease":
+        return GitHubRelease(obj["tag_name"], [GitHubReleaseAsset(**asset) for asset in obj["assets"]])
+
+
+class GitHubRateLimited(Exception):
+    pass
+
+
 # Getting assets from GitHub releases
 class GitHubReleaseReleaseAssets:
+    """
+    Assets of one release (the newest one if release_tag is None, GitHub's "latest" if it is "latest") via the
+    REST API at GITHUB_API_URL. Cached as compact JSON in cache/; within GITHUB_ASSETS_TTL seconds (default 600)
+    the cache is used as is, after that it is revalidated with If-None-Match (a 304 does not count against the
+    rate limit). Rate-limited requests wait for the reset (up to GITHUB_RATELIMIT_MAX_WAIT seconds), and fall
+    back to a stale cache if there is one.
+    """
+
     release_tag: str | None = None
 
     def __init__(self, github_org_repo: string, release_tag: str = None):
         self.github_org_repo = github_org_repo
         self.release_tag = release_tag
+        self.api_url = os.environ.get("GITHUB_API_URL", "https://api.github.com").rstrip("/")
 
-    # cache (with pickle) for self.fetch_release_assets
     def get_release_assets(self):
         # get an MD5 hash (32-char string) of the inputs
         inputs_hash = {
@@ -238,56 +432,141 @@ class GitHubReleaseReleaseAssets:
         }
         input_md5 = hashlib.md5(json.dumps(inputs_hash, sort_keys=True).encode()).hexdigest()
 
+        with release_assets_locks_lock:
+            lock = release_assets_locks.setdefault(input_md5, threading.Lock())
+        with lock:
+            if input_md5 not in release_assets_memo:
+                release_assets_memo[input_md5] = self.get_release_assets_cached(input_md5)
+            return release_assets_memo[input_md5]
+
+    def get_release_assets_cached(self, input_md5: str):
         # ensure "cache" directory exists in current working directory, otherwise create it
         cache_dir = "cache"
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-
-        # check if the cache file exists; if not, fetch the release assets and pickle them
-        cache_file_pickle = os.path.join(cache_dir, f"gh_release_assets_{input_md5}.pkl")
-        if os.path.exists(cache_file_pickle):
-            # read from pickle cache file
-            log.info(f"Cache file {cache_file_pickle} exists, loading cached release assets...")
-            with open(cache_file_pickle, "rb") as fh:
-                cached_values = pickle.load(fh)
-            log.info(f"Loaded cached release assets from {cache_file_pickle}")
-            return cached_values
-
-        log.warning(f"Cache file {cache_file_pickle} does not exist, fetching release assets...")
-        fetched_values = self.fetch_release_assets()
-
-        # pickle the assets to the cache file
-        with open(cache_file_pickle, "wb") as fh:
-            pickle.dump(fetched_values, fh)
-        log.info(f"Cached release assets to {cache_file_pickle}")
-        return fetched_values
-
-    def fetch_release_assets(self):
-        github = Github()
-        if os.environ.get("GITHUB_TOKEN", "") != "":
-            log.info("Using GITHUB_TOKEN from environment!")
-            github = Github(os.environ.get("GITHUB_TOKEN"))
-        else:
-            log.warning("GITHUB_TOKEN not set in environment, will use anonymous API calls (lower rate limits)!")
-
-        log.info(f"Fetching GitHub repo info for {self.github_org_repo}")
-        repo = github.get_repo(self.github_org_repo)
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_file = os.path.join(cache_dir, f"gh_release_assets_{input_md5}.json")
+        ttl = int(os.environ.get("GITHUB_ASSETS_TTL", "600"))
+
+        cached = None
+        if os.path.exists(cache_file):
+            with open(cache_file) as fh:
+                cached = json.load(fh)
+            age = time.time() - cached["fetched"]
+            if age < ttl:
+                log.info(f"Using cached release assets from {cache_file} ({age:.0f}s old)")
+                return self.as_result(cached["release"])
+
+        try:
+            etag, release = self.fetch_release(None if cached is None else cached.get("etag"))
+        except GitHubRateLimited as e:
+            if cached is None:
+                raise
+            log.warning(f"{e}; using stale cached release assets from {cache_file}")
+            return self.as_result(cached["release"])
+
+        if release is None:  # 304: the cached copy is still current
+            log.info(f"Cached release assets in {cache_file} are still current (304)")
+            release = cached["release"]
+        cached = {"fetched": time.time(), "etag": etag, "release": release}
+        with open(f"{cache_file}.tmp", "w") as fh:
+            json.dump(cached, fh, separators=(",", ":"))
+        os.replace(f"{cache_file}.tmp", cache_file)
+        return self.as_result(release)
+
+    @staticmethod
+    def as_result(release: dict | None):
+        if release is None:
+            log.warning(f"No GH releases found.")
+            return None
+        repo_release = GitHubRelease.from_json(release)
+        return {"assets": repo_release.assets, "repo_release": repo_release}
 
+    def fetch_release(self, etag: str | None) -> tuple[str | None, dict | None]:
+        """Returns (etag, compact release or None if there is no release), or (etag, None) on a 304."""
+        repo_url = f"{self.api_url}/repos/{self.github_org_repo}"
+        if os.environ.get("GITHUB_TOKEN", "") == "":
+            log.warning("GITHUB_TOKEN not set in environment, will use anonymous API calls (lower rate limits)!")
         if self.release_tag is None:
-            log.info(f"Fetching first page of Release Assets for {self.github_org_repo}")
-            repo_releases = repo.get_releases().get_page(0)
+            log.info(f"Fetching newest release of {self.github_org_repo}")
+            url = f"{repo_url}/releases?per_page=1"
+        elif self.release_tag == "latest":
+            log.info(f"Fetching latest release of {self.github_org_repo}")
+            url = f"{repo_url}/releases/latest"
         else:
-            log.info(f"Fetching Release Assets for {self.github_org_repo} with tag {self.release_tag}")
-            repo_releases = [repo.get_release(self.release_tag)]
-
-        log.debug(f"repo_releases: {repo_releases}")
-        for repo_release in repo_releases:
-            log.debug(f"Trying repo_release '{repo_release.tag_name}' ")
-            # get all pages of assets for this release - expensive API call rate-limit wise
-            repo_release_assets_paged = repo_release.get_assets()
-            repo_release_assets = list(repo_release_assets_paged)
-            log.debug(f"repo_release_assets: {repo_release_assets}")
-            return {"assets": repo_release_assets, "repo_release": repo_release}
-
-        log.warning(f"No GH releases found.")
+            log.info(f"Fetching release {self.release_tag} of {self.github_org_repo}")
+            url = f"{repo_url}/releases/tags/{self.release_tag}"
+
+        status, new_etag, body = self.api_get(url, etag)
+        if status == 304:
+            return etag, None
+        release = (body[0] if body else None) if isinstance(body, list) else body
+        if release is None:
+            return new_etag, None
+
+        assets = release.get("assets", [])
+        if len(assets) >= 100:  # the embedded list may be cut short; page through all of them, 100 at a time
+            assets = []
+            page = 1
+            while True:
+                _, _, page_assets = self.api_get(f"{repo_url}/releases/{release['id']}/assets?per_page=100&page={page}")
+                assets.extend(page_assets)
+                if len(page_assets) < 100:
+                    break
+                page += 1
+        compact = {
+            "tag_name": release["tag_name"],
+            "assets": [
+                {
+                    "name": asset["name"],
+                    "browser_download_url": asset["browser_download_url"],
+                    "size": asset.get("size", 0),
+                    "digest": asset.get("digest"),
+                }
+                for asset in assets
+            ],
+        }
+        log.info(f"Release {compact['tag_name']} of {self.github_org_repo} has {len(compact['assets'])} assets")
+        return new_etag, compact
+
+    def api_get(self, url: str, etag: str | None = None) -> tuple[int, str | None, object]:
+        headers = {"Accept": "application/vnd.github+json", "User-Agent": "cloud-container-disk"}
+        if os.environ.get("GITHUB_TOKEN", "") != "":
+            headers["Authorization"] = f"Bearer {os.environ['GITHUB_TOKEN']}"
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        max_wait = int(os.environ.get("GITHUB_RATELIMIT_MAX_WAIT", "300"))
+        waited = 0.0
+        while True:
+            try:
+                with (
+                    span("github_api", "http", url=url) as s,
+                    urlopen(Request(url, headers=headers), timeout=60) as response,
+                ):
+                    body = response.read()
+                    s.add_bytes(len(body))
+                    return response.status, response.headers.get("ETag"), json.loads(body)
+            except HTTPError as e:
+                if e.code == 304:
+                    return 304, etag, None
+                if e.code not in (403, 429):
+                    raise
+                # primary limit: X-RateLimit-Remaining 0 until X-RateLimit-Reset; secondary: Retry-After
+                if e.headers.get("Retry-After") is not None:
+                    wait = float(e.headers["Retry-After"])
+                elif e.headers.get("X-RateLimit-Remaining") == "0":
+                    wait = max(1.0, float(e.headers.get("X-RateLimit-Reset", "0")) - time.time())
+                else:
+                    raise
+                if waited + wait > max_wait:
+                    raise GitHubRateLimited(f"GitHub API rate limited for {wait:.0f}s more, fetching {url}")
+                log.warning(f"GitHub API rate limited, waiting {wait:.0f}s before retrying {url}")
+                time.sleep(wait)
+                waited += wait
+
+
+def gh_asset_digest(repo_release_asset) -> tuple[str, str] | None:
+    # GitHub publishes "digest": "sha256:<hex>" for release assets (not for older uploads)
+    digest = repo_release_asset.digest
+    if digest is None or ":" not in digest:
         return None
+    algo, hex_digest = digest.split(":", 1)
+    return algo, hex_digest